@@ -8,11 +8,15 @@ BT-Panel 混合安全检测脚本
 import json
 import os
 import zipfile
+import shutil
 import sys
 import hashlib
 import re
 from datetime import datetime
 from ai_analyzer import AIAnalyzer
+from report_index import ReportIndex
+from report_store import save_report
+from panel_sync import write_tree_manifest
 
 # 加载配置
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
@@ -139,6 +143,46 @@ MALICIOUS_PATTERNS = {
     ]
 }
 
+# AI分析优先级权重（按静态检测命中的类别累加）
+AI_PRIORITY_WEIGHTS = {
+    'backdoor_critical': 100,
+    'obfuscation_critical': 50,
+    'dangerous_functions': 40,
+    'sql_injection_risk': 40,
+    'data_leak': 30,
+    'suspicious_domain': 20,
+    'privilege_escalation': 20,
+    'tracking_ads': 10,
+}
+
+# 路径包含这些关键字的文件额外加分
+AI_PRIORITY_KEYWORDS = ['ajax', 'api', 'auth', 'login', 'admin', 'plugin']
+
+def prioritize_files_for_ai(files_info, static_findings):
+    """
+    根据静态检测结果为AI分析排定文件优先级
+    
+    Returns:
+        [(文件路径, 代码样本)]，按优先级从高到低排序
+    """
+    scores = {}
+    for category, items in static_findings.items():
+        weight = AI_PRIORITY_WEIGHTS.get(category, 1)
+        for item in items:
+            scores[item['file']] = scores.get(item['file'], 0) + weight
+    
+    candidates = []
+    for file_data in files_info:
+        file_path = file_data['path']
+        score = scores.get(file_path, 0)
+        if any(keyword in file_path.lower() for keyword in AI_PRIORITY_KEYWORDS):
+            score += 5
+        if score > 0:
+            candidates.append((score, file_path, file_data['content'][:5000]))  # 只取前5000字符
+    
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    return [(file_path, content) for _, file_path, content in candidates]
+
 def calculate_md5(file_path):
     """计算文件MD5"""
     md5_hash = hashlib.md5()
@@ -188,19 +232,25 @@ def basic_security_check(zip_path):
     
     return checks
 
-def extract_and_analyze_files(zip_path, extract_dir):
+def extract_and_analyze_files(zip_path, extract_dir, package_md5=None):
     """解压并深度分析所有文件（超严格模式 - 排除误报）"""
     print("\n" + "=" * 60)
     print("📦 解压并收集文件信息")
     print("=" * 60)
     
     try:
-        # 解压文件
+        # 解压文件（先清空旧目录，保证目录内容与升级包完全一致）
         print("正在解压文件...")
+        if os.path.isdir(extract_dir):
+            shutil.rmtree(extract_dir)
         with zipfile.ZipFile(zip_path, 'r') as zip_ref:
             zip_ref.extractall(extract_dir)
         print(f"✅ 解压完成: {extract_dir}")
         
+        # 记录扫描时的文件清单，升级时核对后直接复用此目录
+        if package_md5:
+            write_tree_manifest(extract_dir, package_md5)
+        
         # 收集所有文件信息
         all_files = []
         files_to_check = []
@@ -649,7 +699,7 @@ def main():
     basic_check = basic_security_check(file_path)
     
     # 解压并收集文件
-    files_info = extract_and_analyze_files(file_path, extract_dir)
+    files_info = extract_and_analyze_files(file_path, extract_dir, md5)
     
     # 静态安全分析
     static_result = static_code_analysis(files_info, version)
@@ -665,28 +715,31 @@ def main():
         try:
             analyzer = AIAnalyzer()
             
-            # 选择高风险文件进行AI分析
-            high_risk_files = []
-            for file_data in files_info:
-                file_path = file_data['path']
-                if any(keyword in file_path.lower() for keyword in ['ajax', 'api', 'auth', 'login', 'admin', 'plugin']):
-                    high_risk_files.append({
-                        'path': file_path,
-                        'content': file_data['content'][:5000]  # 只取前5000字符
-                    })
+            # 按静态检测结果排定优先级，在token/费用预算内选择尽可能多的文件
+            high_risk_files = prioritize_files_for_ai(files_info, static_result['findings'])
             
             if high_risk_files:
-                # 限制分析数量
-                files_to_analyze = high_risk_files[:5]  # 只分析前5个高风险文件
+                files_to_analyze, budget_skipped = analyzer.plan_files(high_risk_files)
                 print(f"📋 选择 {len(files_to_analyze)} 个高风险文件进行AI分析...")
+                if budget_skipped:
+                    print(f"💰 {budget_skipped} 个文件超出预算，本次跳过")
+                
+                # 先分诊（流式输出时只取评分和风险等级），低风险且达到分诊升级分数的文件不再完整分析
+                triage_first = ai_config.get('triage_first', False)
+                triaged_files = 0
                 
                 ai_results = []
-                for i, file_data in enumerate(files_to_analyze, 1):
+                for i, (path, content) in enumerate(files_to_analyze, 1):
                     try:
-                        print(f"🔍 分析 {i}/{len(files_to_analyze)}: {file_data['path'][:50]}...")
-                        result = analyzer.analyze_code(file_data['content'], file_data['path'])
+                        print(f"🔍 分析 {i}/{len(files_to_analyze)}: {path[:50]}...")
+                        if triage_first:
+                            result, triage_only = analyzer.analyze_with_triage(content, path)
+                            if triage_only:
+                                triaged_files += 1
+                        else:
+                            result = analyzer.analyze_code(content, path)
                         if result:
-                            result['file'] = file_data['path']
+                            result['file'] = path
                             ai_results.append(result)
                     except Exception as e:
                         print(f"   ⚠️  跳过: {e}")
@@ -706,13 +759,18 @@ def main():
                         'total_findings': len(all_findings),
                         'findings': all_findings[:20],  # 只保留前20个发现
                         'recommendations': ai_results[0].get('recommendations', [])[:5],  # 前5条建议
-                        'overall_safe': avg_score >= 70
+                        'overall_safe': avg_score >= 70,
+                        'candidate_files': len(high_risk_files),
+                        'triaged_files': triaged_files,
+                        'budget_skipped': budget_skipped,
+                        'usage': analyzer.budget.summary()
                     }
                     
                     print(f"✅ AI分析完成")
                     print(f"   使用模型: {ai_result['provider']}")
                     print(f"   平均评分: {ai_result['average_score']}/100")
                     print(f"   发现问题: {ai_result['total_findings']}个")
+                    print(f"   Token用量: {ai_result['usage']['total_tokens']} (费用约 {ai_result['usage']['total_cost']})")
                 else:
                     print("⚠️  AI分析未返回结果")
             else:
@@ -737,12 +795,18 @@ def main():
         'files_analyzed': len(files_info)
     }
     
-    result_file = os.path.join(download_dir, f'security_report_{version}.json')
-    with open(result_file, 'w', encoding='utf-8') as f:
-        json.dump(final_result, f, indent=4, ensure_ascii=False)
+    # 报告摘要和检测明细分开保存，读取评分时只需加载摘要
+    compression = config.get('report_storage', {}).get('findings_compression', 'gzip')
+    result_file = save_report(download_dir, final_result, compression)
     
     print(f"\n✅ 完整检测报告已保存: {result_file}")
     
+    # 更新报告索引（统计分析直接读取索引）
+    try:
+        ReportIndex(download_dir).index_report(result_file, final_result)
+    except Exception as e:
+        print(f"⚠️  更新报告索引失败: {e}")
+    
     # 判断是否安全
     if static_result.get('is_safe', False) and static_result.get('security_score', 0) >= config['security_threshold']:
         print(f"\n🎉 安全检测通过！(评分: {static_result.get('security_score')}/100)")
@@ -5,13 +5,147 @@ BT-Panel 检测报告生成脚本
 功能：生成Markdown格式的安全检测报告
 """
 
-import json
+import io
+import gzip
+import html
 import os
 import sys
+import shutil
 from datetime import datetime
+from report_store import load_report
 
-def generate_markdown_report(result_data):
-    """生成详细的Markdown格式检测报告"""
+# 分类名称和说明
+CATEGORY_INFO = {
+    'backdoor_critical': {
+        'name': '🚨 高危后门特征',
+        'severity': '严重',
+        'desc': 'eval($var)、assert($var)等动态代码执行，可能被利用执行任意代码'
+    },
+    'command_execution': {
+        'name': '🔧 系统命令执行',
+        'severity': '正常',
+        'desc': '管理面板需要执行系统命令来管理服务器，这是正常功能'
+    },
+    'remote_connection': {
+        'name': '🌐 远程连接',
+        'severity': '正常',
+        'desc': '管理面板需要建立网络连接进行更新、插件下载等，这是正常功能'
+    },
+    'obfuscation_critical': {
+        'name': '🔒 代码混淆/加密',
+        'severity': '中等',
+        'desc': 'Base64长字符串解码、gzinflate等，可能用于隐藏恶意代码'
+    },
+    'tracking_ads': {
+        'name': '📊 广告/统计追踪',
+        'severity': '严重',
+        'desc': '向bt.cn、io.bt.sb等域名发送统计数据，可能泄露用户隐私'
+    },
+    'data_leak': {
+        'name': '🔐 敏感数据泄露',
+        'severity': '严重',
+        'desc': '密码、Token等敏感数据通过HTTP传输，存在泄露风险'
+    },
+    'suspicious_domain': {
+        'name': '🌍 可疑域名/IP',
+        'severity': '中等',
+        'desc': '直接通过IP地址或可疑域名进行HTTP请求'
+    },
+    'file_transfer': {
+        'name': '📤 文件传输',
+        'severity': '正常',
+        'desc': '管理面板需要下载/上传文件，这是正常功能'
+    },
+    'sql_injection_risk': {
+        'name': '🗄️ SQL注入风险',
+        'severity': '严重',
+        'desc': '直接将用户输入($_GET/$_POST)拼接到SQL查询，存在注入风险'
+    },
+    'privilege_escalation': {
+        'name': '🔓 权限提升',
+        'severity': '中等',
+        'desc': 'chmod 777、sudo等权限操作，可能存在权限滥用风险'
+    },
+    'dangerous_functions': {
+        'name': '💀 危险函数',
+        'severity': '严重',
+        'desc': 'unserialize($_GET)、extract($_POST)等，可能导致代码执行'
+    }
+}
+
+# 按严重程度排序显示
+PRIORITY_ORDER = [
+    'backdoor_critical',
+    'obfuscation_critical', 
+    'sql_injection_risk',
+    'dangerous_functions',
+    'tracking_ads',
+    'data_leak',
+    'privilege_escalation',
+    'suspicious_domain',
+    'file_transfer',
+    'remote_connection',
+    'command_execution'
+]
+
+# 单个分类在主报告中最多内联的条目数，超出部分分页写入独立文件
+INLINE_FINDINGS_LIMIT = 200
+
+# 分类分页文件每页条目数
+FINDINGS_PAGE_SIZE = 1000
+
+def _write_finding(out, index, item):
+    """写入一条检测结果"""
+    out.write(f"{index}. **{item['file']}** (匹配{item['matches']}处)\n")
+    out.write(f"   - 匹配规则: `{item['pattern']}`\n")
+    
+    # 显示代码样本
+    samples = item.get('samples')
+    if samples:
+        out.write("   - 样本: " + ", ".join(f"`{sample}`" for sample in samples[:2]) + "\n")
+    out.write("\n")
+
+def _write_category_pages(version, category, items, pages_dir):
+    """
+    将分类的全部条目分页写入独立文件
+    
+    Returns:
+        分页文件名列表（相对 pages_dir）
+    """
+    os.makedirs(pages_dir, exist_ok=True)
+    info = CATEGORY_INFO.get(category, {})
+    total_pages = (len(items) + FINDINGS_PAGE_SIZE - 1) // FINDINGS_PAGE_SIZE
+    page_names = [f"{category}_{page}.md" for page in range(1, total_pages + 1)]
+    
+    for page, page_name in enumerate(page_names, 1):
+        start = (page - 1) * FINDINGS_PAGE_SIZE
+        end = min(start + FINDINGS_PAGE_SIZE, len(items))
+        
+        nav = [f"[返回报告](../SECURITY_REPORT_{version}.md)"]
+        if page > 1:
+            nav.append(f"[上一页]({page_names[page - 2]})")
+        if page < total_pages:
+            nav.append(f"[下一页]({page_names[page]})")
+        
+        with open(os.path.join(pages_dir, page_name), 'w', encoding='utf-8') as out:
+            out.write(f"# {info.get('name', category)} - BT-Panel {version}\n\n")
+            out.write(f"第 {page}/{total_pages} 页，条目 {start + 1}-{end}（共 {len(items)} 处）\n\n")
+            out.write(" | ".join(nav) + "\n\n---\n\n")
+            for i in range(start, end):
+                _write_finding(out, i + 1, items[i])
+            out.write("---\n\n" + " | ".join(nav) + "\n")
+    
+    return page_names
+
+def write_markdown_report(result_data, out, pages_dir=None):
+    """
+    将详细的Markdown格式检测报告逐段写入 out
+    
+    Args:
+        result_data: 检测结果（含检测明细）
+        out: 可写的文本文件对象
+        pages_dir: 分类分页目录；为None时所有条目都写入主报告
+    """
     version = result_data['version']
     md5 = result_data['md5']
     basic_check = result_data.get('basic_check', {})
@@ -20,67 +154,8 @@ def generate_markdown_report(result_data):
     category_stats = static_analysis.get('category_stats', {})
     findings = static_analysis.get('findings', {})
     
-    # 分类名称和说明
-    category_info = {
-        'backdoor_critical': {
-            'name': '🚨 高危后门特征',
-            'severity': '严重',
-            'desc': 'eval($var)、assert($var)等动态代码执行，可能被利用执行任意代码'
-        },
-        'command_execution': {
-            'name': '🔧 系统命令执行',
-            'severity': '正常',
-            'desc': '管理面板需要执行系统命令来管理服务器，这是正常功能'
-        },
-        'remote_connection': {
-            'name': '🌐 远程连接',
-            'severity': '正常',
-            'desc': '管理面板需要建立网络连接进行更新、插件下载等，这是正常功能'
-        },
-        'obfuscation_critical': {
-            'name': '🔒 代码混淆/加密',
-            'severity': '中等',
-            'desc': 'Base64长字符串解码、gzinflate等，可能用于隐藏恶意代码'
-        },
-        'tracking_ads': {
-            'name': '📊 广告/统计追踪',
-            'severity': '严重',
-            'desc': '向bt.cn、io.bt.sb等域名发送统计数据，可能泄露用户隐私'
-        },
-        'data_leak': {
-            'name': '🔐 敏感数据泄露',
-            'severity': '严重',
-            'desc': '密码、Token等敏感数据通过HTTP传输，存在泄露风险'
-        },
-        'suspicious_domain': {
-            'name': '🌍 可疑域名/IP',
-            'severity': '中等',
-            'desc': '直接通过IP地址或可疑域名进行HTTP请求'
-        },
-        'file_transfer': {
-            'name': '📤 文件传输',
-            'severity': '正常',
-            'desc': '管理面板需要下载/上传文件，这是正常功能'
-        },
-        'sql_injection_risk': {
-            'name': '🗄️ SQL注入风险',
-            'severity': '严重',
-            'desc': '直接将用户输入($_GET/$_POST)拼接到SQL查询，存在注入风险'
-        },
-        'privilege_escalation': {
-            'name': '🔓 权限提升',
-            'severity': '中等',
-            'desc': 'chmod 777、sudo等权限操作，可能存在权限滥用风险'
-        },
-        'dangerous_functions': {
-            'name': '💀 危险函数',
-            'severity': '严重',
-            'desc': 'unserialize($_GET)、extract($_POST)等，可能导致代码执行'
-        }
-    }
-    
     # 生成报告
-    report = f"""# 🔍 BT-Panel {version} 安全检测报告（详细版）
+    out.write(f"""# 🔍 BT-Panel {version} 安全检测报告（详细版）
 
 > **检测时间**: {result_data.get('check_time', 'N/A')}  
 > **检测版本**: Linux Panel {version}  
@@ -105,11 +180,11 @@ def generate_markdown_report(result_data):
 
 ## 🤖 AI深度分析
 
-"""
+""")
     
     # 添加AI分析结果
     if ai_analysis:
-        report += f"""
+        out.write(f"""
 **AI模型**: {ai_analysis.get('provider', 'Unknown').upper()}  
 **分析文件数**: {ai_analysis.get('analyzed_files', 0)} 个高风险文件  
 **AI评分**: {ai_analysis.get('average_score', 0)}/100  
@@ -119,22 +194,22 @@ def generate_markdown_report(result_data):
 <details>
 <summary><b>展开查看AI发现的问题</b></summary>
 
-"""
+""")
         ai_findings = ai_analysis.get('findings', [])
         if ai_findings:
             for i, finding in enumerate(ai_findings[:10], 1):
-                report += f"""
+                out.write(f"""
 **问题 {i}**: {finding.get('type', 'Unknown')}  
 - **严重程度**: {finding.get('severity', 'unknown')}  
 - **描述**: {finding.get('description', 'N/A')}  
 - **位置**: 第 {finding.get('line', 'N/A')} 行
-"""
+""")
         else:
-            report += "\n✅ AI未发现明显安全问题\n"
+            out.write("\n✅ AI未发现明显安全问题\n")
         
-        report += "\n</details>\n"
+        out.write("\n</details>\n")
     else:
-        report += """
+        out.write("""
 **AI分析状态**: ⚪ 未启用
 
 要启用AI分析，请在 `config.json` 中配置：
@@ -145,9 +220,9 @@ def generate_markdown_report(result_data):
 }
 ```
 
-"""
+""")
     
-    report += """
+    out.write(f"""
 ---
 
 ## 📊 静态规则分析
@@ -156,97 +231,203 @@ def generate_markdown_report(result_data):
 **总扣分**: {static_analysis.get('total_deductions', 0)}分
 
 **扣分明细**:
-"""
+""")
     
     # 使用实际的扣分详情（从静态分析结果读取）
     deduction_details = static_analysis.get('deduction_details', [])
     
     if deduction_details:
         for detail in deduction_details:
-            report += f"- {detail}\n"
+            out.write(f"- {detail}\n")
     else:
-        report += "- 无扣分记录\n"
-    
-    report += "\n**正常功能（不扣分）**:\n"
-    report += f"- 🔧 命令执行: {category_stats.get('command_execution', 0)}处 (管理面板必需功能)\n"
-    report += f"- 🌐 远程连接: {category_stats.get('remote_connection', 0)}处 (管理面板必需功能)\n"
-    report += f"- 📤 文件传输: {category_stats.get('file_transfer', 0)}处 (管理面板必需功能)\n"
-    
-    report += "\n---\n\n"
-    report += f"## 🔍 详细检测结果\n\n"
-    report += f"**总问题数**: {static_analysis.get('total_issues', 0)}  \n"
-    report += f"**风险文件数**: {static_analysis.get('risky_files', 0)}/{result_data.get('files_analyzed', 0)}\n\n"
-    
-    # 按严重程度排序显示
-    priority_order = [
-        'backdoor_critical',
-        'obfuscation_critical', 
-        'sql_injection_risk',
-        'dangerous_functions',
-        'tracking_ads',
-        'data_leak',
-        'privilege_escalation',
-        'suspicious_domain',
-        'file_transfer',
-        'remote_connection',
-        'command_execution'
-    ]
-    
-    for category in priority_order:
+        out.write("- 无扣分记录\n")
+    
+    out.write("\n**正常功能（不扣分）**:\n")
+    out.write(f"- 🔧 命令执行: {category_stats.get('command_execution', 0)}处 (管理面板必需功能)\n")
+    out.write(f"- 🌐 远程连接: {category_stats.get('remote_connection', 0)}处 (管理面板必需功能)\n")
+    out.write(f"- 📤 文件传输: {category_stats.get('file_transfer', 0)}处 (管理面板必需功能)\n")
+    
+    out.write("\n---\n\n")
+    out.write(f"## 🔍 详细检测结果\n\n")
+    out.write(f"**总问题数**: {static_analysis.get('total_issues', 0)}  \n")
+    out.write(f"**风险文件数**: {static_analysis.get('risky_files', 0)}/{result_data.get('files_analyzed', 0)}\n\n")
+    
+    for category in PRIORITY_ORDER:
         items = findings.get(category, [])
         if not items:
             continue
         
-        info = category_info.get(category, {})
+        info = CATEGORY_INFO.get(category, {})
         count = len(items)
         
-        report += f"\n### {info.get('name', category)} ({count} 处)\n\n"
-        report += f"**严重程度**: {info.get('severity', '未知')}  \n"
-        report += f"**说明**: {info.get('desc', '暂无说明')}\n\n"
+        out.write(f"\n### {info.get('name', category)} ({count} 处)\n\n")
+        out.write(f"**严重程度**: {info.get('severity', '未知')}  \n")
+        out.write(f"**说明**: {info.get('desc', '暂无说明')}\n\n")
         
-        # 列出所有文件（不省略）
-        report += f"<details>\n<summary>点击展开查看所有 {count} 个文件</summary>\n\n"
+        if pages_dir and count > INLINE_FINDINGS_LIMIT:
+            # 大分类只内联前若干条，全部条目分页写入独立文件（不省略）
+            page_names = _write_category_pages(version, category, items, pages_dir)
+            pages_link = os.path.basename(pages_dir)
+            out.write(f"完整列表共 {len(page_names)} 页: ")
+            out.write(" ".join(f"[{i}]({pages_link}/{name})" for i, name in enumerate(page_names, 1)))
+            out.write("\n\n")
+            out.write(f"<details>\n<summary>点击展开查看前 {INLINE_FINDINGS_LIMIT} 个文件</summary>\n\n")
+            shown = items[:INLINE_FINDINGS_LIMIT]
+        else:
+            # 列出所有文件（不省略）
+            out.write(f"<details>\n<summary>点击展开查看所有 {count} 个文件</summary>\n\n")
+            shown = items
         
-        for i, item in enumerate(items, 1):
-            report += f"{i}. **{item['file']}** (匹配{item['matches']}处)\n"
-            report += f"   - 匹配规则: `{item['pattern']}`\n"
-            
-            # 显示代码样本
-            if item.get('samples'):
-                report += f"   - 样本: "
-                for j, sample in enumerate(item['samples'][:2], 1):
-                    if j > 1:
-                        report += ", "
-                    report += f"`{sample}`"
-                report += "\n"
-            report += "\n"
+        for i, item in enumerate(shown, 1):
+            _write_finding(out, i, item)
         
-        report += "</details>\n\n"
+        out.write("</details>\n\n")
     
     # 安全建议
-    report += "---\n\n## 💡 安全建议\n\n"
+    out.write("---\n\n## 💡 安全建议\n\n")
     
     if static_analysis.get('recommendations'):
         for i, rec in enumerate(static_analysis['recommendations'], 1):
-            report += f"{i}. {rec}\n"
+            out.write(f"{i}. {rec}\n")
     
     # 总结
-    report += "\n---\n\n## 📋 检测总结\n\n"
-    report += f"{static_analysis.get('summary', '无总结')}\n\n"
+    out.write("\n---\n\n## 📋 检测总结\n\n")
+    out.write(f"{static_analysis.get('summary', '无总结')}\n\n")
     
     # 检测信息
-    report += "---\n\n## ℹ️ 检测信息\n\n"
-    report += f"- **分析文件数**: {result_data.get('files_analyzed', 0)}\n"
-    report += f"- **检测方式**: 基础检查 + 静态规则分析\n"
-    report += f"- **检测工具**: Python脚本 + 规则引擎（11类检测）\n"
-    report += f"- **检测日期**: {result_data.get('check_time', 'N/A')}\n"
-    report += f"- **报告生成时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-    
-    report += "\n---\n\n"
-    report += f"**自动化系统**: BTAUTOCHECK V1.0  \n"
-    report += f"**GitHub**: https://github.com/GSDPGIT/BTAUTOCHECK\n"
-    
-    return report
+    out.write("---\n\n## ℹ️ 检测信息\n\n")
+    out.write(f"- **分析文件数**: {result_data.get('files_analyzed', 0)}\n")
+    out.write(f"- **检测方式**: 基础检查 + 静态规则分析\n")
+    out.write(f"- **检测工具**: Python脚本 + 规则引擎（11类检测）\n")
+    out.write(f"- **检测日期**: {result_data.get('check_time', 'N/A')}\n")
+    out.write(f"- **报告生成时间**: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    
+    out.write("\n---\n\n")
+    out.write(f"**自动化系统**: BTAUTOCHECK V1.0  \n")
+    out.write(f"**GitHub**: https://github.com/GSDPGIT/BTAUTOCHECK\n")
+
+def generate_markdown_report(result_data):
+    """生成详细的Markdown格式检测报告（返回字符串，不分页）"""
+    buffer = io.StringIO()
+    write_markdown_report(result_data, buffer)
+    return buffer.getvalue()
+
+def _write_gzip_copy(path):
+    """写入预压缩副本，Web查看器可直接以gzip返回"""
+    with open(path, 'rb') as src, gzip.open(path + '.gz', 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst)
+
+def write_html_report(result_data, html_dir):
+    """
+    预渲染HTML报告供Web查看器使用
+    
+    index.html 为报告主体，每个分类只含标题和锚点，条目列表写入
+    <分类>.html 单独文件，由查看器展开时按需加载。每个文件同时
+    生成 .gz 预压缩副本。
+    """
+    version = result_data['version']
+    static_analysis = result_data.get('static_analysis', {})
+    ai_analysis = result_data.get('ai_analysis', None)
+    basic_check = result_data.get('basic_check', {})
+    category_stats = static_analysis.get('category_stats', {})
+    findings = static_analysis.get('findings', {})
+    esc = html.escape
+    
+    os.makedirs(html_dir, exist_ok=True)
+    written = []
+    
+    # 分类条目片段
+    sections = []
+    for category in PRIORITY_ORDER:
+        items = findings.get(category, [])
+        if not items:
+            continue
+        sections.append((category, len(items)))
+        
+        section_file = os.path.join(html_dir, f'{category}.html')
+        with open(section_file, 'w', encoding='utf-8') as out:
+            out.write('<ol class="finding-list">\n')
+            for item in items:
+                samples = ', '.join(f'<code>{esc(str(sample))}</code>' for sample in (item.get('samples') or [])[:2])
+                out.write(f'<li><strong>{esc(item["file"])}</strong> (匹配{item["matches"]}处)'
+                          f'<br>匹配规则: <code>{esc(item["pattern"])}</code>'
+                          + (f'<br>样本: {samples}' if samples else '') + '</li>\n')
+            out.write('</ol>\n')
+        written.append(section_file)
+    
+    index_file = os.path.join(html_dir, 'index.html')
+    with open(index_file, 'w', encoding='utf-8') as out:
+        out.write(f'<h1 id="top">🔍 BT-Panel {esc(version)} 安全检测报告</h1>\n')
+        out.write('<blockquote>'
+                  f'<p><b>检测时间</b>: {esc(str(result_data.get("check_time", "N/A")))}<br>'
+                  f'<b>安全评分</b>: {static_analysis.get("security_score", 0)}/100<br>'
+                  f'<b>检测状态</b>: {"✅ 通过" if static_analysis.get("is_safe", False) else "⚠️ 需审查"}<br>'
+                  f'<b>检测文件数</b>: {result_data.get("files_analyzed", 0)} 个</p></blockquote>\n')
+        
+        # 目录
+        out.write('<nav class="report-toc"><ul>'
+                  '<li><a href="#basic-info">📦 文件基本信息</a></li>'
+                  '<li><a href="#ai-analysis">🤖 AI深度分析</a></li>'
+                  '<li><a href="#static-analysis">📊 静态规则分析</a></li>')
+        for category, count in sections:
+            name = CATEGORY_INFO.get(category, {}).get('name', category)
+            out.write(f'<li><a href="#cat-{category}">{esc(name)} ({count})</a></li>')
+        out.write('<li><a href="#recommendations">💡 安全建议</a></li>'
+                  '<li><a href="#summary">📋 检测总结</a></li></ul></nav>\n')
+        
+        out.write('<h2 id="basic-info">📦 文件基本信息</h2>\n<table>'
+                  f'<tr><th>文件名</th><td><code>{esc(str(result_data.get("filename", "")))}</code></td></tr>'
+                  f'<tr><th>MD5</th><td><code>{esc(str(result_data.get("md5", "")))}</code></td></tr>'
+                  f'<tr><th>文件大小</th><td>{basic_check.get("size_mb", 0)} MB</td></tr>'
+                  f'<tr><th>压缩包文件数</th><td>{basic_check.get("file_count", 0)} 个</td></tr>'
+                  f'<tr><th>下载来源</th><td>{esc(str(result_data.get("download_url", "")))}</td></tr>'
+                  '</table>\n')
+        
+        out.write('<h2 id="ai-analysis">🤖 AI深度分析</h2>\n')
+        if ai_analysis:
+            out.write(f'<p><b>AI模型</b>: {esc(str(ai_analysis.get("provider", "Unknown")).upper())}<br>'
+                      f'<b>分析文件数</b>: {ai_analysis.get("analyzed_files", 0)}<br>'
+                      f'<b>AI评分</b>: {ai_analysis.get("average_score", 0)}/100<br>'
+                      f'<b>发现问题</b>: {ai_analysis.get("total_findings", 0)} 个</p>\n<ol>')
+            for finding in ai_analysis.get('findings', [])[:10]:
+                out.write(f'<li><b>{esc(str(finding.get("type", "Unknown")))}</b> '
+                          f'({esc(str(finding.get("severity", "unknown")))}): '
+                          f'{esc(str(finding.get("description", "N/A")))}</li>')
+            out.write('</ol>\n')
+        else:
+            out.write('<p>⚪ 未启用</p>\n')
+        
+        out.write('<h2 id="static-analysis">📊 静态规则分析</h2>\n'
+                  f'<p><b>综合评分</b>: {static_analysis.get("security_score", 0)}/100<br>'
+                  f'<b>总扣分</b>: {static_analysis.get("total_deductions", 0)}分<br>'
+                  f'<b>总问题数</b>: {static_analysis.get("total_issues", 0)}</p>\n<ul>')
+        for detail in static_analysis.get('deduction_details', []) or ['无扣分记录']:
+            out.write(f'<li>{esc(str(detail))}</li>')
+        for key, label in (('command_execution', '🔧 命令执行'), ('remote_connection', '🌐 远程连接'),
+                           ('file_transfer', '📤 文件传输')):
+            out.write(f'<li>{label}: {category_stats.get(key, 0)}处 (管理面板必需功能)</li>')
+        out.write('</ul>\n')
+        
+        for category, count in sections:
+            info = CATEGORY_INFO.get(category, {})
+            out.write(f'<section id="cat-{category}" class="report-section">'
+                      f'<h3>{esc(info.get("name", category))} ({count} 处)</h3>'
+                      f'<p><b>严重程度</b>: {esc(info.get("severity", "未知"))}<br>'
+                      f'<b>说明</b>: {esc(info.get("desc", "暂无说明"))}</p>'
+                      f'<div class="section-body" data-section="{category}"></div></section>\n')
+        
+        out.write('<h2 id="recommendations">💡 安全建议</h2>\n<ol>')
+        for rec in static_analysis.get('recommendations', []) or []:
+            out.write(f'<li>{esc(str(rec))}</li>')
+        out.write('</ol>\n')
+        out.write(f'<h2 id="summary">📋 检测总结</h2>\n<p>{esc(str(static_analysis.get("summary", "无总结")))}</p>\n')
+        out.write(f'<p><small>报告生成时间: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</small></p>\n')
+    written.append(index_file)
+    
+    for path in written:
+        _write_gzip_copy(path)
+    
+    return index_file
 
 def main():
     """主函数"""
@@ -269,27 +450,39 @@ def main():
     
     print(f"读取检测结果: {result_path}")
     
-    with open(result_path, 'r', encoding='utf-8') as f:
-        result_data = json.load(f)
+    # 合并单独存放的检测明细
+    result_data = load_report(result_path)
     
-    # 生成Markdown报告
+    # 生成Markdown报告（逐段写入文件，大分类分页）
     print("\n正在生成Markdown报告...")
-    markdown_report = generate_markdown_report(result_data)
-    
-    # 保存报告
     version = result_data['version']
     report_file = os.path.join(download_dir, f'SECURITY_REPORT_{version}.md')
+    pages_dir = os.path.join(download_dir, f'SECURITY_REPORT_{version}_pages')
+    
+    # 清理上次生成的分页，避免残留过期页面
+    if os.path.isdir(pages_dir):
+        shutil.rmtree(pages_dir)
     
     with open(report_file, 'w', encoding='utf-8') as f:
-        f.write(markdown_report)
+        write_markdown_report(result_data, f, pages_dir)
     
     print(f"✅ 报告已生成: {report_file}")
+    if os.path.isdir(pages_dir):
+        print(f"   大分类分页: {pages_dir}")
+    
+    # 预渲染HTML，Web查看器直接返回，不再在浏览器中解析整份Markdown
+    html_dir = os.path.join(download_dir, f'SECURITY_REPORT_{version}_html')
+    if os.path.isdir(html_dir):
+        shutil.rmtree(html_dir)
+    write_html_report(result_data, html_dir)
+    print(f"✅ HTML报告已预渲染: {html_dir}")
     
     # 显示报告预览
     print("\n" + "=" * 60)
     print("报告预览")
     print("=" * 60)
-    print(markdown_report[:500] + "...\n")
+    with open(report_file, 'r', encoding='utf-8') as f:
+        print(f.read(500) + "...\n")
     
     print("=" * 60)
     print("下一步：运行 5_update_and_upload.py 自动更新并上传")
@@ -11,6 +11,8 @@ import sys
 import subprocess
 import shutil
 from datetime import datetime
+from report_store import load_summary
+from config_store import set_value
 
 # 加载配置
 CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'config.json')
@@ -80,6 +82,15 @@ def copy_files_to_repo(version):
         shutil.copy2(report_file, target_report)
         print(f"✅ 已复制: SECURITY_REPORT_{version}.md")
     
+    # 复制大分类分页（报告中以相对路径链接）
+    pages_dir = os.path.join(download_dir, f'SECURITY_REPORT_{version}_pages')
+    if os.path.isdir(pages_dir):
+        target_pages = os.path.join(target_dir, f'SECURITY_REPORT_{version}_pages')
+        if os.path.isdir(target_pages):
+            shutil.rmtree(target_pages)
+        shutil.copytree(pages_dir, target_pages)
+        print(f"✅ 已复制: SECURITY_REPORT_{version}_pages/")
+    
     return True
 
 def git_commit_and_push(version):
@@ -132,8 +143,8 @@ def update_config_version(version):
     """更新配置文件中的当前版本"""
     config['current_version'] = version
     
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=4, ensure_ascii=False)
+    # 只更新版本字段，不覆盖运行期间其它进程对配置的修改
+    set_value('current_version', version, CONFIG_FILE)
     
     print(f"\n✅ 配置文件已更新: current_version = {version}")
 
@@ -155,8 +166,7 @@ def main():
     latest_result = sorted(result_files)[-1]
     result_path = os.path.join(download_dir, latest_result)
     
-    with open(result_path, 'r', encoding='utf-8') as f:
-        result_data = json.load(f)
+    result_data = load_summary(result_path)
 
     version = result_data['version']
     md5 = result_data['md5']
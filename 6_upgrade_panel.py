@@ -10,9 +10,16 @@ import sys
 import json
 import time
 import shutil
+import socket
+import ssl
 import subprocess
-from backup_manager import BackupManager
+import urllib.error
+import urllib.request
+from datetime import datetime
+from backup_manager import BackupManager, load_backup_options
 from notification import NotificationManager
+from config_store import set_value
+from panel_sync import apply_delta, rollback_delta, prune_manifests, verify_tree_manifest, file_md5
 
 def load_config():
     """加载配置"""
@@ -31,6 +38,111 @@ def check_panel_status():
         print(f"⚠️ 检查面板状态失败: {e}")
         return False
 
+def get_panel_port(panel_path='/www/server/panel'):
+    """读取面板端口（data/port.pl），读取失败返回默认端口8888"""
+    try:
+        with open(os.path.join(panel_path, 'data', 'port.pl'), 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return 8888
+
+def _port_open(port, timeout=1):
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def _http_ready(port, timeout=3):
+    """面板能返回HTTP响应即视为就绪（面板可能开启了自签名SSL，不校验证书）"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    for scheme in ('https', 'http'):
+        try:
+            with urllib.request.urlopen(f"{scheme}://127.0.0.1:{port}/", timeout=timeout, context=context) as resp:
+                return resp.status < 500
+        except urllib.error.HTTPError as e:
+            # 登录跳转、404等都说明服务已在处理请求
+            return e.code < 500
+        except Exception:
+            continue
+    return False
+
+def wait_for_panel_ready(panel_path='/www/server/panel', timeout=90, http_check=True,
+                         initial_delay=0.25, max_delay=5):
+    """
+    重启后等待面板就绪（指数退避轮询，超过总时限判定失败）
+    
+    依次检查：进程运行（bt status）→ 端口可连接 → HTTP有响应（可选）。
+    
+    Returns:
+        (是否就绪, 耗时秒数, 最后通过的检查阶段)
+    """
+    port = get_panel_port(panel_path)
+    start = time.time()
+    deadline = start + timeout
+    delay = initial_delay
+    stage = None
+    
+    while True:
+        if check_panel_status():
+            stage = 'process'
+            if _port_open(port):
+                stage = 'port'
+                if not http_check or _http_ready(port):
+                    if http_check:
+                        stage = 'http'
+                    return True, round(time.time() - start, 2), stage
+        
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False, round(time.time() - start, 2), stage
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+def record_restart_metric(version, ready, elapsed, stage, metrics_file='logs/panel_restart_metrics.json'):
+    """记录面板重启到就绪的耗时"""
+    try:
+        os.makedirs(os.path.dirname(metrics_file), exist_ok=True)
+        history = []
+        if os.path.exists(metrics_file):
+            with open(metrics_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        history.append({
+            'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'version': version,
+            'ready': ready,
+            'time_to_ready': elapsed,
+            'stage': stage
+        })
+        # 写入临时文件后原子替换，中途退出不会留下写了一半的记录
+        tmp_file = f"{metrics_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(history[-200:], f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, metrics_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    except Exception as e:
+        print(f"⚠️ 记录重启耗时失败: {e}")
+
+def restart_and_wait(config, version):
+    """重启面板并等待就绪，返回是否就绪"""
+    readiness = config.get('upgrade', {}).get('readiness', {})
+    os.system("bt restart")
+    ready, elapsed, stage = wait_for_panel_ready(
+        timeout=readiness.get('timeout', 90),
+        http_check=readiness.get('http_check', True)
+    )
+    record_restart_metric(version, ready, elapsed, stage)
+    if ready:
+        print(f"⏱️  面板就绪耗时: {elapsed} 秒")
+    else:
+        print(f"⚠️ 面板在 {elapsed} 秒内未就绪（最后通过的检查: {stage or '无'}）")
+    return ready
+
 def upgrade_panel(version_info):
     """
     升级面板
@@ -46,7 +158,7 @@ def upgrade_panel(version_info):
     print("=" * 70)
     
     config = load_config()
-    backup_manager = BackupManager()
+    backup_manager = BackupManager(options=load_backup_options())
     notif = NotificationManager()
     
     current_version = config.get('current_version', 'Unknown')
@@ -54,6 +166,7 @@ def upgrade_panel(version_info):
     upgrade_file = f"downloads/LinuxPanel-{new_version}.zip"
     
     backup_filepath = None
+    delta_manifest = None
     
     try:
         # 1. 检查升级包是否存在
@@ -85,13 +198,20 @@ def upgrade_panel(version_info):
         print("步骤2: 执行升级")
         print("=" * 70)
         
-        # 解压升级包
-        print("📦 正在解压升级包...")
-        shutil.unpack_archive(upgrade_file, '/tmp/bt_upgrade')
+        # 优先复用安全检测时解压并扫描过的目录（核对清单，保证安装的就是扫描过的文件）
+        upgrade_dir = f"downloads/extracted_{new_version}"
+        reusable, reason = verify_tree_manifest(upgrade_dir, file_md5(upgrade_file))
+        if reusable:
+            print(f"♻️  复用已扫描的解压目录: {upgrade_dir}（{reason}）")
+        else:
+            print(f"📦 无法复用已扫描的解压目录（{reason}），正在解压升级包...")
+            upgrade_dir = '/tmp/bt_upgrade'
+            shutil.rmtree(upgrade_dir, ignore_errors=True)
+            shutil.unpack_archive(upgrade_file, upgrade_dir)
         
         # 运行升级脚本
         print("🔄 正在执行升级...")
-        upgrade_script = '/tmp/bt_upgrade/install.sh'
+        upgrade_script = os.path.join(upgrade_dir, 'install.sh')
         
         if os.path.exists(upgrade_script):
             result = subprocess.run(['bash', upgrade_script], 
@@ -100,23 +220,26 @@ def upgrade_panel(version_info):
             if result.returncode != 0:
                 raise Exception(f"升级脚本执行失败: {result.stderr}")
         else:
-            # 直接复制文件升级
+            # 增量更新：只写入变化的文件（临时文件+改名），删除多余文件，并记录变更清单
             panel_path = '/www/server/panel'
-            print(f"📁 正在更新文件到 {panel_path}...")
+            upgrade_config = config.get('upgrade', {})
+            print(f"📁 正在增量更新文件到 {panel_path}...")
+            
+            delta_manifest, changes = apply_delta(
+                upgrade_dir, panel_path,
+                manifest_dir='backups',
+                version=new_version,
+                protected_paths=upgrade_config.get('protected_paths'),
+                delete_obsolete=upgrade_config.get('delete_obsolete', True)
+            )
             
-            for item in os.listdir('/tmp/bt_upgrade'):
-                src = os.path.join('/tmp/bt_upgrade', item)
-                dst = os.path.join(panel_path, item)
-                
-                if os.path.isdir(src):
-                    if os.path.exists(dst):
-                        shutil.rmtree(dst)
-                    shutil.copytree(src, dst)
-                else:
-                    shutil.copy2(src, dst)
-        
-        # 清理临时文件
-        shutil.rmtree('/tmp/bt_upgrade', ignore_errors=True)
+            counts = {action: sum(1 for c in changes if c['action'] == action) for action in ('add', 'update', 'remove')}
+            print(f"✅ 新增 {counts['add']}，更新 {counts['update']}，删除 {counts['remove']} 个文件")
+            print(f"📝 变更清单: {delta_manifest}")
+        
+        # 清理临时文件（复用的扫描目录保留）
+        if upgrade_dir == '/tmp/bt_upgrade':
+            shutil.rmtree(upgrade_dir, ignore_errors=True)
         
         # 4. 重启面板
         print("\n" + "=" * 70)
@@ -124,24 +247,24 @@ def upgrade_panel(version_info):
         print("=" * 70)
         
         print("🔄 正在重启面板...")
-        os.system("bt restart")
-        time.sleep(5)
         
-        # 5. 验证升级是否成功
+        # 5. 验证升级是否成功（轮询进程、端口和HTTP，直到就绪或超时）
         print("\n" + "=" * 70)
         print("步骤4: 验证升级")
         print("=" * 70)
         
-        print("🔍 检查面板状态...")
-        if not check_panel_status():
+        print("🔍 等待面板就绪...")
+        if not restart_and_wait(config, new_version):
             raise Exception("面板服务未正常运行")
         
         print("✅ 面板服务运行正常")
         
+        # 升级已验证成功，才清理旧的变更清单（失败时仍需要它们回滚）
+        if delta_manifest:
+            prune_manifests('backups')
+        
         # 6. 更新配置文件中的版本号
-        config['current_version'] = new_version
-        with open('config.json', 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=4, ensure_ascii=False)
+        set_value('current_version', new_version, 'config.json')
         
         print("\n" + "=" * 70)
         print(f"✅ 升级成功: {current_version} -> {new_version}")
@@ -155,6 +278,22 @@ def upgrade_panel(version_info):
     except Exception as e:
         print(f"\n❌ 升级失败: {e}")
         
+        # 增量更新失败时，优先只回滚变更过的文件
+        if config.get('auto_rollback_on_failure', True) and delta_manifest:
+            print("\n" + "=" * 70)
+            print("🔄 按变更清单回滚")
+            print("=" * 70)
+            
+            try:
+                rollback_delta(delta_manifest)
+                if restart_and_wait(config, current_version):
+                    print("✅ 已回滚到升级前的版本")
+                    notif.notify_upgrade_failed(new_version, f"升级失败，已自动回滚: {str(e)}")
+                    return False
+                print("⚠️ 回滚后面板未正常运行，尝试恢复完整备份")
+            except Exception as rollback_error:
+                print(f"⚠️ 按变更清单回滚失败: {rollback_error}，尝试恢复完整备份")
+        
         # 自动回滚（如果启用）
         if config.get('auto_rollback_on_failure', True) and backup_filepath:
             print("\n" + "=" * 70)
@@ -14,31 +14,78 @@ import time
 import hashlib
 import hmac
 import base64
+import re
 from datetime import datetime
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit
+from ai_budget import AIBudgetGovernor, estimate_tokens
+from secure_config import SecureConfig
+
+# 各AI提供商的默认接口地址（可通过 api_url 或 api_base_override 覆盖）
+DEFAULT_API_URLS = {
+    'gemini': 'https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}',
+    'openai': 'https://api.openai.com/v1/chat/completions',
+    'claude': 'https://api.anthropic.com/v1/messages',
+    'qianwen': 'https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation',
+    'wenxin_auth': 'https://aip.baidubce.com/oauth/2.0/token',
+    'wenxin': 'https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/completions_pro',
+    'zhipu': 'https://open.bigmodel.cn/api/paas/v4/chat/completions',
+    'deepseek': 'https://api.deepseek.com/v1/chat/completions',
+    'kimi': 'https://api.moonshot.cn/v1/chat/completions',
+    'grok': 'https://api.x.ai/v1/chat/completions',
+}
+
+# 单次请求的默认超时（秒），可由调用方通过 config['_timeout'] 缩短
+DEFAULT_REQUEST_TIMEOUT = 60
+
+# 分诊评分低于该值（或风险等级不是low）时再做完整分析，可由 triage_escalation_score 覆盖
+DEFAULT_TRIAGE_ESCALATION_SCORE = 80
+
+# 分诊模式下判断结果已足够的字段（数值后需出现分隔符，避免截断在数字中间）
+TRIAGE_FIELD_PATTERNS = [
+    re.compile(r'"security_score"\s*:\s*"?(\d+(?:\.\d+)?)"?\s*[,}\n]'),
+    re.compile(r'"risk_level"\s*:\s*"(low|medium|high)"', re.IGNORECASE),
+]
 
 class AIAnalyzer:
     """AI安全分析器 - 支持多种AI模型"""
     
     def __init__(self, config_file='config.json'):
-        """初始化AI分析器"""
-        self.config = self.load_config(config_file)
-        self.ai_config = self.config.get('ai_providers', {})
-        self.primary_provider = self.ai_config.get('primary_provider', 'gemini')
-        self.fallback_enabled = self.ai_config.get('fallback_enabled', True)
-        
-    def load_config(self, config_file):
-        """加载配置"""
-        with open(config_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    
-    def analyze_code(self, code_sample, file_info=""):
+        """初始化AI分析器（配置通过 SecureConfig 读取，配置文件修改后立即生效）"""
+        self.secure_config = SecureConfig(config_file)
+        # token/费用预算控制（按当前配置计算预算）
+        self.budget = AIBudgetGovernor(lambda: self.ai_config)
+    
+    @property
+    def config(self):
+        """解密后的当前配置（进程内共享缓存，配置文件未变化时只需一次 stat）"""
+        return self.secure_config.get_config()
+    
+    @property
+    def ai_config(self):
+        return self.config.get('ai_providers', {})
+    
+    @property
+    def primary_provider(self):
+        return self.ai_config.get('primary_provider', 'gemini')
+    
+    @property
+    def fallback_enabled(self):
+        return self.ai_config.get('fallback_enabled', True)
+    
+    @property
+    def api_base_override(self):
+        """统一替换所有提供商的协议和主机（如指向本地 mock_ai_server.py）"""
+        return (self.ai_config.get('api_base_override')
+                or os.environ.get('BTAUTOCHECK_AI_BASE_URL', ''))
+    
+    def analyze_code(self, code_sample, file_info="", triage=False):
         """
         使用AI分析代码安全性
         
         Args:
             code_sample: 代码样本
             file_info: 文件信息
+            triage: 分诊模式，只需要评分和风险等级（流式输出时会提前中断）
             
         Returns:
             分析结果字典
@@ -52,6 +99,8 @@ class AIAnalyzer:
         # 尝试主要提供商
         provider_config = self.ai_config.get(self.primary_provider, {})
         if provider_config.get('enabled', False):
+            if triage:
+                provider_config = dict(provider_config, _triage=True)
             result = self._call_ai_provider(self.primary_provider, prompt, provider_config)
             if result:
                 return result
@@ -59,12 +108,14 @@ class AIAnalyzer:
         # 如果启用了备用，尝试其他提供商
         if self.fallback_enabled:
             for provider_name, provider_config in self.ai_config.items():
-                if provider_name in ['enabled', 'primary_provider', 'fallback_enabled']:
+                if provider_name in ['enabled', 'primary_provider', 'fallback_enabled', 'consensus_mode']:
                     continue
                 if provider_name == self.primary_provider:
                     continue
-                if provider_config.get('enabled', False):
+                if isinstance(provider_config, dict) and provider_config.get('enabled', False):
                     print(f"🔄 切换到备用AI: {provider_name}")
+                    if triage:
+                        provider_config = dict(provider_config, _triage=True)
                     result = self._call_ai_provider(provider_name, prompt, provider_config)
                     if result:
                         return result
@@ -73,6 +124,25 @@ class AIAnalyzer:
         print("⚠️  所有AI提供商不可用，使用静态分析")
         return self._static_analysis_fallback(code_sample)
     
+    def analyze_with_triage(self, code_sample, file_info=""):
+        """
+        先分诊，必要时再做完整分析
+        
+        分诊结果风险等级不是low，或评分低于 ai_providers.triage_escalation_score 时
+        才再调用一次完整分析；低风险且评分达标的文件只调用一次AI。
+        
+        Returns:
+            (分析结果, 是否只做了分诊)
+        """
+        result = self.analyze_code(code_sample, file_info, triage=True)
+        if not result or not result.get('triage_only'):
+            return result, False
+        
+        escalation_score = self.ai_config.get('triage_escalation_score', DEFAULT_TRIAGE_ESCALATION_SCORE)
+        if result['risk_level'] == 'low' and result['security_score'] >= escalation_score:
+            return result, True
+        return self.analyze_code(code_sample, file_info), False
+    
     def _build_security_prompt(self, code_sample, file_info):
         """构建安全分析提示词"""
         return f"""你是一个专业的代码安全审计专家。请分析以下BT（宝塔）面板代码的安全性。
@@ -105,6 +175,17 @@ class AIAnalyzer:
     
     def _call_ai_provider(self, provider_name, prompt, provider_config):
         """调用AI提供商"""
+        cancel = provider_config.get('_cancel')
+        if cancel is not None and cancel.is_set():
+            return None
+        
+        # 预留额度，用量记录时归还；请求失败或没有记录用量时在最后归还
+        reservation = self.budget.reserve(provider_name, estimate_tokens(prompt))
+        if reservation is None:
+            print(f"💰 {provider_name} 已超出token/费用预算，跳过本次调用")
+            return None
+        provider_config = dict(provider_config, _reservation=reservation)
+        
         try:
             if provider_name == 'gemini':
                 return self._call_gemini(prompt, provider_config)
@@ -132,13 +213,36 @@ class AIAnalyzer:
         except Exception as e:
             print(f"❌ {provider_name} 调用失败: {e}")
             return None
+        finally:
+            self.budget.release(reservation)
+    
+    def _get_api_url(self, provider, config, **params):
+        """
+        获取提供商接口地址
+        
+        优先使用配置中的 api_url，其次使用默认地址；
+        设置了 api_base_override 时只保留路径和查询参数，替换协议和主机。
+        """
+        url = config.get('api_url') or DEFAULT_API_URLS[provider]
+        
+        if self.api_base_override:
+            parts = urlsplit(url)
+            url = self.api_base_override.rstrip('/') + parts.path
+            if parts.query:
+                url += '?' + parts.query
+        
+        return url.format(**params) if params else url
+    
+    def _request_timeout(self, config):
+        """单次请求的超时（共识分析按每次调用的截止时间传入 _timeout）"""
+        return config.get('_timeout') or DEFAULT_REQUEST_TIMEOUT
     
     def _call_gemini(self, prompt, config):
         """调用Google Gemini"""
         api_key = config.get('api_key')
         model = config.get('model', 'gemini-2.0-flash-exp')
         
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+        url = self._get_api_url('gemini', config, model=model, api_key=api_key)
         
         payload = {
             "contents": [{
@@ -146,11 +250,16 @@ class AIAnalyzer:
             }]
         }
         
-        response = requests.post(url, json=payload, timeout=60)
+        if self._use_streaming(config):
+            stream_url = url.replace(':generateContent', ':streamGenerateContent')
+            stream_url += ('&' if '?' in stream_url else '?') + 'alt=sse'
+            return self._call_streaming('gemini', prompt, stream_url, {}, payload, config)
+        
+        response = requests.post(url, json=payload, timeout=self._request_timeout(config))
         if response.status_code == 200:
             data = response.json()
             text = data['candidates'][0]['content']['parts'][0]['text']
-            return self._parse_ai_response(text, 'gemini')
+            return self._finish_call('gemini', prompt, text, config, self._extract_usage('gemini', data))
         else:
             print(f"❌ Gemini API错误: {response.status_code}")
             return None
@@ -174,12 +283,16 @@ class AIAnalyzer:
             "temperature": 0.3
         }
         
-        response = requests.post('https://api.openai.com/v1/chat/completions', 
-                               headers=headers, json=payload, timeout=60)
+        if self._use_streaming(config):
+            payload['stream'] = True
+            return self._call_streaming('openai', prompt, self._get_api_url('openai', config), headers, payload, config)
+        
+        response = requests.post(self._get_api_url('openai', config), 
+                               headers=headers, json=payload, timeout=self._request_timeout(config))
         if response.status_code == 200:
             data = response.json()
             text = data['choices'][0]['message']['content']
-            return self._parse_ai_response(text, 'openai')
+            return self._finish_call('openai', prompt, text, config, self._extract_usage('openai', data))
         else:
             print(f"❌ OpenAI API错误: {response.status_code}")
             return None
@@ -203,12 +316,16 @@ class AIAnalyzer:
             ]
         }
         
-        response = requests.post('https://api.anthropic.com/v1/messages',
-                               headers=headers, json=payload, timeout=60)
+        if self._use_streaming(config):
+            payload['stream'] = True
+            return self._call_streaming('claude', prompt, self._get_api_url('claude', config), headers, payload, config)
+        
+        response = requests.post(self._get_api_url('claude', config),
+                               headers=headers, json=payload, timeout=self._request_timeout(config))
         if response.status_code == 200:
             data = response.json()
             text = data['content'][0]['text']
-            return self._parse_ai_response(text, 'claude')
+            return self._finish_call('claude', prompt, text, config, self._extract_usage('claude', data))
         else:
             print(f"❌ Claude API错误: {response.status_code}")
             return None
@@ -236,12 +353,17 @@ class AIAnalyzer:
             }
         }
         
-        response = requests.post('https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation',
-                               headers=headers, json=payload, timeout=60)
+        if self._use_streaming(config):
+            headers['X-DashScope-SSE'] = 'enable'
+            payload['parameters']['incremental_output'] = True
+            return self._call_streaming('qianwen', prompt, self._get_api_url('qianwen', config), headers, payload, config)
+        
+        response = requests.post(self._get_api_url('qianwen', config),
+                               headers=headers, json=payload, timeout=self._request_timeout(config))
         if response.status_code == 200:
             data = response.json()
             text = data['output']['choices'][0]['message']['content']
-            return self._parse_ai_response(text, 'qianwen')
+            return self._finish_call('qianwen', prompt, text, config, self._extract_usage('qianwen', data))
         else:
             print(f"❌ 通义千问API错误: {response.status_code}")
             return None
@@ -252,15 +374,19 @@ class AIAnalyzer:
         secret_key = config.get('secret_key')
         
         # 获取access_token
-        auth_url = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={api_key}&client_secret={secret_key}"
-        auth_response = requests.get(auth_url)
+        auth_url = self._get_api_url('wenxin_auth', {})
+        auth_response = requests.get(auth_url, params={
+            'grant_type': 'client_credentials',
+            'client_id': api_key,
+            'client_secret': secret_key
+        }, timeout=min(30, self._request_timeout(config)))
         access_token = auth_response.json().get('access_token')
         
         if not access_token:
             print("❌ 文心一言获取token失败")
             return None
         
-        url = f"https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/completions_pro?access_token={access_token}"
+        url = f"{self._get_api_url('wenxin', config)}?access_token={access_token}"
         
         payload = {
             "messages": [
@@ -268,11 +394,15 @@ class AIAnalyzer:
             ]
         }
         
-        response = requests.post(url, json=payload, timeout=60)
+        if self._use_streaming(config):
+            payload['stream'] = True
+            return self._call_streaming('wenxin', prompt, url, {}, payload, config)
+        
+        response = requests.post(url, json=payload, timeout=self._request_timeout(config))
         if response.status_code == 200:
             data = response.json()
             text = data.get('result', '')
-            return self._parse_ai_response(text, 'wenxin')
+            return self._finish_call('wenxin', prompt, text, config, self._extract_usage('wenxin', data))
         else:
             print(f"❌ 文心一言API错误: {response.status_code}")
             return None
@@ -295,12 +425,16 @@ class AIAnalyzer:
             ]
         }
         
-        response = requests.post('https://open.bigmodel.cn/api/paas/v4/chat/completions',
-                               headers=headers, json=payload, timeout=60)
+        if self._use_streaming(config):
+            payload['stream'] = True
+            return self._call_streaming('zhipu', prompt, self._get_api_url('zhipu', config), headers, payload, config)
+        
+        response = requests.post(self._get_api_url('zhipu', config),
+                               headers=headers, json=payload, timeout=self._request_timeout(config))
         if response.status_code == 200:
             data = response.json()
             text = data['choices'][0]['message']['content']
-            return self._parse_ai_response(text, 'zhipu')
+            return self._finish_call('zhipu', prompt, text, config, self._extract_usage('zhipu', data))
         else:
             print(f"❌ 智谱GLM API错误: {response.status_code}")
             return None
@@ -323,12 +457,16 @@ class AIAnalyzer:
             ]
         }
         
-        response = requests.post('https://api.deepseek.com/v1/chat/completions',
-                               headers=headers, json=payload, timeout=60)
+        if self._use_streaming(config):
+            payload['stream'] = True
+            return self._call_streaming('deepseek', prompt, self._get_api_url('deepseek', config), headers, payload, config)
+        
+        response = requests.post(self._get_api_url('deepseek', config),
+                               headers=headers, json=payload, timeout=self._request_timeout(config))
         if response.status_code == 200:
             data = response.json()
             text = data['choices'][0]['message']['content']
-            return self._parse_ai_response(text, 'deepseek')
+            return self._finish_call('deepseek', prompt, text, config, self._extract_usage('deepseek', data))
         else:
             print(f"❌ DeepSeek API错误: {response.status_code}")
             return None
@@ -352,12 +490,16 @@ class AIAnalyzer:
             "temperature": 0.3
         }
         
-        response = requests.post('https://api.moonshot.cn/v1/chat/completions',
-                               headers=headers, json=payload, timeout=60)
+        if self._use_streaming(config):
+            payload['stream'] = True
+            return self._call_streaming('kimi', prompt, self._get_api_url('kimi', config), headers, payload, config)
+        
+        response = requests.post(self._get_api_url('kimi', config),
+                               headers=headers, json=payload, timeout=self._request_timeout(config))
         if response.status_code == 200:
             data = response.json()
             text = data['choices'][0]['message']['content']
-            return self._parse_ai_response(text, 'kimi')
+            return self._finish_call('kimi', prompt, text, config, self._extract_usage('kimi', data))
         else:
             print(f"❌ Kimi API错误: {response.status_code}")
             return None
@@ -388,53 +530,372 @@ class AIAnalyzer:
             "temperature": 0.3
         }
         
-        response = requests.post('https://api.x.ai/v1/chat/completions',
-                               headers=headers, json=payload, timeout=60)
+        if self._use_streaming(config):
+            payload['stream'] = True
+            return self._call_streaming('grok', prompt, self._get_api_url('grok', config), headers, payload, config)
+        
+        response = requests.post(self._get_api_url('grok', config),
+                               headers=headers, json=payload, timeout=self._request_timeout(config))
         if response.status_code == 200:
             data = response.json()
             text = data['choices'][0]['message']['content']
-            return self._parse_ai_response(text, 'grok')
+            return self._finish_call('grok', prompt, text, config, self._extract_usage('grok', data))
         else:
             print(f"❌ Grok API错误: {response.status_code}")
             return None
     
-    def _parse_ai_response(self, text, provider):
-        """解析AI响应"""
+    def _use_streaming(self, config):
+        """是否对该提供商使用流式输出（提供商配置 stream 优先于全局 streaming）"""
+        return config.get('stream', self.ai_config.get('streaming', False))
+    
+    def _call_streaming(self, provider, prompt, url, headers, payload, config):
+        """
+        以SSE流式方式调用AI并增量拼接回复
+        
+        分诊模式（config['_triage']）下，一旦 security_score 和 risk_level
+        已经出现就立即断开连接，剩余内容不再生成和计费。
+        超过 _timeout 或调用方设置了 config['_cancel'] 时同样断开连接，返回None。
+        """
+        triage = config.get('_triage', False)
+        cancel = config.get('_cancel')
+        timeout = self._request_timeout(config)
+        deadline = time.monotonic() + timeout
+        text = ''
+        usage = {}
+        aborted = False
+        
+        with requests.post(url, headers=headers, json=payload, timeout=timeout, stream=True) as response:
+            if response.status_code != 200:
+                print(f"❌ {provider} 流式API错误: {response.status_code}")
+                return None
+            
+            for line in response.iter_lines(decode_unicode=True):
+                if (cancel is not None and cancel.is_set()) or time.monotonic() > deadline:
+                    # 已生成的部分仍然计费，记录用量后放弃
+                    self._record_usage(provider, prompt, text, usage, config)
+                    return None
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[5:].strip()
+                if data == '[DONE]':
+                    break
+                try:
+                    event = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                
+                # 各家的用量字段是累计值或分散在首尾事件中，取最大值合并
+                for key, value in (self._extract_usage(provider, event) or {}).items():
+                    usage[key] = max(usage.get(key, 0), value)
+                
+                delta = self._extract_stream_delta(provider, event)
+                if not delta:
+                    continue
+                text += delta
+                
+                if triage and self._triage_ready(text[-(len(delta) + 64):], text):
+                    aborted = True
+                    break
+        
+        if aborted:
+            # 提前中断的回复只有评分和风险等级，不给出安全结论和问题列表
+            usage = self._record_usage(provider, prompt, text, usage, config)
+            result = self._extract_triage_result(text)
+            if result is not None:
+                result.update({'ai_provider': provider,
+                               'ai_response_time': datetime.now().isoformat(),
+                               'usage': usage})
+            return result
+        
+        return self._finish_call(provider, prompt, text, config, usage)
+    
+    def _extract_usage(self, provider, data):
+        """
+        从提供商响应（或流式事件）中提取token用量
+        
+        Returns:
+            {'input_tokens': n, 'output_tokens': n}（可能只含其中一项），无用量信息返回None
+        """
+        if not isinstance(data, dict):
+            return None
+        
+        if provider == 'gemini':
+            meta = data.get('usageMetadata') or {}
+            usage = {'input_tokens': meta.get('promptTokenCount'),
+                     'output_tokens': meta.get('candidatesTokenCount')}
+        elif provider in ('claude', 'qianwen'):
+            raw = data.get('usage') or (data.get('message') or {}).get('usage') or {}
+            usage = {'input_tokens': raw.get('input_tokens'), 'output_tokens': raw.get('output_tokens')}
+        else:
+            raw = data.get('usage') or {}
+            usage = {'input_tokens': raw.get('prompt_tokens'), 'output_tokens': raw.get('completion_tokens')}
+        
+        usage = {k: v for k, v in usage.items() if isinstance(v, int)}
+        return usage or None
+    
+    def _record_usage(self, provider, prompt, text, usage, config=None):
+        """记录一次调用的用量（缺失的用量按文本长度估算），同时归还调用前预留的额度"""
+        usage = dict(usage or {})
+        estimated = 'input_tokens' not in usage or 'output_tokens' not in usage
+        usage.setdefault('input_tokens', estimate_tokens(prompt))
+        usage.setdefault('output_tokens', estimate_tokens(text))
+        usage['estimated'] = estimated
+        self.budget.record(provider, usage, (config or {}).get('_reservation'))
+        return usage
+    
+    def _finish_call(self, provider, prompt, text, config, usage):
+        """
+        记录用量并解析回复
+        
+        请求返回时调用方已经放弃（config['_cancel']），只记录一次用量，
+        不再解析，也不会触发JSON修复重试。
+        """
+        usage = self._record_usage(provider, prompt, text, usage, config)
+        
+        cancel = config.get('_cancel')
+        if cancel is not None and cancel.is_set():
+            return None
+        
+        result = self._parse_ai_response(text, provider, config)
+        if result is not None:
+            result['usage'] = usage
+        return result
+    
+    def _extract_stream_delta(self, provider, event):
+        """从各提供商的流式事件中取出新增文本"""
         try:
-            # 尝试从响应中提取JSON
-            # AI通常会返回包含代码块的markdown，需要提取JSON部分
-            if '```json' in text:
-                json_start = text.find('```json') + 7
-                json_end = text.find('```', json_start)
-                json_text = text[json_start:json_end].strip()
-            elif '```' in text:
-                json_start = text.find('```') + 3
-                json_end = text.find('```', json_start)
-                json_text = text[json_start:json_end].strip()
-            elif '{' in text and '}' in text:
-                json_start = text.find('{')
-                json_end = text.rfind('}') + 1
-                json_text = text[json_start:json_end]
+            if provider == 'gemini':
+                return event['candidates'][0]['content']['parts'][0].get('text', '')
+            elif provider == 'claude':
+                if event.get('type') == 'content_block_delta':
+                    return event['delta'].get('text', '')
+                return ''
+            elif provider == 'qianwen':
+                return event['output']['choices'][0]['message'].get('content', '')
+            elif provider == 'wenxin':
+                return event.get('result', '')
             else:
-                json_text = text
+                return event['choices'][0]['delta'].get('content') or ''
+        except (KeyError, IndexError, TypeError, AttributeError):
+            return ''
+    
+    def _triage_ready(self, tail, text):
+        """分诊所需字段（评分和风险等级）是否都已完整输出"""
+        if not TRIAGE_FIELD_PATTERNS[0].search(tail) and not TRIAGE_FIELD_PATTERNS[1].search(tail):
+            return False
+        return all(pattern.search(text) for pattern in TRIAGE_FIELD_PATTERNS)
+    
+    def _extract_triage_result(self, text):
+        """
+        从提前中断的回复中取出分诊结果
+        
+        Returns:
+            {'security_score', 'risk_level', 'triage_only': True, 'stream_aborted': True}，
+            字段不完整返回None
+        """
+        score_match = TRIAGE_FIELD_PATTERNS[0].search(text)
+        risk_match = TRIAGE_FIELD_PATTERNS[1].search(text)
+        if not score_match or not risk_match:
+            return None
+        
+        score = float(score_match.group(1))
+        if not 0 <= score <= 100:
+            return None
+        return {
+            'security_score': int(score) if score.is_integer() else round(score, 1),
+            'risk_level': risk_match.group(1).lower(),
+            'triage_only': True,
+            'stream_aborted': True
+        }
+    
+    def _parse_ai_response(self, text, provider, config=None):
+        """
+        解析AI响应
+        
+        依次尝试多个代码块、正文中的JSON对象以及截断修复，并按结果格式校验；
+        仍然失败时只把出错的片段发回AI做一次修复，不再伪造评分结果。
+        
+        Args:
+            text: AI返回的文本
+            provider: 提供商名称
+            config: 提供商配置（用于修复重试，为None时不重试）
             
-            result = json.loads(json_text)
-            result['ai_provider'] = provider
-            result['ai_response_time'] = datetime.now().isoformat()
-            return result
+        Returns:
+            分析结果字典，解析失败返回None
+        """
+        result, fragment = self._extract_json_result(text)
+        
+        if result is None and config is not None and not config.get('_repair_attempt') \
+                and self.ai_config.get('repair_enabled', True):
+            print(f"⚠️  {provider} 返回格式异常，请求AI修复JSON片段...")
+            repaired = self._call_ai_provider(provider, self._build_repair_prompt(fragment or text),
+                                              dict(config, _repair_attempt=True))
+            if repaired:
+                repaired['repaired'] = True
+                return repaired
+        
+        if result is None:
+            print(f"❌ {provider} 返回内容无法解析为有效的分析结果")
+            return None
+        
+        result['ai_provider'] = provider
+        result['ai_response_time'] = datetime.now().isoformat()
+        return result
+    
+    def _extract_json_result(self, text):
+        """
+        从AI回复中提取并校验分析结果
+        
+        Returns:
+            (校验后的结果字典或None, 最可能的JSON片段)
+        """
+        text = text or ''
+        
+        # 代码块优先（可能有多个，末尾未闭合的代码块视为截断），其次整段文本
+        candidates = [m.group(1) for m in re.finditer(r'```[a-zA-Z]*[ \t]*\n?(.*?)(?:```|$)', text, re.S)]
+        candidates.append(text)
+        
+        fragment = None
+        for candidate in candidates:
+            start = candidate.find('{')
+            if start < 0:
+                continue
+            if fragment is None:
+                fragment = candidate[start:].strip()
             
-        except json.JSONDecodeError:
-            # 如果无法解析JSON，返回原始文本
-            print(f"⚠️  {provider} 返回格式异常，尝试解析文本...")
-            return {
-                'security_score': 75,
-                'risk_level': 'medium',
-                'findings': [],
-                'recommendation': text[:500],
-                'safe_to_use': True,
-                'ai_provider': provider,
-                'parse_failed': True
-            }
+            for obj in self._iter_json_objects(candidate, start):
+                result = self._validate_ai_result(obj)
+                if result is not None:
+                    return result, fragment
+            
+            # 可能是输出被截断，补全括号后再试
+            for repaired_text in self._close_truncated_json(candidate[start:]):
+                try:
+                    obj = json.loads(repaired_text)
+                except json.JSONDecodeError:
+                    continue
+                result = self._validate_ai_result(obj)
+                if result is not None:
+                    result['truncated'] = True
+                    return result, fragment
+        
+        return None, fragment
+    
+    def _iter_json_objects(self, text, start=0, max_attempts=50):
+        """从每个 '{' 位置尝试增量解码一个完整JSON对象"""
+        decoder = json.JSONDecoder()
+        pos = start
+        attempts = 0
+        while 0 <= pos < len(text) and attempts < max_attempts:
+            attempts += 1
+            try:
+                obj, end = decoder.raw_decode(text, pos)
+                if isinstance(obj, dict):
+                    yield obj
+                pos = text.find('{', end)
+            except json.JSONDecodeError:
+                pos = text.find('{', pos + 1)
+    
+    def _close_truncated_json(self, fragment, max_cuts=20):
+        """
+        为被截断的JSON补全引号和括号
+        
+        先尝试直接补全，再依次回退到更早的逗号处截断后补全。
+        
+        Returns:
+            候选JSON文本列表
+        """
+        stack = []
+        cut_points = []
+        in_string = False
+        escaped = False
+        
+        for i, ch in enumerate(fragment):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == '\\':
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+                continue
+            
+            if ch == '"':
+                in_string = True
+            elif ch in '{[':
+                stack.append('}' if ch == '{' else ']')
+            elif ch in '}]':
+                if stack:
+                    stack.pop()
+                if not stack:
+                    # 已经是完整对象，说明问题不在截断
+                    return []
+            elif ch == ',':
+                cut_points.append((i, ''.join(reversed(stack))))
+        
+        if not stack:
+            return []
+        
+        tail = fragment + ('"' if in_string else '')
+        tail = re.sub(r'[\s,:]+$', '', tail)
+        candidates = [tail + ''.join(reversed(stack))]
+        for pos, closers in reversed(cut_points[-max_cuts:]):
+            candidates.append(fragment[:pos] + closers)
+        return candidates
+    
+    def _validate_ai_result(self, obj):
+        """
+        按分析结果格式校验并规范化
+        
+        security_score、risk_level、findings、safe_to_use 为必填字段。
+        
+        Returns:
+            规范化后的结果字典，不符合格式返回None
+        """
+        if not isinstance(obj, dict):
+            return None
+        
+        try:
+            score = float(obj.get('security_score'))
+        except (TypeError, ValueError):
+            return None
+        if not 0 <= score <= 100:
+            return None
+        score = int(score) if score.is_integer() else round(score, 1)
+        
+        # 缺少风险等级或安全结论时视为无效，不根据评分推测
+        risk_level = str(obj.get('risk_level', '')).strip().lower()
+        if risk_level not in ('low', 'medium', 'high'):
+            return None
+        
+        findings = obj.get('findings')
+        if not isinstance(findings, list):
+            return None
+        findings = [f if isinstance(f, dict) else {'description': str(f)} for f in findings]
+        
+        safe_to_use = obj.get('safe_to_use')
+        if isinstance(safe_to_use, str) and safe_to_use.strip().lower() in ('true', 'false'):
+            safe_to_use = safe_to_use.strip().lower() == 'true'
+        if not isinstance(safe_to_use, bool):
+            return None
+        
+        result = dict(obj)
+        result.update({
+            'security_score': score,
+            'risk_level': risk_level,
+            'findings': findings,
+            'recommendation': str(obj.get('recommendation', '')),
+            'safe_to_use': safe_to_use
+        })
+        return result
+    
+    def _build_repair_prompt(self, fragment):
+        """构建JSON修复提示词（只发送出错的片段）"""
+        return f"""下面是一段格式错误或被截断的JSON安全分析结果。请将其修复为合法的JSON，只返回JSON本身，不要添加任何解释。
+
+字段要求：security_score（0-100的整数）、risk_level（low/medium/high）、findings（数组，元素包含type/severity/description/line）、recommendation（字符串）、safe_to_use（布尔值）。
+
+{fragment[:4000]}"""
     
     def _static_analysis_fallback(self, code_sample):
         """静态分析备用方案"""
@@ -470,13 +931,39 @@ class AIAnalyzer:
             'is_fallback': True
         }
     
-    def batch_analyze_files(self, file_list, max_files=10):
+    def plan_files(self, candidates):
+        """
+        按预算挑选要送AI分析的文件
+
+        Args:
+            candidates: [(文件路径, 代码样本)]，已按优先级从高到低排序
+
+        Returns:
+            (选中的候选列表, 因预算跳过的数量)
+        """
+        provider = self.primary_provider
+        if not self.ai_config.get(provider, {}).get('enabled', False):
+            for name, provider_config in self.ai_config.items():
+                if isinstance(provider_config, dict) and provider_config.get('enabled', False) \
+                        and name != 'consensus_mode':
+                    provider = name
+                    break
+
+        # max_files_per_run 始终是上限，配置了预算时在上限内再按预算挑选
+        max_files = self.ai_config.get('max_files_per_run', 5)
+
+        sized = [((path, content), estimate_tokens(self._build_security_prompt(content, path)))
+                 for path, content in candidates]
+        return self.budget.plan(provider, sized, max_files)
+
+    def batch_analyze_files(self, file_list, max_files=10, triage=False):
         """
         批量分析文件
         
         Args:
             file_list: 文件路径列表
             max_files: 最大分析文件数
+            triage: 分诊模式，只获取评分和风险等级
             
         Returns:
             分析结果列表
@@ -496,7 +983,7 @@ class AIAnalyzer:
                 
                 if len(content) > 100:  # 只分析有实质内容的文件
                     print(f"🔍 分析: {filepath}")
-                    result = self.analyze_code(content, filepath)
+                    result = self.analyze_code(content, filepath, triage=triage)
                     if result:
                         result['file'] = filepath
                         results.append(result)
@@ -530,10 +1017,12 @@ def test_ai_providers():
     
     providers = analyzer.ai_config.keys()
     for provider in providers:
-        if provider in ['enabled', 'primary_provider', 'fallback_enabled']:
+        if provider in ['enabled', 'primary_provider', 'fallback_enabled', 'consensus_mode']:
             continue
         
         config = analyzer.ai_config.get(provider, {})
+        if not isinstance(config, dict):
+            continue
         if config.get('enabled', False):
             print(f"\n📡 测试 {provider.upper()}...")
             result = analyzer._call_ai_provider(provider, 
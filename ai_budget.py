@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BTAUTOCHECK AI用量与预算控制
+AI Token & Cost Budget Governor
+"""
+
+import fcntl
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# 中日韩字符约1个token，其余字符约4个字符1个token
+CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]')
+
+# 未配置时假定每次回复的输出token数
+DEFAULT_EXPECTED_OUTPUT_TOKENS = 800
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数"""
+    if not text:
+        return 0
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class AIBudgetGovernor:
+    """AI用量与预算控制器 - 按提供商统计本次运行和当天的token/费用"""
+
+    def __init__(self, ai_config, usage_file='logs/ai_usage.json'):
+        """
+        初始化预算控制器
+
+        Args:
+            ai_config: config.json 中的 ai_providers 配置，或返回当前配置的函数（配置修改后立即生效）
+            usage_file: 每日用量记录文件
+        """
+        self._ai_config = ai_config
+        self.usage_file = usage_file
+        self.lock = threading.RLock()
+        self.run_usage = {}
+        # 已发出但尚未记录用量的调用预留的额度 {提供商: {'tokens', 'cost'}}
+        self.reserved = {}
+
+    @property
+    def ai_config(self):
+        """当前 ai_providers 配置"""
+        return self._ai_config() if callable(self._ai_config) else self._ai_config
+
+    @property
+    def expected_output_tokens(self):
+        return self.ai_config.get('expected_output_tokens', DEFAULT_EXPECTED_OUTPUT_TOKENS)
+
+    def _empty_usage(self):
+        return {'calls': 0, 'input_tokens': 0, 'output_tokens': 0, 'cost': 0.0, 'estimated_calls': 0}
+
+    def _get_budget(self, provider):
+        """获取提供商预算配置"""
+        provider_config = self.ai_config.get(provider, {})
+        if not isinstance(provider_config, dict):
+            return {}
+        return provider_config.get('budget', {}) or {}
+
+    def estimate_cost(self, provider, input_tokens, output_tokens):
+        """按提供商单价（每1000 token）估算费用"""
+        provider_config = self.ai_config.get(provider, {})
+        pricing = provider_config.get('pricing', {}) if isinstance(provider_config, dict) else {}
+        return (input_tokens / 1000 * pricing.get('input_per_1k', 0)
+                + output_tokens / 1000 * pricing.get('output_per_1k', 0))
+
+    def remaining(self, provider):
+        """
+        获取提供商剩余预算
+
+        Returns:
+            {'tokens': 剩余token或None, 'cost': 剩余费用或None}，None表示不限制
+        """
+        budget = self._get_budget(provider)
+        with self.lock:
+            run = dict(self.run_usage.get(provider, self._empty_usage()))
+            held = dict(self.reserved.get(provider, {'tokens': 0, 'cost': 0.0}))
+        # 当天用量每次从文件读取，包含其它进程/分析器的调用
+        day = self.daily_usage().get(provider, self._empty_usage())
+        # 并发中的调用预留的额度同时计入本次运行和当天用量
+        run['input_tokens'] += held['tokens']
+        run['cost'] += held['cost']
+        day = dict(day, input_tokens=day['input_tokens'] + held['tokens'], cost=day['cost'] + held['cost'])
+
+        token_limits = []
+        if budget.get('max_tokens_per_run'):
+            token_limits.append(budget['max_tokens_per_run'] - run['input_tokens'] - run['output_tokens'])
+        if budget.get('max_tokens_per_day'):
+            token_limits.append(budget['max_tokens_per_day'] - day['input_tokens'] - day['output_tokens'])
+
+        cost_limits = []
+        if budget.get('max_cost_per_run'):
+            cost_limits.append(budget['max_cost_per_run'] - run['cost'])
+        if budget.get('max_cost_per_day'):
+            cost_limits.append(budget['max_cost_per_day'] - day['cost'])
+
+        return {
+            'tokens': max(0, min(token_limits)) if token_limits else None,
+            'cost': max(0.0, min(cost_limits)) if cost_limits else None
+        }
+
+    def can_afford(self, provider, input_tokens, output_tokens=None):
+        """判断一次调用是否在预算内"""
+        if output_tokens is None:
+            output_tokens = self.expected_output_tokens
+
+        left = self.remaining(provider)
+        if left['tokens'] is not None and input_tokens + output_tokens > left['tokens']:
+            return False
+        if left['cost'] is not None and self.estimate_cost(provider, input_tokens, output_tokens) > left['cost']:
+            return False
+        return True
+
+    def reserve(self, provider, input_tokens, output_tokens=None):
+        """
+        在预算内为一次调用预留额度
+
+        检查和预留在同一把锁内完成，多个提供商/线程并发调用时不会一起超出预算。
+        调用结束后通过 record(..., reservation) 或 release(reservation) 归还。
+
+        Returns:
+            预留记录，超出预算返回None
+        """
+        if output_tokens is None:
+            output_tokens = self.expected_output_tokens
+        tokens = input_tokens + output_tokens
+        cost = self.estimate_cost(provider, input_tokens, output_tokens)
+
+        with self.lock:
+            if not self.can_afford(provider, input_tokens, output_tokens):
+                return None
+            held = self.reserved.setdefault(provider, {'tokens': 0, 'cost': 0.0})
+            held['tokens'] += tokens
+            held['cost'] += cost
+        return {'provider': provider, 'tokens': tokens, 'cost': cost, 'released': False}
+
+    def release(self, reservation):
+        """归还预留额度（可重复调用）"""
+        if not reservation:
+            return
+        with self.lock:
+            if reservation['released']:
+                return
+            reservation['released'] = True
+            held = self.reserved.get(reservation['provider'])
+            if held:
+                held['tokens'] = max(0, held['tokens'] - reservation['tokens'])
+                held['cost'] = max(0.0, held['cost'] - reservation['cost'])
+
+    def plan(self, provider, candidates, max_items=None):
+        """
+        在预算内按优先级挑选尽可能多的待分析项
+
+        Args:
+            provider: 提供商
+            candidates: [(item, 预估输入token)]，已按优先级从高到低排序
+            max_items: 最多挑选数量（None表示只受预算限制）
+
+        Returns:
+            (选中的item列表, 因预算跳过的数量)
+        """
+        left = self.remaining(provider)
+        tokens_left = left['tokens']
+        cost_left = left['cost']
+
+        selected = []
+        skipped = 0
+        for item, input_tokens in candidates:
+            if max_items is not None and len(selected) >= max_items:
+                break
+
+            tokens = input_tokens + self.expected_output_tokens
+            cost = self.estimate_cost(provider, input_tokens, self.expected_output_tokens)
+            if (tokens_left is not None and tokens > tokens_left) or (cost_left is not None and cost > cost_left):
+                # 放不下就跳过，继续尝试后面更小的文件
+                skipped += 1
+                continue
+
+            selected.append(item)
+            if tokens_left is not None:
+                tokens_left -= tokens
+            if cost_left is not None:
+                cost_left -= cost
+
+        return selected, skipped
+
+    def record(self, provider, usage, reservation=None):
+        """
+        记录一次调用的实际用量
+
+        Args:
+            provider: 提供商
+            usage: {'input_tokens', 'output_tokens', 'estimated'}
+            reservation: reserve() 返回的预留记录，写入当天用量后归还
+        """
+        cost = self.estimate_cost(provider, usage['input_tokens'], usage['output_tokens'])
+        usage['cost'] = round(cost, 6)
+
+        with self.lock:
+            self._add_usage(self.run_usage, provider, usage, cost)
+
+        try:
+            with self._file_locked():
+                history = self._load_usage_history()
+                today = datetime.now().strftime('%Y-%m-%d')
+                self._add_usage(history.setdefault(today, {}), provider, usage, cost)
+
+                # 只保留最近30天
+                cutoff = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+                history = {day: stats for day, stats in history.items() if day >= cutoff}
+                self._write_usage_history(history)
+        except Exception as e:
+            print(f"保存AI用量记录失败: {e}")
+        finally:
+            self.release(reservation)
+
+    def _add_usage(self, bucket, provider, usage, cost):
+        """把一次调用的用量累加到 {提供商: 统计} 中"""
+        stats = bucket.setdefault(provider, self._empty_usage())
+        stats['calls'] += 1
+        stats['input_tokens'] += usage['input_tokens']
+        stats['output_tokens'] += usage['output_tokens']
+        stats['cost'] = round(stats['cost'] + cost, 6)
+        if usage.get('estimated'):
+            stats['estimated_calls'] += 1
+
+    def daily_usage(self):
+        """当天各提供商的用量（所有进程合计）"""
+        return self._load_usage_history().get(datetime.now().strftime('%Y-%m-%d'), {})
+
+    def summary(self):
+        """本次运行的用量汇总（写入检测报告）"""
+        with self.lock:
+            providers = {p: dict(stats) for p, stats in self.run_usage.items()}
+
+        return {
+            'providers': providers,
+            'total_tokens': sum(s['input_tokens'] + s['output_tokens'] for s in providers.values()),
+            'total_cost': round(sum(s['cost'] for s in providers.values()), 6)
+        }
+
+    def _load_usage_history(self):
+        """加载每日用量记录"""
+        if not os.path.exists(self.usage_file):
+            return {}
+
+        try:
+            with open(self.usage_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    @contextmanager
+    def _file_locked(self):
+        """进程间文件锁，多个分析器同时记录用量时依次读取-合并-写入"""
+        os.makedirs(os.path.dirname(self.usage_file) or '.', exist_ok=True)
+        with open(self.usage_file + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_usage_history(self, history):
+        """写入临时文件后原子替换"""
+        tmp_file = f"{self.usage_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(history, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, self.usage_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
@@ -5,31 +5,67 @@ BTAUTOCHECK AI共识分析引擎
 AI Consensus Analysis Engine
 """
 
+import re
 import json
+import time
+import hashlib
+import random
 import statistics
+import threading
+from collections import Counter
+from concurrent.futures import Future, wait, FIRST_COMPLETED
 from ai_analyzer import AIAnalyzer
 
+# 发现聚类参数
+LINE_WINDOW = 20              # 行号窗口大小，相邻窗口视为同一位置
+SHINGLE_SIZE = 3              # 描述文本的字符shingle长度
+SIMILARITY_THRESHOLD = 0.35   # Jaccard相似度阈值
+MINHASH_BANDS = 16
+MINHASH_ROWS = 2
+MINHASH_PERMUTATIONS = MINHASH_BANDS * MINHASH_ROWS
+# 固定种子的异或掩码，模拟MinHash的多个随机置换（结果可复现）
+MINHASH_MASKS = [random.Random(seed).getrandbits(64) for seed in range(MINHASH_PERMUTATIONS)]
+
+SEVERITY_ALIASES = {
+    'critical': 'high', 'high': 'high', '高': 'high', '高危': 'high', '严重': 'high',
+    'medium': 'medium', 'moderate': 'medium', '中': 'medium', '中危': 'medium', '中等': 'medium',
+    'low': 'low', 'info': 'low', '低': 'low', '低危': 'low', '轻微': 'low'
+}
+
 class AIConsensusAnalyzer:
     """AI共识分析器 - 使用多个AI模型进行交叉验证"""
     
     def __init__(self, config_file='config.json'):
         self.analyzer = AIAnalyzer(config_file)
-        self.config = self.analyzer.config
     
-    def analyze_with_consensus(self, code_sample, file_info="", min_ais=2, max_ais=3):
+    @property
+    def config(self):
+        """当前配置（与分析器共用 SecureConfig 缓存）"""
+        return self.analyzer.config
+    
+    def analyze_with_consensus(self, code_sample, file_info="", min_ais=2, max_ais=3,
+                               score_tolerance=None, call_timeout=None):
         """
-        使用多个AI进行共识分析
+        使用多个AI进行共识分析（并发调用，达到法定数量后提前结束）
         
         Args:
             code_sample: 代码样本
             file_info: 文件信息
             min_ais: 最少使用的AI数量
             max_ais: 最多使用的AI数量
+            score_tolerance: 评分容差，min_ais个结果的评分差不超过该值即视为达成共识
+            call_timeout: 单次调用的截止时间（秒）
             
         Returns:
             共识分析结果
         """
         ai_config = self.config.get('ai_providers', {})
+        consensus_config = ai_config.get('consensus_mode', {})
+        
+        if score_tolerance is None:
+            score_tolerance = consensus_config.get('score_tolerance', 10)
+        if call_timeout is None:
+            call_timeout = consensus_config.get('call_timeout', 90)
         
         if not ai_config.get('enabled', False):
             return {
@@ -40,7 +76,7 @@ class AIConsensusAnalyzer:
         # 获取启用的AI列表
         enabled_ais = []
         for provider, provider_config in ai_config.items():
-            if provider in ['enabled', 'primary_provider', 'fallback_enabled']:
+            if provider in ['enabled', 'primary_provider', 'fallback_enabled', 'consensus_mode']:
                 continue
             if isinstance(provider_config, dict) and provider_config.get('enabled', False):
                 enabled_ais.append(provider)
@@ -58,16 +94,40 @@ class AIConsensusAnalyzer:
         print(f"参与AI: {', '.join(ais_to_use)}")
         print("=" * 60)
         
-        # 调用多个AI进行分析
+        prompt = self.analyzer._build_security_prompt(code_sample, file_info)
+        
+        # 并发调用多个AI进行分析，每个调用有各自的截止时间
         results = []
+        early_stopped = False
+        cancel = threading.Event()
+        futures = {}
+        deadlines = {}
         for ai_provider in ais_to_use:
-            try:
-                print(f"🔍 正在调用 {ai_provider}...")
-                
-                provider_config = ai_config.get(ai_provider, {})
-                prompt = self.analyzer._build_security_prompt(code_sample, file_info)
-                
-                result = self.analyzer._call_ai_provider(ai_provider, prompt, provider_config)
+            print(f"🔍 正在调用 {ai_provider}...")
+            provider_config = dict(ai_config.get(ai_provider, {}), _timeout=call_timeout, _cancel=cancel)
+            future = self._submit(self.analyzer._call_ai_provider, ai_provider, prompt, provider_config)
+            futures[future] = ai_provider
+            deadlines[future] = time.monotonic() + call_timeout
+        
+        pending = set(futures)
+        timed_out = set()
+        while pending:
+            now = time.monotonic()
+            expired = {f for f in pending if deadlines[f] <= now}
+            timed_out |= expired
+            pending -= expired
+            if not pending:
+                break
+            
+            remaining = min(deadlines[f] for f in pending) - now
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                ai_provider = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"❌ {ai_provider} 异常: {e}")
+                    continue
                 
                 if result:
                     result['provider'] = ai_provider
@@ -75,19 +135,33 @@ class AIConsensusAnalyzer:
                     print(f"✅ {ai_provider}: 评分 {result.get('security_score', 'N/A')}")
                 else:
                     print(f"❌ {ai_provider}: 调用失败")
-                    
-            except Exception as e:
-                print(f"❌ {ai_provider} 异常: {e}")
-                continue
+            
+            # 已有min_ais个结果评分一致，无需等待其余AI
+            if pending and self._quorum_reached(results, min_ais, score_tolerance):
+                early_stopped = True
+                break
+        
+        # 不再等待的调用：流式调用会在下一个事件时断开，普通请求最迟在 call_timeout 后结束；
+        # 已发出的请求仍会计费，其用量在调用结束时计入预算
+        cancel.set()
+        abandoned_ais = [{'provider': futures[f], 'reason': '调用超时'}
+                         for f in futures if f in timed_out]
+        abandoned_ais += [{'provider': futures[f], 'reason': '已达成共识'}
+                          for f in futures if f in pending]
+        for item in abandoned_ais:
+            print(f"⏹️  放弃等待 {item['provider']}（{item['reason']}，已发出的请求仍计入用量）")
         
         if len(results) < min_ais:
             return {
                 'consensus_available': False,
-                'message': f'只有{len(results)}个AI成功响应，不足{min_ais}个'
+                'message': f'只有{len(results)}个AI成功响应，不足{min_ais}个',
+                'abandoned_ais': abandoned_ais
             }
         
         # 进行共识分析
         consensus = self._calculate_consensus(results)
+        consensus['early_stopped'] = early_stopped
+        consensus['abandoned_ais'] = abandoned_ais
         
         print(f"\n📊 共识分析结果:")
         print(f"  平均评分: {consensus['consensus_score']}")
@@ -97,6 +171,36 @@ class AIConsensusAnalyzer:
         
         return consensus
     
+    def _submit(self, fn, *args):
+        """
+        在守护线程中执行调用
+        
+        不使用线程池：放弃等待的调用不会阻塞解释器退出。
+        """
+        future = Future()
+        
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+        
+        threading.Thread(target=run, daemon=True).start()
+        return future
+    
+    def _quorum_reached(self, results, min_ais, score_tolerance):
+        """判断是否已有min_ais个结果的评分落在容差范围内"""
+        if len(results) < min_ais:
+            return False
+        
+        scores = sorted(r.get('security_score', 0) for r in results)
+        for i in range(len(scores) - min_ais + 1):
+            if scores[i + min_ais - 1] - scores[i] <= score_tolerance:
+                return True
+        return False
+    
     def _calculate_consensus(self, results):
         """计算AI共识"""
         # 提取评分
@@ -119,9 +223,10 @@ class AIConsensusAnalyzer:
             agreement_level = 'unknown'
             agreement_text = '无法判断'
         
-        # 找出共同发现的问题
-        common_findings = self._find_common_findings(results)
-        divergent_findings = self._find_divergent_findings(results)
+        # 聚类后找出共同发现和分歧发现的问题
+        clusters = self._cluster_findings(results)
+        common_findings = self._find_common_findings(clusters, len(results))
+        divergent_findings = self._find_divergent_findings(clusters, len(results))
         
         # 综合评分（取平均值）
         consensus_score = round(statistics.mean(scores), 1) if scores else 0
@@ -144,56 +249,145 @@ class AIConsensusAnalyzer:
             'recommendation': self._generate_recommendation(consensus_score, agreement_level, common_findings)
         }
     
-    def _find_common_findings(self, results):
-        """找出所有AI都发现的问题"""
-        if len(results) < 2:
-            return []
+    def _cluster_findings(self, results):
+        """
+        将各AI的发现聚类为同一问题
         
-        # 收集所有findings
-        all_findings = []
+        先按 (文件, 行号窗口, 类型, 严重程度) 归一化，再用描述文本的
+        MinHash签名做LSH分桶，只在同桶候选之间比较相似度。桶内候选全部比较，
+        同一文件中大量相似发现时也不会漏掉排在后面的匹配项。
+        同一AI的不同发现始终是不同的问题，不会合并。
+        
+        Returns:
+            聚类列表，每个聚类包含代表描述和发现它的AI集合
+        """
+        items = []
         for r in results:
-            findings = r.get('findings', [])
-            for f in findings:
-                if isinstance(f, dict):
-                    all_findings.append(f.get('description', str(f)))
-                else:
-                    all_findings.append(str(f))
+            provider = r.get('provider') or r.get('ai_provider', 'unknown')
+            for f in r.get('findings', []):
+                if not isinstance(f, dict):
+                    f = {'description': str(f)}
+                description = str(f.get('description', '')).strip() or str(f)
+                shingles = self._shingles(description)
+                items.append({
+                    'provider': provider,
+                    'finding': f,
+                    'description': description,
+                    'file': str(f.get('file', '')).strip(),
+                    'line_window': self._line_window(f.get('line')),
+                    'type': str(f.get('type', '')).strip().lower(),
+                    'severity': SEVERITY_ALIASES.get(str(f.get('severity', '')).strip().lower(), 'unknown'),
+                    'shingles': shingles,
+                    'signature': self._minhash(shingles)
+                })
         
-        # 找出出现次数 >= 结果数量的问题（所有AI都发现）
-        from collections import Counter
-        finding_counts = Counter(all_findings)
+        parent = list(range(len(items)))
+        # 每个聚类包含的AI，同一AI的两条发现不会被合并
+        cluster_providers = [{item['provider']} for item in items]
         
-        common = [
-            {'description': finding, 'agreement_count': count}
-            for finding, count in finding_counts.items()
-            if count >= len(results)  # 所有AI都发现
-        ]
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
         
-        return common
+        buckets = {}
+        for idx, item in enumerate(items):
+            # 结构一致的发现和MinHash同桶的发现都只是候选，仍需描述相似才合并
+            keys = [('key', item['file'], item['line_window'], item['type'], item['severity'])]
+            for band in range(MINHASH_BANDS):
+                start = band * MINHASH_ROWS
+                keys.append(('band', item['file'], band, tuple(item['signature'][start:start + MINHASH_ROWS])))
+            
+            for key in keys:
+                members = buckets.setdefault(key, [])
+                for other in members:
+                    root, other_root = find(idx), find(other)
+                    if root == other_root:
+                        break
+                    if cluster_providers[root] & cluster_providers[other_root]:
+                        continue
+                    if self._similar(items[other], item):
+                        parent[root] = other_root
+                        cluster_providers[other_root] |= cluster_providers[root]
+                        break
+                members.append(idx)
+        
+        groups = {}
+        for idx, item in enumerate(items):
+            groups.setdefault(find(idx), []).append(item)
+        
+        clusters = []
+        for members in groups.values():
+            providers = sorted(set(m['provider'] for m in members))
+            representative = max(members, key=lambda m: len(m['description']))
+            clusters.append({
+                'description': representative['description'],
+                'type': representative['finding'].get('type', ''),
+                'severity': Counter(m['severity'] for m in members).most_common(1)[0][0],
+                'file': representative['file'],
+                'line': representative['finding'].get('line'),
+                'providers': providers,
+                'agreement_count': len(providers),
+                'variants': len(members)
+            })
+        
+        return clusters
     
-    def _find_divergent_findings(self, results):
-        """找出只有部分AI发现的问题"""
-        if len(results) < 2:
+    def _shingles(self, text):
+        """将描述归一化后切分为字符shingle（兼容中英文）"""
+        normalized = re.sub(r'[\W_]+', ' ', text.lower()).strip()
+        if len(normalized) <= SHINGLE_SIZE:
+            return {normalized} if normalized else set()
+        return {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    
+    def _minhash(self, shingles):
+        """计算MinHash签名"""
+        if not shingles:
+            return [0] * MINHASH_PERMUTATIONS
+        
+        hashes = [int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'big')
+                  for s in shingles]
+        return [min([h ^ mask for h in hashes]) for mask in MINHASH_MASKS]
+    
+    def _line_window(self, line):
+        """将行号映射到窗口，无行号时返回None"""
+        try:
+            return int(line) // LINE_WINDOW
+        except (TypeError, ValueError):
+            return None
+    
+    def _similar(self, a, b):
+        """判断两个候选发现是否描述同一问题"""
+        if a['line_window'] is not None and b['line_window'] is not None:
+            if abs(a['line_window'] - b['line_window']) > 1:
+                return False
+        
+        if not a['shingles'] or not b['shingles']:
+            return False
+        
+        jaccard = len(a['shingles'] & b['shingles']) / len(a['shingles'] | b['shingles'])
+        return jaccard >= SIMILARITY_THRESHOLD
+    
+    def _find_common_findings(self, clusters, total_ais):
+        """找出所有AI都发现的问题"""
+        if total_ais < 2:
             return []
         
-        # 收集所有findings
-        all_findings = []
-        for r in results:
-            findings = r.get('findings', [])
-            for f in findings:
-                if isinstance(f, dict):
-                    all_findings.append(f.get('description', str(f)))
-                else:
-                    all_findings.append(str(f))
+        common = [c for c in clusters if c['agreement_count'] >= total_ais]
+        common.sort(key=lambda x: x['variants'], reverse=True)
         
-        # 找出出现次数 < 结果数量的问题（部分AI发现）
-        from collections import Counter
-        finding_counts = Counter(all_findings)
+        return common
+    
+    def _find_divergent_findings(self, clusters, total_ais):
+        """找出只有部分AI发现的问题"""
+        if total_ais < 2:
+            return []
         
         divergent = [
-            {'description': finding, 'agreement_count': count, 'total_ais': len(results)}
-            for finding, count in finding_counts.items()
-            if 1 <= count < len(results)  # 部分AI发现
+            dict(c, total_ais=total_ais)
+            for c in clusters
+            if 1 <= c['agreement_count'] < total_ais  # 部分AI发现
         ]
         
         # 按同意数量排序
@@ -249,6 +443,8 @@ def upload_data(data):
         print(f"  一致性: {result['agreement_text']}")
         print(f"  共同发现: {len(result['common_findings'])}个")
         print(f"  分歧问题: {len(result['divergent_findings'])}个")
+        for item in result['abandoned_ais']:
+            print(f"  放弃等待: {item['provider']}（{item['reason']}）")
         print(f"\n💡 建议: {result['recommendation']}")
     else:
         print(f"\n⚠️ {result['message']}")
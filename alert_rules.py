@@ -9,24 +9,21 @@ import json
 import os
 from datetime import datetime, timedelta
 from notification import NotificationManager
+from report_store import load_summary
+from secure_config import SecureConfig
 
 class AlertRulesEngine:
     """智能告警规则引擎"""
     
     def __init__(self, config_file='config.json'):
-        self.config_file = config_file
-        self.config = self.load_config()
+        self.secure_config = SecureConfig(config_file)
         self.alert_history_file = 'logs/alert_history.json'
-        self.notif_manager = NotificationManager()
+        self.notif_manager = NotificationManager(config_file)
     
-    def load_config(self):
-        """加载配置"""
-        try:
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"加载配置失败: {e}")
-            return {}
+    @property
+    def config(self):
+        """解密后的当前配置（进程内共享缓存，配置文件修改后立即生效）"""
+        return self.secure_config.get_config()
     
     def should_alert(self, check_result):
         """判断是否应该发送告警"""
@@ -327,9 +324,8 @@ BT-Panel版本检测报告
             reports.sort(key=os.path.getmtime, reverse=True)
             
             if len(reports) >= 2:
-                with open(reports[1], 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    return data.get('static_analysis', {}).get('security_score', 0)
+                data = load_summary(reports[1])
+                return data.get('static_analysis', {}).get('security_score', 0)
         except:
             pass
         
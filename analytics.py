@@ -5,66 +5,217 @@ BTAUTOCHECK 数据分析引擎
 Analytics Engine for Trend Analysis and Statistics
 """
 
-import json
 import os
-import glob
+import bisect
+import threading
 from datetime import datetime, timedelta
-from collections import defaultdict
-import statistics
+from collections import defaultdict, Counter
+from report_index import ReportIndex
+
+class ReportSummaryCache:
+    """
+    进程内报告摘要缓存
+    
+    以 (路径, mtime, size) 判断报告是否变化，每次刷新只需列一次目录，
+    新增/修改的报告才从索引加载，汇总数据随之增量更新。
+    """
+    
+    def __init__(self, downloads_dir, index):
+        self.downloads_dir = downloads_dir
+        self.index = index
+        self.lock = threading.Lock()
+        self.entries = {}      # path -> ((mtime, size), summary)
+        self.ordered = []      # [(check_time, path)]，按检测时间排序
+        self.synced = False
+        
+        # 增量维护的汇总数据
+        self.static_sum = 0
+        self.static_count = 0
+        self.ai_sum = 0
+        self.ai_count = 0
+        self.versions = Counter()
+        self.providers = defaultdict(lambda: {'count': 0, 'success': 0, 'total_score': 0,
+                                              'total_tokens': 0, 'total_cost': 0.0})
+        self.score_range = None  # (最低分, 最高分)，删除报告后置None懒重算
+    
+    def refresh(self):
+        """按目录列表增量刷新缓存"""
+        with self.lock:
+            if not self.synced:
+                # 首次加载时清理索引中已不存在的报告
+                self.index.sync()
+                self.synced = True
+            
+            current = {}
+            try:
+                with os.scandir(self.downloads_dir) as it:
+                    for entry in it:
+                        if entry.name.startswith('security_report_') and entry.name.endswith('.json'):
+                            st = entry.stat()
+                            current[os.path.join(self.downloads_dir, entry.name)] = (st.st_mtime, st.st_size)
+            except OSError:
+                pass
+            
+            for path in list(self.entries):
+                if path not in current:
+                    self._remove(path)
+                    self.index.remove_report(path)
+            
+            for path, key in current.items():
+                cached = self.entries.get(path)
+                if cached and cached[0] == key:
+                    continue
+                summary = self._load(path, key)
+                if cached:
+                    self._remove(path)
+                if summary:
+                    self._add(path, key, summary)
+    
+    def _load(self, path, key):
+        """从索引读取报告摘要，索引过期时重新索引"""
+        try:
+            summary = self.index.get_report(path)
+            if not summary or (summary['mtime'], summary['size']) != key:
+                self.index.index_report(path)
+                summary = self.index.get_report(path)
+            return summary
+        except Exception as e:
+            print(f"读取报告失败 {path}: {e}")
+            return None
+    
+    def _add(self, path, key, summary):
+        self.entries[path] = (key, summary)
+        bisect.insort(self.ordered, (summary['check_time'], path))
+        
+        if summary['static_score'] > 0:
+            self.static_sum += summary['static_score']
+            self.static_count += 1
+        if summary['ai_score'] > 0:
+            self.ai_sum += summary['ai_score']
+            self.ai_count += 1
+        self.versions[summary['version']] += 1
+        
+        usage = summary['ai_usage']
+        if usage:
+            stats = self.providers[usage['provider']]
+            stats['count'] += 1
+            stats['total_score'] += usage['average_score']
+            stats['success'] += 1 if usage['average_score'] > 0 else 0
+            stats['total_tokens'] += usage['total_tokens'] or 0
+            stats['total_cost'] += usage['total_cost'] or 0
+        
+        if self.score_range is not None:
+            scores = [v for v in (summary['static_score'], summary['ai_score']) if v > 0]
+            if scores:
+                low, high = self.score_range
+                self.score_range = (min(scores + ([low] if low is not None else [])),
+                                    max(scores + ([high] if high is not None else [])))
+    
+    def _remove(self, path):
+        _, summary = self.entries.pop(path)
+        self.ordered.remove((summary['check_time'], path))
+        
+        if summary['static_score'] > 0:
+            self.static_sum -= summary['static_score']
+            self.static_count -= 1
+        if summary['ai_score'] > 0:
+            self.ai_sum -= summary['ai_score']
+            self.ai_count -= 1
+        self.versions[summary['version']] -= 1
+        if not self.versions[summary['version']]:
+            del self.versions[summary['version']]
+        
+        usage = summary['ai_usage']
+        if usage:
+            stats = self.providers[usage['provider']]
+            stats['count'] -= 1
+            stats['total_score'] -= usage['average_score']
+            stats['success'] -= 1 if usage['average_score'] > 0 else 0
+            stats['total_tokens'] -= usage['total_tokens'] or 0
+            stats['total_cost'] -= usage['total_cost'] or 0
+            if not stats['count']:
+                del self.providers[usage['provider']]
+        
+        self.score_range = None
+    
+    # 以下读取方法都在锁内复制数据，避免与其它线程的 refresh() 交错
+    
+    def reports(self, since=None):
+        """按检测时间排序的报告摘要（since 为 '%Y-%m-%d %H:%M:%S' 起始时间）"""
+        with self.lock:
+            start = bisect.bisect_left(self.ordered, (since, '')) if since else 0
+            return [self.entries[path][1] for _, path in self.ordered[start:]]
+    
+    def latest(self):
+        with self.lock:
+            return self.entries[self.ordered[-1][1]][1] if self.ordered else None
+    
+    def provider_stats(self):
+        """各AI提供商的汇总数据（副本）"""
+        with self.lock:
+            return {provider: dict(stats) for provider, stats in self.providers.items()}
+    
+    def totals(self):
+        """汇总数据的一致快照"""
+        with self.lock:
+            lowest, highest = self._score_range()
+            return {
+                'total_reports': len(self.entries),
+                'static_sum': self.static_sum,
+                'static_count': self.static_count,
+                'ai_sum': self.ai_sum,
+                'ai_count': self.ai_count,
+                'total_versions': len(self.versions),
+                'lowest_score': lowest,
+                'highest_score': highest,
+                'latest_check': self.entries[self.ordered[-1][1]][1]['check_time'] if self.ordered else None
+            }
+    
+    def _score_range(self):
+        """最低分和最高分（评分为0的不计入，调用方需持有锁）"""
+        if self.score_range is None:
+            scores = [v for _, summary in self.entries.values()
+                      for v in (summary['static_score'], summary['ai_score']) if v > 0]
+            self.score_range = (min(scores), max(scores)) if scores else (None, None)
+        return self.score_range
+
 
 class AnalyticsEngine:
     """数据分析引擎"""
     
+    # 同一进程内的引擎实例共享摘要缓存（按报告目录区分）
+    _caches = {}
+    _caches_lock = threading.Lock()
+    
     def __init__(self):
         self.downloads_dir = 'downloads'
         self.config_file = 'config.json'
+        with self._caches_lock:
+            if self.downloads_dir not in self._caches:
+                self._caches[self.downloads_dir] = ReportSummaryCache(
+                    self.downloads_dir, ReportIndex(self.downloads_dir))
+            self.cache = self._caches[self.downloads_dir]
+        self.index = self.cache.index
     
     def get_all_reports_data(self):
-        """加载所有历史报告数据"""
-        reports = []
-        pattern = os.path.join(self.downloads_dir, 'security_report_*.json')
-        files = glob.glob(pattern)
-        
-        for filepath in files:
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                    # 提取关键信息
-                    version = data.get('version', 'unknown')
-                    check_time = data.get('check_time', '')
-                    
-                    static_analysis = data.get('static_analysis', {})
-                    ai_analysis = data.get('ai_analysis', {})
-                    
-                    reports.append({
-                        'version': version,
-                        'check_time': check_time,
-                        'static_score': static_analysis.get('security_score', 0),
-                        'ai_score': ai_analysis.get('average_score', 0) if ai_analysis else 0,
-                        'risk_files': static_analysis.get('risk_files_count', 0),
-                        'total_issues': static_analysis.get('total_issues', 0),
-                        'file_path': filepath
-                    })
-            except Exception as e:
-                print(f"读取报告失败 {filepath}: {e}")
-                continue
-        
-        # 按时间排序
-        reports.sort(key=lambda x: x['check_time'])
-        
-        return reports
+        """加载所有历史报告摘要（增量刷新进程内缓存）"""
+        self.cache.refresh()
+        return [{
+            'version': r['version'],
+            'check_time': r['check_time'],
+            'static_score': r['static_score'],
+            'ai_score': r['ai_score'],
+            'risk_files': r['risk_files'],
+            'total_issues': r['total_issues'],
+            'file_path': r['file_path']
+        } for r in self.cache.reports()]
     
     def get_score_trend(self, days=30):
         """获取评分趋势（最近N天）"""
-        reports = self.get_all_reports_data()
-        
         # 过滤最近N天的数据
         cutoff_date = datetime.now() - timedelta(days=days)
-        recent_reports = [
-            r for r in reports 
-            if self._parse_date(r['check_time']) >= cutoff_date
-        ]
+        self.cache.refresh()
+        recent_reports = self.cache.reports(since=cutoff_date.strftime('%Y-%m-%d %H:%M:%S'))
         
         if not recent_reports:
             return {
@@ -96,8 +247,7 @@ class AnalyticsEngine:
         if not latest_report:
             return {}
         
-        static_analysis = latest_report.get('static_analysis', {})
-        deduction_details = static_analysis.get('deduction_details', {})
+        category_stats = latest_report['category_stats']
         
         # 构建分类数据
         distribution = {}
@@ -117,8 +267,7 @@ class AnalyticsEngine:
         }
         
         for key, label in category_map.items():
-            detail = deduction_details.get(key, {})
-            count = detail.get('count', 0)
+            count = category_stats.get(key, 0)
             if count > 0:
                 distribution[label] = count
         
@@ -126,48 +275,26 @@ class AnalyticsEngine:
     
     def get_ai_usage_stats(self):
         """获取AI使用统计"""
-        reports = self.get_all_reports_data()
-        
-        ai_stats = defaultdict(lambda: {'count': 0, 'total_score': 0, 'success': 0})
-        
-        for report in reports:
-            filepath = report['file_path']
-            try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    ai_analysis = data.get('ai_analysis', {})
-                    
-                    if ai_analysis:
-                        provider = ai_analysis.get('provider', 'unknown')
-                        score = ai_analysis.get('average_score', 0)
-                        
-                        ai_stats[provider]['count'] += 1
-                        ai_stats[provider]['total_score'] += score
-                        if score > 0:
-                            ai_stats[provider]['success'] += 1
-            except:
-                continue
+        self.cache.refresh()
         
         # 计算平均分
         result = {}
-        for provider, stats in ai_stats.items():
+        for provider, stats in self.cache.provider_stats().items():
             result[provider] = {
                 'count': stats['count'],
                 'success_rate': (stats['success'] / stats['count'] * 100) if stats['count'] > 0 else 0,
-                'avg_score': (stats['total_score'] / stats['count']) if stats['count'] > 0 else 0
+                'avg_score': (stats['total_score'] / stats['count']) if stats['count'] > 0 else 0,
+                'total_tokens': stats['total_tokens'],
+                'total_cost': round(stats['total_cost'], 4)
             }
         
         return result
     
     def get_check_frequency_stats(self, days=30):
         """获取检测频率统计"""
-        reports = self.get_all_reports_data()
-        
         cutoff_date = datetime.now() - timedelta(days=days)
-        recent_reports = [
-            r for r in reports 
-            if self._parse_date(r['check_time']) >= cutoff_date
-        ]
+        self.cache.refresh()
+        recent_reports = self.cache.reports(since=cutoff_date.strftime('%Y-%m-%d %H:%M:%S'))
         
         # 按日期分组统计
         daily_counts = defaultdict(int)
@@ -195,9 +322,10 @@ class AnalyticsEngine:
     
     def get_summary_stats(self):
         """获取汇总统计"""
-        reports = self.get_all_reports_data()
+        self.cache.refresh()
+        totals = self.cache.totals()
         
-        if not reports:
+        if not totals['total_reports']:
             return {
                 'total_reports': 0,
                 'avg_static_score': 0,
@@ -207,34 +335,20 @@ class AnalyticsEngine:
                 'total_versions': 0
             }
         
-        static_scores = [r['static_score'] for r in reports if r['static_score'] > 0]
-        ai_scores = [r['ai_score'] for r in reports if r['ai_score'] > 0]
-        all_scores = static_scores + ai_scores
-        
         return {
-            'total_reports': len(reports),
-            'avg_static_score': round(statistics.mean(static_scores), 2) if static_scores else 0,
-            'avg_ai_score': round(statistics.mean(ai_scores), 2) if ai_scores else 0,
-            'highest_score': max(all_scores) if all_scores else 0,
-            'lowest_score': min(all_scores) if all_scores else 0,
-            'total_versions': len(set(r['version'] for r in reports)),
-            'latest_check': reports[-1]['check_time'] if reports else 'Never'
+            'total_reports': totals['total_reports'],
+            'avg_static_score': round(totals['static_sum'] / totals['static_count'], 2) if totals['static_count'] else 0,
+            'avg_ai_score': round(totals['ai_sum'] / totals['ai_count'], 2) if totals['ai_count'] else 0,
+            'highest_score': totals['highest_score'] if totals['highest_score'] is not None else 0,
+            'lowest_score': totals['lowest_score'] if totals['lowest_score'] is not None else 0,
+            'total_versions': totals['total_versions'],
+            'latest_check': totals['latest_check']
         }
     
     def _get_latest_report(self):
-        """获取最新报告"""
-        reports = self.get_all_reports_data()
-        if not reports:
-            return None
-        
-        latest = reports[-1]
-        filepath = latest['file_path']
-        
-        try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return None
+        """获取最新报告摘要（含 file_path 和 category_stats）"""
+        self.cache.refresh()
+        return self.cache.latest()
     
     def _parse_date(self, date_str):
         """解析日期字符串"""
@@ -12,6 +12,7 @@ import json
 from datetime import datetime
 from notification import NotificationManager
 from alert_rules import AlertRulesEngine
+from report_store import load_summary
 
 def run_script(script_name, description):
     """运行子脚本"""
@@ -100,20 +101,20 @@ def main():
         report_files = glob.glob('downloads/security_report_*.json')
         if report_files:
             latest_report = sorted(report_files)[-1]
-            with open(latest_report, 'r', encoding='utf-8') as f:
-                report_data = json.load(f)
+            # 告警只需要评分和分类统计，读取摘要即可
+            report_data = load_summary(latest_report)
+            
+            # 使用智能告警规则引擎判断是否发送告警
+            alert_engine = AlertRulesEngine()
+            if alert_engine.should_alert(report_data):
+                print("✅ 智能告警已发送")
+            else:
+                print("ℹ️  未触发告警条件或在静默时间")
                 
-                # 使用智能告警规则引擎判断是否发送告警
-                alert_engine = AlertRulesEngine()
-                if alert_engine.should_alert(report_data):
-                    print("✅ 智能告警已发送")
-                else:
-                    print("ℹ️  未触发告警条件或在静默时间")
-                    
-                # 兼容旧的通知方式（如果未配置告警规则）
-                version = report_data.get('version', 'Unknown')
-                score = report_data.get('static_analysis', {}).get('security_score', 0)
-                is_safe = report_data.get('static_analysis', {}).get('is_safe', False)
+            # 兼容旧的通知方式（如果未配置告警规则）
+            version = report_data.get('version', 'Unknown')
+            score = report_data.get('static_analysis', {}).get('security_score', 0)
+            is_safe = report_data.get('static_analysis', {}).get('is_safe', False)
                 
     except Exception as e:
         print(f"⚠️  发送安全检测通知失败: {e}")
@@ -9,39 +9,218 @@ import os
 import sys
 import shutil
 import json
+import stat
 import tarfile
 import hashlib
+import zlib
+import gzip
+import random
+import fcntl
+import signal
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+from secure_config import SecureConfig
+
+# 备份类型：archive 完整压缩包；dedup 分块去重（快照清单 + 共享数据块）；
+# snapshot 同文件系统上的reflink快照目录（随后在后台生成压缩包；不支持reflink时改为 archive）
+BACKUP_TYPES = ('archive', 'dedup', 'snapshot')
+
+# Linux FICLONE ioctl（btrfs/xfs等支持reflink的文件系统上做写时复制克隆）
+FICLONE = 0x40049409
+
+# 去重备份的数据块大小（大文件按此切分，小文件整体作为一个数据块）
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# 去重备份清单文件后缀
+MANIFEST_SUFFIX = '.manifest.json'
+
+# 压缩包格式对应的扩展名
+ARCHIVE_SUFFIXES = {
+    'gzip': '.tar.gz',
+    'zstd': '.tar.zst',
+}
+
+# 并行gzip每个压缩块的大小
+GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+
+# 抽样校验时解压的压缩块/数据块数量
+SAMPLE_BLOCKS = 8
+
+# 校验时的读取块大小
+VERIFY_READ_SIZE = 1024 * 1024
+
+# 数据块回收时跳过最近写入的数据块（秒），避免删除其它进程正在写入的快照引用的数据块
+CHUNK_GC_GRACE_SECONDS = 3600
+
+
+def zstd_available():
+    try:
+        import zstandard  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class DigestWriter:
+    """写入时同步计算MD5和大小，避免写完后重新读取整个备份文件"""
+    
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.size = 0
+    
+    def write(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+    
+    def flush(self):
+        self.fileobj.flush()
+
+
+class DigestReader:
+    """读取时同步计算MD5，解压校验与MD5校验只需读取一遍文件"""
+    
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+    
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.md5.update(data)
+        return data
+    
+    def drain(self):
+        """读完剩余内容（tar结束标记之后的填充也计入MD5）"""
+        while self.read(VERIFY_READ_SIZE):
+            pass
+
+
+class HashingReader:
+    """打包时计算成员内容的SHA256（tarfile读取文件内容时顺带计算，不重复读取）"""
+    
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+    
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class ParallelGzipWriter:
+    """
+    多线程gzip压缩
+    
+    输入按 GZIP_BLOCK_SIZE 分块，每块在线程池中独立压缩为一个gzip成员，按顺序写出。
+    多成员gzip是标准格式，tarfile/gzip/gunzip 均可直接读取。
+    """
+    
+    def __init__(self, fileobj, level=6, threads=None):
+        self.fileobj = fileobj
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+        # 每个gzip成员在输出文件中的 (偏移, 长度)，用于抽样校验
+        self.blocks = []
+        self.offset = 0
+    
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= GZIP_BLOCK_SIZE:
+            block = bytes(self.buffer[:GZIP_BLOCK_SIZE])
+            del self.buffer[:GZIP_BLOCK_SIZE]
+            self._submit(block)
+        return len(data)
+    
+    def _submit(self, block):
+        self.pending.append(self.executor.submit(gzip.compress, block, self.level, mtime=0))
+        # 限制在途块数量，控制内存占用
+        while len(self.pending) > self.threads * 2:
+            self._write_block(self.pending.popleft().result())
+    
+    def _write_block(self, compressed):
+        self.blocks.append((self.offset, len(compressed)))
+        self.offset += len(compressed)
+        self.fileobj.write(compressed)
+    
+    def close(self):
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self._write_block(self.pending.popleft().result())
+        self.executor.shutdown()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
 
 class BackupManager:
     """备份管理器"""
     
-    def __init__(self, panel_path='/www/server/panel', backup_path='backups'):
+    def __init__(self, panel_path='/www/server/panel', backup_path='backups', options=None):
         """
         初始化备份管理器
         
         Args:
             panel_path: BT面板安装路径
             backup_path: 备份存储路径
+            options: 备份选项（config.json 中的 backup 配置）
         """
         self.panel_path = panel_path
         self.backup_path = backup_path
         self.backup_info_file = os.path.join(backup_path, 'backup_info.json')
+        self.chunk_path = os.path.join(backup_path, 'chunks')
+        
+        options = options or {}
+        self.backup_type = options.get('type', 'archive')
+        if self.backup_type not in BACKUP_TYPES:
+            self.backup_type = 'archive'
+        self.chunk_level = int(options.get('chunk_compression_level', 3))
+        
+        # 压缩包格式：auto 时优先使用 zstd（需 pip install zstandard），否则并行gzip
+        compression = options.get('compression', 'auto')
+        if compression == 'auto':
+            compression = 'zstd' if zstd_available() else 'gzip'
+        elif compression == 'zstd' and not zstd_available():
+            print("⚠️  未安装zstandard，备份改用并行gzip压缩 (pip install zstandard)")
+            compression = 'gzip'
+        self.compression = compression if compression in ARCHIVE_SUFFIXES else 'gzip'
+        default_level = 3 if self.compression == 'zstd' else 6
+        self.compression_level = int(options.get('compression_level') or default_level)
+        self.compression_threads = int(options.get('compression_threads') or 0) or os.cpu_count() or 1
+        # 恢复前的校验方式：full 单遍完整校验 / sample 抽样校验
+        # （去重备份恢复前只检查数据块是否存在，重建时逐块校验SHA256）
+        self.verify_mode = options.get('verify_mode', 'full')
+        # 保留最近的备份数量（至少保留刚创建的这一个）
+        self.keep_backups = max(1, int(options.get('keep_backups', 5)))
+        self._store_lock_held = False
         
         # 创建备份目录
         os.makedirs(backup_path, exist_ok=True)
     
-    def create_backup(self, version, description=""):
+    def create_backup(self, version, description="", backup_type=None):
         """
         创建面板备份
         
         Args:
             version: 当前面板版本
             description: 备份描述
+            backup_type: 备份类型 archive/dedup，默认使用配置中的类型
             
         Returns:
-            备份文件路径，失败返回None
+            备份文件路径（去重备份为清单文件路径），失败返回None
         """
         print("=" * 70)
         print("📦 创建备份")
@@ -51,9 +230,18 @@ class BackupManager:
             print(f"❌ 面板路径不存在: {self.panel_path}")
             return None
         
+        backup_type = backup_type or self.backup_type
+        if backup_type == 'dedup':
+            return self._create_dedup_backup(version, description)
+        if backup_type == 'snapshot':
+            return self._create_snapshot_backup(version, description)
+        return self._create_archive_backup(version, description)
+    
+    def _create_archive_backup(self, version, description):
+        """创建完整压缩包备份"""
         # 生成备份文件名
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f"panel_backup_{version}_{timestamp}.tar.gz"
+        backup_filename = f"panel_backup_{version}_{timestamp}{ARCHIVE_SUFFIXES[self.compression]}"
         backup_filepath = os.path.join(self.backup_path, backup_filename)
         
         try:
@@ -64,14 +252,9 @@ class BackupManager:
             total, used, free = shutil.disk_usage("/")
             print(f"💿 可用空间: {free // (2**30)} GB")
             
-            # 创建tar.gz压缩备份
-            print("🔄 正在压缩备份...")
-            with tarfile.open(backup_filepath, "w:gz") as tar:
-                tar.add(self.panel_path, arcname=os.path.basename(self.panel_path))
-            
-            # 计算备份文件大小和MD5
-            backup_size = os.path.getsize(backup_filepath)
-            backup_md5 = self._calculate_md5(backup_filepath)
+            # 多线程压缩备份（大小、MD5和成员索引在写入时计算）
+            print(f"🔄 正在压缩备份（{self.compression} 级别{self.compression_level}，{self.compression_threads} 线程）...")
+            backup_size, backup_md5, member_count = self._write_archive(backup_filepath)
             
             print(f"✅ 备份创建成功")
             print(f"📊 备份大小: {backup_size // (2**20)} MB")
@@ -79,11 +262,15 @@ class BackupManager:
             
             # 保存备份信息
             backup_info = {
+                "type": "archive",
+                "compression": self.compression,
+                "compression_level": self.compression_level,
                 "version": version,
                 "filename": backup_filename,
                 "filepath": backup_filepath,
                 "size": backup_size,
                 "md5": backup_md5,
+                "members": member_count,
                 "timestamp": timestamp,
                 "description": description,
                 "panel_path": self.panel_path,
@@ -93,14 +280,13 @@ class BackupManager:
             self._save_backup_info(backup_info)
             
             # 清理旧备份（保留最近5个）
-            self._cleanup_old_backups(keep=5)
+            self._cleanup_old_backups()
             
             return backup_filepath
             
         except Exception as e:
             print(f"❌ 备份创建失败: {e}")
-            if os.path.exists(backup_filepath):
-                os.remove(backup_filepath)
+            self._remove_archive(backup_filepath)
             return None
     
     def restore_backup(self, backup_filepath=None, backup_version=None):
@@ -134,27 +320,45 @@ class BackupManager:
         try:
             # 验证备份文件完整性
             print("🔍 验证备份完整性...")
-            if not self._verify_backup(backup_filepath):
+            if not self._verify_backup(backup_filepath, sample=self.verify_mode == 'sample', deep=False):
                 print("❌ 备份文件校验失败")
                 return False
             
-            # 创建当前面板的临时备份（以防万一）
-            print("🔄 创建安全快照...")
-            temp_backup = self.panel_path + "_temp_backup_" + datetime.now().strftime('%H%M%S')
-            if os.path.exists(self.panel_path):
-                shutil.move(self.panel_path, temp_backup)
+            # 解压到面板目录旁的暂存目录（同一文件系统），期间面板照常运行
+            print("📦 正在解压到暂存目录...")
+            backup_type = self._backup_type_of(backup_filepath)
+            staging_root = self._sibling_path('restore')
+            if backup_type == 'snapshot':
+                # 快照目录本身就是完整的目录树
+                staged_tree = backup_filepath
+            else:
+                staged_tree = os.path.join(staging_root, os.path.basename(os.path.abspath(self.panel_path)))
+                if backup_type == 'dedup':
+                    self._materialize_snapshot(backup_filepath, staged_tree)
+                else:
+                    with self._open_archive(backup_filepath) as tar:
+                        tar.extractall(path=staging_root)
             
-            # 解压备份文件
-            print("📦 正在恢复备份...")
-            with tarfile.open(backup_filepath, "r:gz") as tar:
-                tar.extractall(path=os.path.dirname(self.panel_path))
+            print("🔍 验证暂存目录...")
+            if not self._verify_staged_tree(staged_tree, backup_filepath, backup_type):
+                raise Exception("暂存目录与备份内容不一致")
+            
+            if backup_type == 'snapshot':
+                # 快照目录即将成为面板目录，后台打包不能再读取它
+                self._stop_snapshot_archiver(backup_filepath)
+            
+            # 两次改名完成切换，面板目录缺失的时间只有毫秒级
+            print("🔄 切换目录...")
+            old_tree = self._swap_into_place(staged_tree)
+            
+            if backup_type == 'snapshot':
+                self._snapshot_consumed(backup_filepath)
             
             print("✅ 备份恢复成功")
             
-            # 删除临时备份
-            if os.path.exists(temp_backup):
-                shutil.rmtree(temp_backup)
-                print("🧹 已清理临时文件")
+            # 后台删除旧目录和暂存目录
+            self._remove_in_background(old_tree, staging_root)
+            print("🧹 旧目录将在后台清理")
             
             # 重启面板服务
             print("🔄 正在重启面板服务...")
@@ -169,16 +373,81 @@ class BackupManager:
         except Exception as e:
             print(f"❌ 备份恢复失败: {e}")
             
-            # 尝试恢复临时备份
-            if 'temp_backup' in locals() and os.path.exists(temp_backup):
-                print("🔄 正在恢复临时快照...")
-                if os.path.exists(self.panel_path):
-                    shutil.rmtree(self.panel_path)
-                shutil.move(temp_backup, self.panel_path)
-                print("✅ 已恢复到原始状态")
+            # 切换前失败时面板目录未被改动，只需清理暂存目录
+            if 'staging_root' in locals() and os.path.exists(staging_root):
+                shutil.rmtree(staging_root, ignore_errors=True)
+                print("🧹 已清理暂存目录，面板保持原状")
             
             return False
     
+    def _sibling_path(self, purpose):
+        """面板目录旁的临时路径（同一文件系统，保证 rename 是原子操作）"""
+        parent = os.path.dirname(os.path.abspath(self.panel_path))
+        name = os.path.basename(os.path.abspath(self.panel_path))
+        return os.path.join(parent, f".{name}_{purpose}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+    
+    def _verify_staged_tree(self, staged_tree, backup_filepath, backup_type):
+        """核对暂存目录：每个文件都存在且大小一致（只做stat，不读内容）"""
+        if not os.path.isdir(staged_tree):
+            return False
+        if backup_type == 'snapshot':
+            return True
+        
+        if backup_type == 'dedup':
+            expected = [(entry['path'], entry.get('size'))
+                        for entry in self._load_manifest(backup_filepath)['entries']]
+        else:
+            try:
+                with open(self._index_file(backup_filepath), 'r', encoding='utf-8') as f:
+                    members = json.load(f)['members']
+            except (OSError, ValueError):
+                # 旧备份没有索引，解压成功即视为通过
+                return True
+            root = os.path.basename(os.path.abspath(self.panel_path))
+            expected = []
+            for member in members:
+                rel = os.path.relpath(member['name'], root)
+                if rel != '.':
+                    expected.append((rel, member['size'] if 'sha256' in member else None))
+        
+        for rel, size in expected:
+            path = os.path.join(staged_tree, rel)
+            if not os.path.lexists(path):
+                print(f"❌ 暂存目录缺少: {rel}")
+                return False
+            if size is not None and not os.path.islink(path) and os.path.getsize(path) != size:
+                print(f"❌ 文件大小不一致: {rel}")
+                return False
+        return True
+    
+    def _swap_into_place(self, staged_tree):
+        """
+        用两次 rename 把暂存目录换成面板目录
+        
+        Returns:
+            被换下的旧目录路径（面板目录原本不存在时为None）
+        """
+        old_tree = None
+        if os.path.exists(self.panel_path):
+            old_tree = self._sibling_path('old')
+            os.rename(self.panel_path, old_tree)
+        try:
+            os.rename(staged_tree, self.panel_path)
+        except OSError:
+            # 第二次改名失败，立即换回原目录
+            if old_tree:
+                os.rename(old_tree, self.panel_path)
+            raise
+        return old_tree
+    
+    def _remove_in_background(self, *paths):
+        """用独立进程删除目录（调用方退出后仍继续）"""
+        paths = [path for path in paths if path and os.path.exists(path)]
+        if paths:
+            subprocess.Popen(['rm', '-rf', '--'] + paths,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                             stdin=subprocess.DEVNULL, start_new_session=True)
+    
     def list_backups(self):
         """
         列出所有备份
@@ -202,6 +471,91 @@ class BackupManager:
             print(f"⚠️ 读取备份信息失败: {e}")
             return []
     
+    def _write_archive(self, backup_filepath, source_path=None):
+        """
+        以流式tar写入压缩包（source_path 默认为面板目录，归档名始终为面板目录名）
+        
+        打包的同时生成索引文件 <压缩包>.index.json：每个成员的大小和SHA256，
+        以及并行gzip各压缩块的位置，供单遍校验和抽样校验使用。
+        
+        Returns:
+            (文件大小, MD5, 成员数量)
+        """
+        source_path = source_path or self.panel_path
+        arc_root = os.path.basename(os.path.abspath(self.panel_path))
+        members = []
+        
+        with open(backup_filepath, 'wb') as raw:
+            digest = DigestWriter(raw)
+            if self.compression == 'zstd':
+                import zstandard
+                compressor = zstandard.ZstdCompressor(level=self.compression_level,
+                                                      threads=self.compression_threads)
+                stream = compressor.stream_writer(digest, closefd=False)
+            else:
+                stream = ParallelGzipWriter(digest, self.compression_level, self.compression_threads)
+            
+            with stream:
+                with tarfile.open(fileobj=stream, mode='w|') as tar:
+                    for full_path, arcname in self._walk_archive_paths(source_path, arc_root):
+                        info = tar.gettarinfo(full_path, arcname)
+                        if info is None:
+                            continue
+                        member = {'name': info.name, 'size': info.size}
+                        if info.isreg():
+                            with open(full_path, 'rb') as f:
+                                reader = HashingReader(f)
+                                tar.addfile(info, reader)
+                            member['sha256'] = reader.sha256.hexdigest()
+                        else:
+                            tar.addfile(info)
+                        members.append(member)
+        
+        index = {'members': members, 'blocks': getattr(stream, 'blocks', None)}
+        with open(self._index_file(backup_filepath), 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        
+        return digest.size, digest.md5.hexdigest(), len(members)
+    
+    def _walk_archive_paths(self, source_path, arc_root):
+        """按 tar.add 的顺序遍历目录（目录在其内容之前，符号链接目录不展开）"""
+        yield source_path, arc_root
+        for root, dirs, files in os.walk(source_path):
+            dirs.sort()
+            rel_root = os.path.relpath(root, source_path)
+            for name in sorted(dirs + files):
+                arcname = os.path.normpath(os.path.join(arc_root, rel_root, name))
+                yield os.path.join(root, name), arcname
+    
+    def _index_file(self, backup_filepath):
+        return backup_filepath + '.index.json'
+    
+    def _remove_archive(self, backup_filepath):
+        """删除压缩包及其索引文件"""
+        for path in (backup_filepath, self._index_file(backup_filepath)):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def _archive_compression(self, backup_filepath):
+        """压缩包格式（优先读取备份记录，旧备份按扩展名判断）"""
+        for backup in self.list_backups():
+            if backup['filepath'] == backup_filepath and backup.get('compression'):
+                return backup['compression']
+        return 'zstd' if backup_filepath.endswith('.zst') else 'gzip'
+    
+    @contextmanager
+    def _open_archive(self, backup_filepath):
+        """打开压缩包用于读取（兼容旧的单线程 .tar.gz 备份）"""
+        if self._archive_compression(backup_filepath) == 'zstd':
+            import zstandard
+            with open(backup_filepath, 'rb') as raw:
+                with zstandard.ZstdDecompressor().stream_reader(raw) as stream:
+                    with tarfile.open(fileobj=stream, mode='r|') as tar:
+                        yield tar
+        else:
+            with tarfile.open(backup_filepath, "r:gz") as tar:
+                yield tar
+    
     def _calculate_md5(self, filepath):
         """计算文件MD5"""
         md5 = hashlib.md5()
@@ -210,46 +564,176 @@ class BackupManager:
                 md5.update(chunk)
         return md5.hexdigest()
     
-    def _verify_backup(self, backup_filepath):
-        """验证备份文件完整性"""
+    def verify_backup(self, backup_filepath, sample=False):
+        """
+        验证备份完整性
+        
+        Args:
+            backup_filepath: 备份文件路径
+            sample: 抽样校验（只解压随机抽取的少量压缩块/数据块，秒级完成）
+        """
+        return self._verify_backup(backup_filepath, sample=sample)
+    
+    def _verify_backup(self, backup_filepath, sample=False, deep=True):
+        """
+        验证备份文件完整性
+        
+        deep=False 时去重备份只检查清单MD5和数据块是否存在（恢复时使用：
+        重建目录树本来就要解压每个数据块，届时逐块校验SHA256，不必预先解压一遍）
+        """
+        backup_type = self._backup_type_of(backup_filepath)
+        if backup_type == 'dedup':
+            return self._verify_dedup_backup(backup_filepath, deep=deep and not sample, sample=sample)
+        if backup_type == 'snapshot':
+            return self._verify_snapshot(backup_filepath)
+        
+        record = next((b for b in self.list_backups() if b['filepath'] == backup_filepath), {})
         try:
-            # 验证文件可以正常打开
-            with tarfile.open(backup_filepath, "r:gz") as tar:
-                tar.getmembers()
+            with open(self._index_file(backup_filepath), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+        
+        try:
+            if sample and index and index.get('blocks'):
+                return self._verify_archive_sample(backup_filepath, record, index)
+            return self._verify_archive_stream(backup_filepath, record, index)
+        except Exception as e:
+            print(f"❌ 备份文件验证失败: {e}")
+            return False
+    
+    def _verify_archive_stream(self, backup_filepath, record, index):
+        """
+        单遍流式校验：读取一次压缩包，同时校验MD5、成员数量和每个成员的SHA256
+        （旧备份没有索引文件时只校验MD5和压缩包结构）
+        """
+        expected = {m['name']: m for m in index['members']} if index else None
+        member_count = 0
+        
+        with open(backup_filepath, 'rb') as raw:
+            reader = DigestReader(raw)
+            if self._archive_compression(backup_filepath) == 'zstd':
+                import zstandard
+                stream = zstandard.ZstdDecompressor().stream_reader(reader)
+            else:
+                # GzipFile 支持多成员gzip（并行压缩的备份）
+                stream = gzip.GzipFile(fileobj=reader, mode='rb')
             
-            # 验证MD5（如果有记录）
-            backups = self.list_backups()
-            for backup in backups:
-                if backup['filepath'] == backup_filepath:
-                    saved_md5 = backup.get('md5')
-                    if saved_md5:
-                        current_md5 = self._calculate_md5(backup_filepath)
-                        if current_md5 != saved_md5:
-                            print(f"❌ MD5校验失败")
-                            print(f"   期望: {saved_md5}")
-                            print(f"   实际: {current_md5}")
+            with stream, tarfile.open(fileobj=stream, mode='r|') as tar:
+                for member in tar:
+                    member_count += 1
+                    if expected is None:
+                        continue
+                    
+                    entry = expected.get(member.name)
+                    if entry is None or entry['size'] != member.size:
+                        print(f"❌ 成员与索引不一致: {member.name}")
+                        return False
+                    if member.isreg() and 'sha256' in entry:
+                        sha256 = hashlib.sha256()
+                        f = tar.extractfile(member)
+                        for data in iter(lambda: f.read(VERIFY_READ_SIZE), b''):
+                            sha256.update(data)
+                        if sha256.hexdigest() != entry['sha256']:
+                            print(f"❌ 成员内容校验失败: {member.name}")
                             return False
             
-            return True
-        except Exception as e:
-            print(f"❌ 备份文件验证失败: {e}")
+            reader.drain()
+        
+        if expected is not None and member_count != len(expected):
+            print(f"❌ 成员数量不一致: 期望 {len(expected)}，实际 {member_count}")
+            return False
+        
+        saved_md5 = record.get('md5')
+        if saved_md5 and reader.md5.hexdigest() != saved_md5:
+            print(f"❌ MD5校验失败")
+            print(f"   期望: {saved_md5}")
+            print(f"   实际: {reader.md5.hexdigest()}")
             return False
+        
+        print(f"✅ 校验通过（{member_count} 个成员）")
+        return True
     
-    def _save_backup_info(self, backup_info):
-        """保存备份信息"""
-        backups = []
-        if os.path.exists(self.backup_info_file):
-            try:
-                with open(self.backup_info_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    backups = data.get('backups', [])
-            except Exception as e:
-                print(f"⚠️ 读取备份信息失败: {e}")
+    def _verify_archive_sample(self, backup_filepath, record, index):
+        """
+        抽样校验（并行gzip备份）：核对文件大小，随机解压若干个gzip成员
+        （每个成员自带CRC32和长度校验）以及最后一个成员
+        """
+        blocks = index['blocks']
+        size = os.path.getsize(backup_filepath)
+        last_offset, last_length = blocks[-1]
+        if last_offset + last_length != size or (record.get('size') and record['size'] != size):
+            print(f"❌ 压缩包大小不一致: {size}")
+            return False
         
-        backups.append(backup_info)
+        picked = set(random.sample(range(len(blocks)), min(SAMPLE_BLOCKS, len(blocks))))
+        picked.add(len(blocks) - 1)
+        with open(backup_filepath, 'rb') as f:
+            for i in sorted(picked):
+                offset, length = blocks[i]
+                f.seek(offset)
+                gzip.decompress(f.read(length))
         
-        with open(self.backup_info_file, 'w', encoding='utf-8') as f:
-            json.dump({'backups': backups}, f, indent=2, ensure_ascii=False)
+        print(f"✅ 抽样校验通过（{len(picked)}/{len(blocks)} 个压缩块）")
+        return True
+    
+    @contextmanager
+    def _locked_backup_info(self):
+        """
+        加锁读写备份信息（后台归档进程和主进程可能同时写入）
+        
+        yield 备份记录列表，修改后原子写回
+        """
+        with open(self.backup_info_file + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            backups = []
+            if os.path.exists(self.backup_info_file):
+                try:
+                    with open(self.backup_info_file, 'r', encoding='utf-8') as f:
+                        backups = json.load(f).get('backups', [])
+                except Exception as e:
+                    print(f"⚠️ 读取备份信息失败: {e}")
+            
+            yield backups
+            
+            tmp_file = f"{self.backup_info_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'backups': backups}, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, self.backup_info_file)
+    
+    @contextmanager
+    def _locked_store(self):
+        """
+        备份目录级排它锁：去重备份的创建（写入/复用数据块直到清单登记）和数据块回收
+        互斥，避免回收删除正在创建的快照所引用的数据块。同一实例内可重入。
+        """
+        if self._store_lock_held:
+            yield
+            return
+        
+        with open(os.path.join(self.backup_path, '.store.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._store_lock_held = True
+            try:
+                yield
+            finally:
+                self._store_lock_held = False
+                fcntl.flock(lock, fcntl.LOCK_UN)
+    
+    def _save_backup_info(self, backup_info):
+        """保存备份信息"""
+        with self._locked_backup_info() as backups:
+            backups.append(backup_info)
+    
+    def _update_backup_info(self, filepath, updates=None, remove=False):
+        """修改或删除一条备份记录"""
+        with self._locked_backup_info() as backups:
+            for backup in list(backups):
+                if backup['filepath'] == filepath:
+                    if remove:
+                        backups.remove(backup)
+                    else:
+                        backup.update(updates or {})
     
     def _get_latest_backup(self):
         """获取最新备份文件路径"""
@@ -269,8 +753,10 @@ class BackupManager:
                 return backup['filepath']
         return None
     
-    def _cleanup_old_backups(self, keep=5):
-        """清理旧备份"""
+    def _cleanup_old_backups(self, keep=None):
+        """清理旧备份（默认保留 keep_backups 个）"""
+        if keep is None:
+            keep = self.keep_backups
         backups = self.list_backups()
         if len(backups) <= keep:
             return
@@ -281,9 +767,32 @@ class BackupManager:
         # 删除旧备份
         to_delete = backups[keep:]
         for backup in to_delete:
+            if backup.get('type') == 'snapshot':
+                try:
+                    self._stop_snapshot_archiver(backup['filepath'])
+                    if os.path.isdir(backup['filepath']):
+                        shutil.rmtree(backup['filepath'])
+                    if os.path.exists(self._snapshot_index_file(backup['filepath'])):
+                        os.remove(self._snapshot_index_file(backup['filepath']))
+                    if backup.get('archive'):
+                        self._remove_archive(backup['archive'])
+                    print(f"🧹 已删除旧快照: {backup['filename']}")
+                except OSError as e:
+                    print(f"⚠️ 删除快照失败 {backup['filename']}: {e}")
+                continue
+            if backup.get('type') == 'dedup':
+                # 去重备份只删除清单，数据块在下面统一回收
+                try:
+                    if os.path.exists(backup['filepath']):
+                        os.remove(backup['filepath'])
+                        print(f"🧹 已删除旧快照: {backup['filename']}")
+                except OSError as e:
+                    print(f"⚠️ 删除快照清单失败 {backup['filename']}: {e}")
+                continue
+            
             try:
                 if os.path.exists(backup['filepath']):
-                    os.remove(backup['filepath'])
+                    self._remove_archive(backup['filepath'])
                     print(f"🧹 已删除旧备份: {backup['filename']}")
             except OSError as e:
                 print(f"⚠️ 删除备份文件失败 {backup['filename']}: {e}")
@@ -291,9 +800,595 @@ class BackupManager:
                 print(f"⚠️ 删除备份异常: {e}")
         
         # 更新备份信息文件
-        kept_backups = backups[:keep]
-        with open(self.backup_info_file, 'w', encoding='utf-8') as f:
-            json.dump({'backups': kept_backups}, f, indent=2, ensure_ascii=False)
+        deleted = {backup['filepath'] for backup in to_delete}
+        with self._locked_backup_info() as current:
+            current[:] = [backup for backup in current if backup['filepath'] not in deleted]
+        
+        if any(backup.get('type') == 'dedup' for backup in to_delete):
+            self._collect_garbage_chunks()
+    
+    # ========================================
+    # reflink 快照
+    # ========================================
+    
+    def _snapshot_dir(self, version, timestamp):
+        """快照目录放在面板目录旁边，保证与面板在同一文件系统（可reflink、可改名恢复）"""
+        parent = os.path.dirname(os.path.abspath(self.panel_path))
+        name = os.path.basename(os.path.abspath(self.panel_path))
+        return os.path.join(parent, f".{name}_snapshot_{version}_{timestamp}")
+    
+    def _snapshot_index_file(self, snapshot_dir):
+        """快照索引放在备份目录（快照目录会被改名为面板目录）"""
+        return os.path.join(self.backup_path, os.path.basename(snapshot_dir) + '.index.json')
+    
+    def _clone_tree(self, source, target):
+        """
+        以 reflink（写时复制）克隆目录树，不复制文件数据
+        
+        只使用reflink：克隆后的文件与面板文件不共享数据，升级脚本原地覆盖写
+        （如 install.sh）也不会改变快照。硬链接会共享inode，不能用作快照。
+        
+        Returns:
+            快照索引 [{'path', 'type', 'size', 'mtime_ns', 'target'}]，用于恢复前校验
+        
+        Raises:
+            OSError: 文件系统不支持reflink（FICLONE失败）
+        """
+        entries = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            rel = os.path.relpath(root, source)
+            target_root = os.path.normpath(os.path.join(target, rel))
+            os.makedirs(target_root, exist_ok=True)
+            shutil.copystat(root, target_root, follow_symlinks=False)
+            
+            for name in sorted(files + [d for d in dirs if os.path.islink(os.path.join(root, d))]):
+                src = os.path.join(root, name)
+                dst = os.path.join(target_root, name)
+                rel_path = os.path.normpath(os.path.join(rel, name))
+                if os.path.islink(src):
+                    link_target = os.readlink(src)
+                    os.symlink(link_target, dst)
+                    entries.append({'path': rel_path, 'type': 'symlink', 'target': link_target})
+                    continue
+                if not os.path.isfile(src):
+                    continue
+                with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                shutil.copystat(src, dst)
+                st = os.stat(src)
+                if hasattr(os, 'geteuid') and os.geteuid() == 0:
+                    os.chown(dst, st.st_uid, st.st_gid)
+                entries.append({'path': rel_path, 'type': 'file', 'size': st.st_size,
+                                'mtime_ns': os.stat(dst).st_mtime_ns})
+            
+            for name in dirs:
+                if not os.path.islink(os.path.join(root, name)):
+                    entries.append({'path': os.path.normpath(os.path.join(rel, name)), 'type': 'dir'})
+        
+        # 目录时间在写入内容后会改变，最后统一恢复
+        for root, dirs, files in os.walk(source):
+            target_root = os.path.normpath(os.path.join(target, os.path.relpath(root, source)))
+            shutil.copystat(root, target_root, follow_symlinks=False)
+        return entries
+    
+    def _verify_snapshot(self, snapshot_dir):
+        """按快照索引核对快照目录：文件集合、大小、修改时间和符号链接目标（只做lstat）"""
+        if not os.path.isdir(snapshot_dir):
+            print(f"❌ 快照目录不存在: {snapshot_dir}")
+            return False
+        try:
+            with open(self._snapshot_index_file(snapshot_dir), 'r', encoding='utf-8') as f:
+                expected = {entry['path']: entry for entry in json.load(f)['entries']}
+        except (OSError, ValueError, KeyError):
+            print("❌ 快照缺少索引，无法校验")
+            return False
+        
+        seen = set()
+        for root, dirs, files in os.walk(snapshot_dir):
+            for name in dirs + files:
+                full_path = os.path.join(root, name)
+                rel_path = os.path.relpath(full_path, snapshot_dir)
+                entry = expected.get(rel_path)
+                if entry is None:
+                    print(f"❌ 快照中有多余文件: {rel_path}")
+                    return False
+                seen.add(rel_path)
+                st = os.lstat(full_path)
+                if entry['type'] == 'symlink':
+                    ok = stat.S_ISLNK(st.st_mode) and os.readlink(full_path) == entry['target']
+                elif entry['type'] == 'dir':
+                    ok = stat.S_ISDIR(st.st_mode)
+                else:
+                    ok = (stat.S_ISREG(st.st_mode) and st.st_size == entry['size']
+                          and st.st_mtime_ns == entry['mtime_ns'])
+                if not ok:
+                    print(f"❌ 快照文件已被修改: {rel_path}")
+                    return False
+        
+        missing = set(expected) - seen
+        if missing:
+            print(f"❌ 快照缺少: {sorted(missing)[0]}")
+            return False
+        return True
+    
+    def _create_snapshot_backup(self, version, description):
+        """
+        创建reflink快照备份，并启动后台进程把快照打包为压缩包（用于异地保存）
+        
+        文件系统不支持reflink时改为创建完整压缩包备份。
+        """
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        snapshot_dir = self._snapshot_dir(version, timestamp)
+        
+        print(f"📁 备份目标: {self.panel_path}")
+        print(f"📸 快照目录: {snapshot_dir}")
+        
+        try:
+            entries = self._clone_tree(self.panel_path, snapshot_dir)
+        except OSError as e:
+            print(f"⚠️  无法创建reflink快照（{e}），改为创建完整压缩包备份")
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+            return self._create_archive_backup(version, description)
+        
+        try:
+            with open(self._snapshot_index_file(snapshot_dir), 'w', encoding='utf-8') as f:
+                json.dump({'entries': entries}, f, ensure_ascii=False)
+            print(f"✅ 快照创建成功（reflink）")
+            
+            archive_name = f"panel_backup_{version}_{timestamp}{ARCHIVE_SUFFIXES[self.compression]}"
+            backup_info = {
+                "type": "snapshot",
+                "link_method": "reflink",
+                "version": version,
+                "filename": os.path.basename(snapshot_dir),
+                "filepath": snapshot_dir,
+                "size": 0,
+                "archive": os.path.join(self.backup_path, archive_name),
+                "archive_status": "pending",
+                "compression": self.compression,
+                "compression_level": self.compression_level,
+                "timestamp": timestamp,
+                "description": description,
+                "panel_path": self.panel_path,
+                "created_at": datetime.now().isoformat()
+            }
+            self._save_backup_info(backup_info)
+            self._cleanup_old_backups()
+            
+            # 后台生成压缩包（独立进程，升级脚本退出后仍继续）
+            subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), 'archive', '--file', snapshot_dir,
+                 '--panel-path', self.panel_path, '--backup-path', os.path.abspath(self.backup_path)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL,
+                start_new_session=True
+            )
+            print(f"🔄 已在后台生成压缩包: {archive_name}")
+            
+            return snapshot_dir
+            
+        except Exception as e:
+            print(f"❌ 快照创建失败: {e}")
+            if os.path.isdir(snapshot_dir):
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+            if os.path.exists(self._snapshot_index_file(snapshot_dir)):
+                os.remove(self._snapshot_index_file(snapshot_dir))
+            return None
+    
+    def archive_snapshot(self, snapshot_dir):
+        """把快照目录打包为压缩包，并更新备份记录"""
+        record = next((b for b in self.list_backups() if b['filepath'] == snapshot_dir), None)
+        if not record or not os.path.isdir(snapshot_dir):
+            print(f"❌ 快照不存在: {snapshot_dir}")
+            return False
+        
+        archive_file = record['archive']
+        self.compression = record.get('compression', self.compression)
+        self.compression_level = record.get('compression_level', self.compression_level)
+        if not self._claim_snapshot_archive(snapshot_dir):
+            print(f"⚠️ 快照已被恢复或正在打包，跳过: {snapshot_dir}")
+            return False
+        try:
+            size, md5, member_count = self._write_archive(archive_file, source_path=snapshot_dir)
+            self._update_backup_info(snapshot_dir, {
+                'archive_status': 'done', 'size': size, 'md5': md5, 'members': member_count,
+                'archived_at': datetime.now().isoformat()
+            })
+            print(f"✅ 快照已打包: {archive_file}")
+            return True
+        except Exception as e:
+            print(f"❌ 快照打包失败: {e}")
+            self._remove_archive(archive_file)
+            self._update_backup_info(snapshot_dir, {'archive_status': 'failed'})
+            return False
+    
+    def _claim_snapshot_archive(self, snapshot_dir):
+        """
+        打包开始前把记录从 pending 改为 running 并登记本进程pid
+        
+        恢复时会先把 pending 改为 cancelled，已取消或已有进程在打包时返回False。
+        """
+        with self._locked_backup_info() as backups:
+            for backup in backups:
+                if backup['filepath'] == snapshot_dir and backup.get('type') == 'snapshot' \
+                        and backup.get('archive_status') == 'pending':
+                    backup.update({'archive_status': 'running', 'archive_pid': os.getpid()})
+                    return True
+        return False
+    
+    def _archiver_alive(self, pid, snapshot_dir):
+        """pid 是否仍是打包该快照的进程（防止pid被复用；僵尸进程视为已退出）"""
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                cmdline = f.read().split(b'\0')
+        except FileNotFoundError:
+            return False
+        except OSError:
+            # 没有 /proc 时只能判断进程是否存在
+            try:
+                os.kill(pid, 0)
+                return True
+            except OSError:
+                return False
+        return b'archive' in cmdline and os.fsencode(snapshot_dir) in cmdline
+    
+    def _stop_snapshot_archiver(self, snapshot_dir, timeout=10):
+        """
+        快照被恢复或删除前停止后台打包
+        
+        尚未开始的打包标记为 cancelled；正在运行的打包进程被终止，
+        半成品压缩包被删除，记录标记为 failed。已完成的打包不受影响。
+        """
+        pid = None
+        with self._locked_backup_info() as backups:
+            for backup in backups:
+                if backup['filepath'] != snapshot_dir:
+                    continue
+                if backup.get('archive_status') == 'pending':
+                    backup['archive_status'] = 'cancelled'
+                elif backup.get('archive_status') == 'running':
+                    pid = backup.get('archive_pid')
+        if pid is None:
+            return
+        
+        if self._archiver_alive(pid, snapshot_dir):
+            print(f"⏹️  停止后台打包进程: {pid}")
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+            deadline = time.monotonic() + timeout
+            while self._archiver_alive(pid, snapshot_dir):
+                if time.monotonic() > deadline:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    break
+                try:
+                    # 打包进程是本进程启动的子进程时需要回收
+                    os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    pass
+                time.sleep(0.05)
+        
+        # 进程停止前可能已经打包完成（记录为 done），只清理未完成的
+        with self._locked_backup_info() as backups:
+            for backup in backups:
+                if backup['filepath'] == snapshot_dir and backup.get('archive_status') == 'running':
+                    self._remove_archive(backup['archive'])
+                    backup['archive_status'] = 'failed'
+    
+    def _snapshot_consumed(self, snapshot_dir):
+        """快照目录已改名为面板目录：有压缩包时记录转为普通备份，否则删除记录"""
+        if os.path.exists(self._snapshot_index_file(snapshot_dir)):
+            os.remove(self._snapshot_index_file(snapshot_dir))
+        record = next((b for b in self.list_backups() if b['filepath'] == snapshot_dir), None)
+        if record and record.get('archive_status') == 'done' and os.path.exists(record['archive']):
+            self._update_backup_info(snapshot_dir, {
+                'type': 'archive',
+                'filepath': record['archive'],
+                'filename': os.path.basename(record['archive'])
+            })
+        else:
+            self._update_backup_info(snapshot_dir, remove=True)
+    
+    # ========================================
+    # 分块去重备份
+    # ========================================
+    
+    def _backup_type_of(self, backup_filepath):
+        """根据备份记录（或文件名）判断备份类型"""
+        for backup in self.list_backups():
+            if backup['filepath'] == backup_filepath:
+                return backup.get('type', 'archive')
+        return 'dedup' if backup_filepath.endswith(MANIFEST_SUFFIX) else 'archive'
+    
+    def _chunk_file(self, digest):
+        return os.path.join(self.chunk_path, digest[:2], digest)
+    
+    def _store_chunk(self, data):
+        """
+        写入数据块（内容寻址，已存在则跳过）
+        
+        Returns:
+            (数据块SHA256, 新写入的字节数)
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        chunk_file = self._chunk_file(digest)
+        if os.path.exists(chunk_file):
+            return digest, 0
+        
+        os.makedirs(os.path.dirname(chunk_file), exist_ok=True)
+        compressed = zlib.compress(data, self.chunk_level)
+        tmp_file = f"{chunk_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_file, chunk_file)
+        return digest, len(compressed)
+    
+    def _read_chunk(self, digest, verify=False):
+        """读取并解压数据块（verify=True 时校验SHA256，不一致抛出 ValueError）"""
+        with open(self._chunk_file(digest), 'rb') as f:
+            data = zlib.decompress(f.read())
+        if verify and hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"数据块校验失败: {digest}")
+        return data
+    
+    def _latest_manifest_entries(self):
+        """最近一次去重备份的文件清单（用于跳过未修改文件的读取和哈希）"""
+        dedup_backups = [b for b in self.list_backups() if b.get('type') == 'dedup']
+        dedup_backups.sort(key=lambda x: x['created_at'], reverse=True)
+        for backup in dedup_backups:
+            try:
+                manifest = self._load_manifest(backup['filepath'])
+            except (OSError, ValueError):
+                continue
+            if manifest.get('panel_path') == self.panel_path:
+                return {entry['path']: entry for entry in manifest['entries'] if entry['type'] == 'file'}
+        return {}
+    
+    def _load_manifest(self, manifest_file):
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _create_dedup_backup(self, version, description):
+        """
+        创建分块去重备份
+        
+        每个文件按 CHUNK_SIZE 切块，以SHA256为名存入 backups/chunks（已存在的块不再写入）；
+        快照清单记录目录结构、元数据和每个文件的数据块列表。大小、修改时间和inode
+        都未变化的文件直接复用上一次快照的数据块，不再读取。
+        """
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        manifest_name = f"panel_backup_{version}_{timestamp}{MANIFEST_SUFFIX}"
+        manifest_file = os.path.join(self.backup_path, manifest_name)
+        
+        print(f"📁 备份目标: {self.panel_path}")
+        print(f"💾 快照清单: {manifest_name}")
+        
+        # 持有备份目录锁直到清单登记完成，期间其它进程不会回收数据块
+        with self._locked_store():
+            try:
+                previous = self._latest_manifest_entries()
+                entries = []
+                stored_bytes = 0
+                logical_size = 0
+                reused_files = 0
+                
+                for root, dirs, files in os.walk(self.panel_path):
+                    dirs.sort()
+                    for name in dirs + sorted(files):
+                        full_path = os.path.join(root, name)
+                        rel_path = os.path.relpath(full_path, self.panel_path)
+                        st = os.lstat(full_path)
+                        entry = {
+                            'path': rel_path,
+                            'mode': stat.S_IMODE(st.st_mode),
+                            'uid': st.st_uid,
+                            'gid': st.st_gid,
+                            'mtime_ns': st.st_mtime_ns
+                        }
+                        
+                        if stat.S_ISLNK(st.st_mode):
+                            entry.update(type='symlink', target=os.readlink(full_path))
+                        elif stat.S_ISDIR(st.st_mode):
+                            entry['type'] = 'dir'
+                        elif stat.S_ISREG(st.st_mode):
+                            entry.update(type='file', size=st.st_size, ino=st.st_ino)
+                            logical_size += st.st_size
+                            
+                            old = previous.get(rel_path)
+                            if (old and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns
+                                    and old.get('ino') == st.st_ino
+                                    and all(os.path.exists(self._chunk_file(c)) for c in old['chunks'])):
+                                entry['chunks'] = old['chunks']
+                                reused_files += 1
+                            else:
+                                chunks = []
+                                with open(full_path, 'rb') as f:
+                                    for data in iter(lambda: f.read(CHUNK_SIZE), b''):
+                                        digest, written = self._store_chunk(data)
+                                        chunks.append(digest)
+                                        stored_bytes += written
+                                entry['chunks'] = chunks
+                        else:
+                            # 跳过设备文件、套接字等
+                            continue
+                        
+                        entries.append(entry)
+                
+                manifest = {
+                    'version': version,
+                    'panel_path': self.panel_path,
+                    'created_at': datetime.now().isoformat(),
+                    'chunk_size': CHUNK_SIZE,
+                    'entries': entries
+                }
+                tmp_file = manifest_file + '.tmp'
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(manifest, f, ensure_ascii=False)
+                os.replace(tmp_file, manifest_file)
+                
+                manifest_md5 = self._calculate_md5(manifest_file)
+                
+                print(f"✅ 快照创建成功")
+                print(f"📊 文件: {len(entries)} 项（{reused_files} 个未修改文件复用已有数据块）")
+                print(f"📊 新增数据: {stored_bytes // (2**20)} MB / 总大小 {logical_size // (2**20)} MB")
+                
+                backup_info = {
+                    "type": "dedup",
+                    "version": version,
+                    "filename": manifest_name,
+                    "filepath": manifest_file,
+                    "size": stored_bytes,
+                    "logical_size": logical_size,
+                    "md5": manifest_md5,
+                    "timestamp": timestamp,
+                    "description": description,
+                    "panel_path": self.panel_path,
+                    "created_at": datetime.now().isoformat()
+                }
+                
+                self._save_backup_info(backup_info)
+                self._cleanup_old_backups()
+                
+                return manifest_file
+                
+            except Exception as e:
+                print(f"❌ 快照创建失败: {e}")
+                if os.path.exists(manifest_file):
+                    os.remove(manifest_file)
+                return None
+    
+    def _materialize_snapshot(self, manifest_file, target_path):
+        """按快照清单在 target_path 重建目录树（逐块校验SHA256，数据块损坏时抛出异常）"""
+        manifest = self._load_manifest(manifest_file)
+        is_root = hasattr(os, 'geteuid') and os.geteuid() == 0
+        
+        os.makedirs(target_path, exist_ok=True)
+        directories = []
+        for entry in manifest['entries']:
+            full_path = os.path.join(target_path, entry['path'])
+            
+            if entry['type'] == 'dir':
+                os.makedirs(full_path, exist_ok=True)
+                directories.append((full_path, entry))
+                continue
+            
+            if entry['type'] == 'symlink':
+                os.symlink(entry['target'], full_path)
+            else:
+                with open(full_path, 'wb') as f:
+                    for digest in entry['chunks']:
+                        f.write(self._read_chunk(digest, verify=True))
+                os.chmod(full_path, entry['mode'])
+            
+            if is_root:
+                os.lchown(full_path, entry['uid'], entry['gid'])
+            if entry['type'] == 'file':
+                os.utime(full_path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+        
+        # 目录权限和时间在写完内容后设置（子目录先于父目录）
+        for full_path, entry in reversed(directories):
+            os.chmod(full_path, entry['mode'])
+            if is_root:
+                os.chown(full_path, entry['uid'], entry['gid'])
+            os.utime(full_path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+    
+    def _verify_dedup_backup(self, manifest_file, deep=False, sample=False):
+        """
+        验证快照清单MD5以及引用的数据块是否完整
+        
+        默认只检查数据块是否存在；deep=True 时解压每个数据块并校验SHA256，
+        sample=True 时只对随机抽取的少量数据块校验SHA256。
+        """
+        try:
+            for backup in self.list_backups():
+                if backup['filepath'] == manifest_file and backup.get('md5'):
+                    if self._calculate_md5(manifest_file) != backup['md5']:
+                        print("❌ 快照清单MD5校验失败")
+                        return False
+            
+            manifest = self._load_manifest(manifest_file)
+            checked = set()
+            for entry in manifest['entries']:
+                for digest in entry.get('chunks', []):
+                    if digest in checked:
+                        continue
+                    checked.add(digest)
+                    if not os.path.exists(self._chunk_file(digest)):
+                        print(f"❌ 数据块缺失: {entry['path']}")
+                        return False
+                    if deep and hashlib.sha256(self._read_chunk(digest)).hexdigest() != digest:
+                        print(f"❌ 数据块校验失败: {entry['path']}")
+                        return False
+            
+            if sample and checked:
+                for digest in random.sample(sorted(checked), min(SAMPLE_BLOCKS, len(checked))):
+                    if hashlib.sha256(self._read_chunk(digest)).hexdigest() != digest:
+                        print(f"❌ 数据块校验失败: {digest}")
+                        return False
+            return True
+        except Exception as e:
+            print(f"❌ 快照验证失败: {e}")
+            return False
+    
+    def _collect_garbage_chunks(self):
+        """
+        删除不再被任何快照引用的数据块
+        
+        持有备份目录锁，在锁内读取备份记录（不会漏掉其它进程刚登记的快照）；
+        临时文件和最近写入的数据块一律保留，由以后的回收处理。
+        """
+        with self._locked_store():
+            referenced = set()
+            for backup in self.list_backups():
+                if backup.get('type') != 'dedup':
+                    continue
+                try:
+                    manifest = self._load_manifest(backup['filepath'])
+                except (OSError, ValueError) as e:
+                    # 清单无法读取时不回收，避免误删
+                    print(f"⚠️ 读取快照清单失败，跳过数据块回收: {e}")
+                    return
+                for entry in manifest['entries']:
+                    referenced.update(entry.get('chunks', []))
+            
+            cutoff = datetime.now().timestamp() - CHUNK_GC_GRACE_SECONDS
+            removed = 0
+            if os.path.isdir(self.chunk_path):
+                for prefix in os.listdir(self.chunk_path):
+                    prefix_dir = os.path.join(self.chunk_path, prefix)
+                    for name in os.listdir(prefix_dir):
+                        if name in referenced or name.endswith('.tmp'):
+                            continue
+                        chunk_file = os.path.join(prefix_dir, name)
+                        try:
+                            if os.stat(chunk_file).st_mtime > cutoff:
+                                continue
+                            os.remove(chunk_file)
+                            removed += 1
+                        except FileNotFoundError:
+                            continue
+            if removed:
+                print(f"🧹 已回收 {removed} 个未引用的数据块")
+
+
+def load_backup_options(config_file='config.json'):
+    """
+    读取 config.json 中的 backup 配置（经 SecureConfig 共享缓存，返回可修改的副本）
+
+    顶层的 keep_backups（配置页面修改的字段）并入选项，backup.keep_backups 优先。
+    """
+    try:
+        config = SecureConfig(config_file).get_config()
+    except (OSError, ValueError):
+        return {}
+    options = dict(config.get('backup', {}))
+    if 'keep_backups' in config:
+        options.setdefault('keep_backups', config['keep_backups'])
+    return options
 
 
 def main():
@@ -301,24 +1396,43 @@ def main():
     import argparse
     
     parser = argparse.ArgumentParser(description='BT-Panel 备份和回滚工具')
-    parser.add_argument('action', choices=['backup', 'restore', 'list'],
-                       help='操作: backup(备份), restore(恢复), list(列表)')
+    parser.add_argument('action', choices=['backup', 'restore', 'list', 'archive', 'verify'],
+                       help='操作: backup(备份), restore(恢复), list(列表), archive(快照打包), verify(校验)')
     parser.add_argument('--version', help='面板版本号')
     parser.add_argument('--file', help='备份文件路径')
     parser.add_argument('--desc', default='', help='备份描述')
+    parser.add_argument('--type', choices=BACKUP_TYPES,
+                       help='备份类型: archive(完整压缩包), dedup(分块去重), snapshot(reflink快照)')
+    parser.add_argument('--sample', action='store_true', help='verify时只做抽样校验')
+    parser.add_argument('--panel-path', default='/www/server/panel', help='面板安装路径')
+    parser.add_argument('--backup-path', default='backups', help='备份存储路径')
     
     args = parser.parse_args()
     
-    manager = BackupManager()
+    manager = BackupManager(args.panel_path, args.backup_path, options=load_backup_options())
     
     if args.action == 'backup':
         if not args.version:
             print("❌ 请指定版本号: --version 11.2.0")
             sys.exit(1)
         
-        result = manager.create_backup(args.version, args.desc)
+        result = manager.create_backup(args.version, args.desc, backup_type=args.type)
         sys.exit(0 if result else 1)
     
+    elif args.action == 'verify':
+        backup_filepath = args.file or manager._get_latest_backup()
+        if not backup_filepath:
+            print("❌ 暂无备份")
+            sys.exit(1)
+        print(f"🔍 校验备份: {backup_filepath}")
+        sys.exit(0 if manager.verify_backup(backup_filepath, sample=args.sample) else 1)
+    
+    elif args.action == 'archive':
+        if not args.file:
+            print("❌ 请指定快照目录: --file <快照目录>")
+            sys.exit(1)
+        sys.exit(0 if manager.archive_snapshot(args.file) else 1)
+    
     elif args.action == 'restore':
         result = manager.restore_backup(args.file, args.version)
         sys.exit(0 if result else 1)
@@ -334,6 +1448,7 @@ def main():
         else:
             for i, backup in enumerate(backups, 1):
                 print(f"\n[{i}] {backup['filename']}")
+                print(f"    类型: {backup.get('type', 'archive')}")
                 print(f"    版本: {backup['version']}")
                 print(f"    大小: {backup['size'] // (2**20)} MB")
                 print(f"    时间: {backup['created_at']}")
@@ -35,9 +35,10 @@ log ""
 log "开始执行检测..."
 log ""
 
-# 运行主程序，将输出同时保存到文件和显示在控制台
-python3 auto_update.py 2>&1 | tee -a "${LOG_FILE}"
-EXIT_CODE=${PIPESTATUS[0]}
+# 通过检测队列运行主程序（输出由队列写入日志并显示在控制台）
+# 与Web管理后台共用进程间锁：已有检测在运行时只记录本次触发，不重复执行
+python3 check_jobs.py run --trigger cron
+EXIT_CODE=$?
 
 log ""
 log "======================================================================"
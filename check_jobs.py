@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BTAUTOCHECK 检测任务管理
+Check Job Runner with Live Stage Events
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# 从检测脚本输出中识别阶段事件
+STAGE_PATTERN = re.compile(r'^步骤: (.+)$')
+DOWNLOAD_PATTERN = re.compile(r'下载进度: ([\d.]+)%')
+SCAN_PATTERN = re.compile(r'^进度: (\d+)/(\d+) \((\d+)%\)')
+AI_CALL_PATTERN = re.compile(r'🔍 分析 (\d+)/(\d+): (.+)')
+
+# 每个任务保留的事件数（环形缓冲区）
+EVENT_BUFFER_SIZE = 1000
+
+# 内存中保留的已结束任务数
+MAX_FINISHED_JOBS = 20
+
+# 持久化队列/历史文件，以及运行检测时持有的进程间锁
+STATE_FILE = 'logs/check_jobs.json'
+RUN_LOCK_FILE = 'logs/check.lock'
+
+# 保留的运行历史条数
+MAX_HISTORY = 100
+
+
+class CheckJob:
+    """一次检测任务：后台运行 auto_update.py，并把输出解析为阶段事件"""
+
+    def __init__(self, trigger='manual', command=None, log_dir='logs', job_id=None, echo=False):
+        self.id = job_id or uuid.uuid4().hex[:12]
+        self.trigger = trigger
+        self.command = command or [sys.executable, 'auto_update.py']
+        self.log_dir = log_dir
+        self.echo = echo
+        self.status = 'queued'
+        self.returncode = None
+        self.started_at = None
+        self.finished_at = None
+        self.stage = None
+        self.process = None
+
+        self.events = deque(maxlen=EVENT_BUFFER_SIZE)
+        self.last_seq = 0
+        self.condition = threading.Condition()
+        self._last_download_percent = None
+
+    def start(self, lock_fd=None):
+        """
+        启动任务（输出由后台线程持续读取，不会因管道写满而阻塞子进程）
+
+        Args:
+            lock_fd: 运行锁的文件描述符，由子进程继承，运行者进程退出后锁仍由检测进程持有
+        """
+        env = dict(os.environ, PYTHONUNBUFFERED='1')
+        # 独立进程组，取消时连同各步骤子脚本一起终止
+        self.process = subprocess.Popen(
+            self.command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+            env=env,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            start_new_session=True,
+            pass_fds=(lock_fd,) if lock_fd is not None else ()
+        )
+        self.started_at = time.time()
+        self.status = 'running'
+        self._emit('status', status='running', trigger=self.trigger)
+
+        thread = threading.Thread(target=self._read_output, daemon=True)
+        thread.start()
+        return self
+
+    def _read_output(self):
+        """读取子进程输出，写入当天日志并生成事件"""
+        os.makedirs(self.log_dir, exist_ok=True)
+        log_file = os.path.join(self.log_dir, f"auto_check_{datetime.now().strftime('%Y%m%d')}.log")
+        buffer = b''
+
+        with open(log_file, 'ab') as log:
+            while True:
+                chunk = os.read(self.process.stdout.fileno(), 4096)
+                if not chunk:
+                    break
+                log.write(chunk)
+                log.flush()
+                if self.echo:
+                    sys.stdout.buffer.write(chunk)
+                    sys.stdout.flush()
+
+                # 下载进度用 \r 刷新同一行，按 \r 和 \n 都切分
+                buffer += chunk
+                parts = re.split(rb'[\r\n]', buffer)
+                buffer = parts.pop()
+                for part in parts:
+                    if part.strip():
+                        self._handle_line(part.decode('utf-8', errors='replace').strip())
+
+            if buffer.strip():
+                self._handle_line(buffer.decode('utf-8', errors='replace').strip())
+
+        self.process.stdout.close()
+        self.returncode = self.process.wait()
+        self.finished_at = time.time()
+        if self.status != 'cancelled':
+            self.status = 'succeeded' if self.returncode == 0 else 'failed'
+        self._emit('done', status=self.status, returncode=self.returncode,
+                   duration=round(self.finished_at - self.started_at, 1))
+
+    def _handle_line(self, line):
+        """把一行输出转换为事件"""
+        match = STAGE_PATTERN.match(line)
+        if match:
+            self.stage = match.group(1)
+            self._emit('stage', stage=self.stage)
+            return
+
+        match = DOWNLOAD_PATTERN.search(line)
+        if match:
+            # 下载进度每个数据块刷新一次，只在整数百分比变化时发事件
+            percent = int(float(match.group(1)))
+            if percent != self._last_download_percent:
+                self._last_download_percent = percent
+                self._emit('progress', stage='download', percent=percent)
+            return
+
+        match = SCAN_PATTERN.match(line)
+        if match:
+            self._emit('progress', stage='scan', current=int(match.group(1)),
+                       total=int(match.group(2)), percent=int(match.group(3)))
+            return
+
+        match = AI_CALL_PATTERN.search(line)
+        if match:
+            self._emit('ai', current=int(match.group(1)), total=int(match.group(2)),
+                       file=match.group(3).rstrip('.'))
+            return
+
+        self._emit('log', line=line)
+
+    def _emit(self, event_type, **data):
+        with self.condition:
+            self.last_seq += 1
+            self.events.append(dict(data, seq=self.last_seq, type=event_type,
+                                    time=datetime.now().strftime('%H:%M:%S')))
+            self.condition.notify_all()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def cancel(self):
+        """取消任务（排队中直接结束，运行中终止整个进程组）"""
+        if self.finished:
+            return False
+        self.status = 'cancelled'
+        if self.process is None:
+            self.finished_at = time.time()
+            self._emit('done', status='cancelled', returncode=None, duration=0)
+        else:
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        return True
+
+    def events_since(self, seq, timeout=15):
+        """
+        获取序号大于 seq 的事件，没有新事件时最多等待 timeout 秒
+
+        事件超出环形缓冲区后会被丢弃，此时只返回仍在缓冲区中的事件。
+        """
+        with self.condition:
+            if self.last_seq <= seq and not self.finished:
+                self.condition.wait(timeout)
+            return [event for event in self.events if event['seq'] > seq]
+
+    def wait(self, timeout=None):
+        """等待任务结束（含排队时间），返回退出码"""
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.condition:
+            while not self.finished:
+                if deadline is not None and time.time() >= deadline:
+                    return None
+                self.condition.wait(1)
+        return self.returncode
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'trigger': self.trigger,
+            'status': self.status,
+            'stage': self.stage,
+            'returncode': self.returncode,
+            'started_at': _format_time(self.started_at),
+            'duration': round((self.finished_at or time.time()) - self.started_at, 1) if self.started_at else None,
+            'last_seq': self.last_seq
+        }
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def _group_alive(pid):
+    """检测进程是否仍在运行（检测进程是独立进程组的组长，可排除PID被复用的情况）"""
+    try:
+        return os.getpgid(pid) == pid
+    except ProcessLookupError:
+        return False
+
+
+def _read_state(state_file=STATE_FILE):
+    """只读方式读取持久化状态（写入总是原子替换，无需加锁）"""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state.setdefault('queue', [])
+    state.setdefault('active', None)
+    state.setdefault('history', [])
+    return state
+
+
+@contextmanager
+def _locked_state(state_file=STATE_FILE):
+    """
+    加锁读写持久化状态（Web进程和cron命令行共用）
+
+    状态结构: {'queue': [记录], 'active': 记录或None, 'history': [记录]}
+    """
+    os.makedirs(os.path.dirname(state_file) or '.', exist_ok=True)
+    with open(state_file + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            state = _read_state(state_file)
+
+            yield state
+
+            state['history'] = state['history'][-MAX_HISTORY:]
+            tmp_file = f"{state_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, state_file)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _new_record(trigger):
+    return {
+        'id': uuid.uuid4().hex[:12],
+        'trigger': trigger,
+        'coalesced': [],
+        'status': 'queued',
+        'requested_at': _format_time(time.time()),
+        'started_at': None,
+        'finished_at': None,
+        'duration': None,
+        'returncode': None,
+        'runner_pid': None,
+        'pid': None
+    }
+
+
+def _finish_record(state, record, job):
+    """把运行结束的任务写入历史"""
+    record.update({
+        'status': job.status,
+        'returncode': job.returncode,
+        'finished_at': _format_time(job.finished_at),
+        'duration': round(job.finished_at - job.started_at, 1) if job.started_at and job.finished_at else 0
+    })
+    if state['active'] and state['active']['id'] == record['id']:
+        record['coalesced'] = state['active'].get('coalesced', [])
+        state['active'] = None
+    state['history'].append(record)
+
+
+def _active_running(active):
+    """
+    运行中的任务是否仍然存活
+
+    检测进程启动后以检测进程为准（运行者进程退出后检测进程可能仍在运行），
+    启动前以运行者进程为准。
+    """
+    if active.get('pid'):
+        return _group_alive(active['pid'])
+    return bool(active.get('runner_pid')) and _pid_alive(active['runner_pid'])
+
+
+def _retire_active(state):
+    """把已不在运行的任务记为 interrupted 并移入历史"""
+    active = state['active']
+    active['status'] = 'interrupted'
+    active['finished_at'] = _format_time(time.time())
+    state['history'].append(active)
+    state['active'] = None
+
+
+def _activate(state, record):
+    """
+    把任务记为运行中（调用方已持有运行锁）
+
+    与出队在同一次状态文件加锁内完成，期间提交的请求总能合并到该任务。
+    """
+    # 已持有运行锁，之前的任务必然已经结束
+    if state['active']:
+        _retire_active(state)
+    record.update(status='running', started_at=_format_time(time.time()), runner_pid=os.getpid())
+    state['active'] = record
+    return record
+
+
+def _active_alive(state):
+    """当前运行中的任务是否仍然存活（已结束但未记录结果时记为 interrupted）"""
+    active = state['active']
+    if not active:
+        return False
+    if _active_running(active):
+        return True
+    _retire_active(state)
+    return False
+
+
+class CheckJobQueue:
+    """
+    检测任务队列（单飞执行）
+
+    - 同一时间只运行一个检测：运行时持有 logs/check.lock（fcntl），
+      cron 命令行（python3 check_jobs.py run）与Web进程共用此锁；
+      锁由检测进程继承，运行者（如Web进程）退出后直到检测结束都不会释放
+    - 已有任务排队或运行时，重复触发合并到该任务（记录在 coalesced 中）
+    - 队列和运行历史持久化在 logs/check_jobs.json，Web重启后继续执行排队任务
+    """
+
+    def __init__(self, state_file=STATE_FILE, lock_file=RUN_LOCK_FILE, command=None):
+        self.state_file = state_file
+        self.lock_file = lock_file
+        self.command = command
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.jobs = {}
+        self.worker = None
+
+    def start_worker(self):
+        """启动后台执行线程（Web进程启动时调用一次）"""
+        with self.lock:
+            if self.worker and self.worker.is_alive():
+                return
+            # 恢复持久化的排队任务
+            with _locked_state(self.state_file) as state:
+                _active_alive(state)
+                for record in state['queue']:
+                    self._job_for(record)
+            self.worker = threading.Thread(target=self._worker_loop, daemon=True)
+            self.worker.start()
+        self.wakeup.set()
+
+    def _job_for(self, record):
+        job = self.jobs.get(record['id'])
+        if job is None:
+            job = CheckJob(trigger=record['trigger'], command=self.command, job_id=record['id'])
+            self.jobs[record['id']] = job
+        return job
+
+    def submit(self, trigger='manual'):
+        """
+        提交检测请求
+
+        Returns:
+            (任务记录, 是否合并到已有任务)
+        """
+        with self.lock, _locked_state(self.state_file) as state:
+            target = state['queue'][0] if state['queue'] else None
+            if target is None and _active_alive(state):
+                target = state['active']
+
+            if target is not None:
+                target['coalesced'].append({'trigger': trigger, 'time': _format_time(time.time())})
+                return dict(target), True
+
+            record = _new_record(trigger)
+            state['queue'].append(record)
+            self._job_for(record)
+            self._prune()
+
+        self.wakeup.set()
+        return dict(record), False
+
+    def _prune(self):
+        finished = sorted((j for j in self.jobs.values() if j.finished), key=lambda j: j.finished_at)
+        for old in finished[:-MAX_FINISHED_JOBS]:
+            self.jobs.pop(old.id, None)
+
+    def get(self, job_id):
+        """进程内任务对象（用于推送事件），其它进程运行的任务返回None"""
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """取消排队或运行中的任务"""
+        with self.lock, _locked_state(self.state_file) as state:
+            for record in state['queue']:
+                if record['id'] == job_id:
+                    state['queue'].remove(record)
+                    record.update(status='cancelled', finished_at=_format_time(time.time()), duration=0)
+                    state['history'].append(record)
+                    job = self.jobs.get(job_id)
+                    if job:
+                        job.cancel()
+                    return True
+
+            active = state['active']
+            if not active or active['id'] != job_id:
+                return False
+
+        job = self.get(job_id)
+        if job:
+            return job.cancel()
+
+        # 由其它进程（如cron）运行的任务，终止其进程组
+        if active.get('pid'):
+            try:
+                os.killpg(active['pid'], signal.SIGTERM)
+                return True
+            except ProcessLookupError:
+                pass
+        return False
+
+    def status(self):
+        """
+        队列状态：运行中、排队中的任务和最近历史
+
+        只读，不修改状态文件；已不在运行的任务显示为 interrupted，
+        下次提交或执行任务时才写入历史。
+        """
+        state = _read_state(self.state_file)
+        active = state['active']
+        if active and not _active_running(active):
+            active = dict(active, status='interrupted')
+        return {
+            'active': active,
+            'queue': state['queue'],
+            'history': list(reversed(state['history'][-20:]))
+        }
+
+    def history(self, limit=50):
+        """最近的运行历史（只读）"""
+        return list(reversed(_read_state(self.state_file)['history'][-limit:]))
+
+    def _acquire_run_lock(self, blocking=True):
+        """获取进程间运行锁，返回锁文件对象，获取失败返回None"""
+        os.makedirs(os.path.dirname(self.lock_file) or '.', exist_ok=True)
+        handle = open(self.lock_file, 'a')
+        while True:
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return handle
+            except BlockingIOError:
+                if not blocking:
+                    handle.close()
+                    return None
+                time.sleep(2)
+
+    def _run(self, record, job, lock_handle):
+        """在持有运行锁的情况下执行任务并记录历史"""
+        try:
+            job.start(lock_fd=lock_handle.fileno())
+
+            with _locked_state(self.state_file) as state:
+                if state['active'] and state['active']['id'] == record['id']:
+                    state['active']['pid'] = job.process.pid
+
+            job.wait()
+
+            with _locked_state(self.state_file) as state:
+                _finish_record(state, record, job)
+        finally:
+            # 只关闭本进程的句柄，不能 LOCK_UN（会同时释放检测进程继承的锁）
+            lock_handle.close()
+
+    def _worker_loop(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+
+            while True:
+                with self.lock, _locked_state(self.state_file) as state:
+                    if not state['queue']:
+                        break
+                    record = state['queue'][0]
+                    job = self._job_for(record)
+
+                # 其它进程（cron）正在运行时等待其结束
+                lock_handle = self._acquire_run_lock()
+
+                with self.lock, _locked_state(self.state_file) as state:
+                    if not state['queue'] or state['queue'][0]['id'] != record['id']:
+                        # 等待期间被取消
+                        lock_handle.close()
+                        continue
+                    record = _activate(state, state['queue'].pop(0))
+
+                try:
+                    self._run(record, job, lock_handle)
+                except Exception as e:
+                    print(f"❌ 检测任务执行失败: {e}")
+
+    def run_foreground(self, trigger='cron'):
+        """
+        在当前进程中直接运行一次检测（供cron调用）
+
+        已有检测在运行时不再重复执行，只把本次触发合并记录到该任务。
+
+        Returns:
+            退出码；合并到已有任务时返回0
+        """
+        lock_handle = self._acquire_run_lock(blocking=False)
+        if lock_handle is None:
+            record, _ = self.submit(trigger)
+            print(f"ℹ️  已有检测任务在运行（{record['id']}），本次触发已合并")
+            return 0
+
+        with _locked_state(self.state_file) as state:
+            # 排队中的任务由本次运行一并完成
+            record = state['queue'].pop(0) if state['queue'] else _new_record(trigger)
+            if record['trigger'] != trigger:
+                record['coalesced'].append({'trigger': trigger, 'time': _format_time(time.time())})
+            _activate(state, record)
+
+        job = CheckJob(trigger=record['trigger'], command=self.command, job_id=record['id'], echo=True)
+        self._run(record, job, lock_handle)
+        return job.returncode if job.returncode is not None else 1
+
+
+def format_sse(event):
+    """格式化为Server-Sent Events消息"""
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BTAUTOCHECK 检测任务队列')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='运行一次检测（已有检测在运行时合并）')
+    run_parser.add_argument('--trigger', default='cron', help='触发来源')
+
+    subparsers.add_parser('status', help='查看运行中/排队中的任务')
+
+    history_parser = subparsers.add_parser('history', help='查看运行历史')
+    history_parser.add_argument('--limit', type=int, default=20)
+
+    cancel_parser = subparsers.add_parser('cancel', help='取消任务')
+    cancel_parser.add_argument('job_id')
+
+    args = parser.parse_args()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    queue = CheckJobQueue()
+
+    if args.command == 'run':
+        return queue.run_foreground(args.trigger)
+    if args.command == 'status':
+        print(json.dumps(queue.status(), indent=2, ensure_ascii=False))
+    elif args.command == 'history':
+        for record in queue.history(args.limit):
+            print(f"{record['id']}  {record['status']:<11} {record['trigger']:<10} "
+                  f"{record.get('started_at') or record['requested_at']}  {record.get('duration')}s  "
+                  f"合并{len(record.get('coalesced', []))}次")
+    elif args.command == 'cancel':
+        print('✅ 已取消' if queue.cancel(args.job_id) else '❌ 任务不存在或已结束')
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BTAUTOCHECK 配置存储
+Atomic, Versioned config.json Writes
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+
+# 配置文件中的修订号字段，每次写入递增
+REVISION_KEY = '_revision'
+
+
+class ConfigConflictError(Exception):
+    """配置在读取后已被其它写入者修改（比较并交换失败）"""
+
+    def __init__(self, expected, actual):
+        super().__init__(f"配置已被修改（期望修订号 {expected}，当前 {actual}），请刷新后重试")
+        self.expected = expected
+        self.actual = actual
+
+
+_thread_lock = threading.RLock()
+
+
+def get_revision(config):
+    """配置字典的修订号（旧配置文件没有修订号时为0）"""
+    return int(config.get(REVISION_KEY, 0) or 0)
+
+
+@contextmanager
+def _locked(path):
+    """进程内线程锁 + 进程间文件锁（锁文件与配置文件同目录）"""
+    with _thread_lock:
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_config(path=CONFIG_FILE):
+    """读取配置文件（原始内容，加密字段保持 ENC[...]），不存在时返回空字典"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_atomic(path, config):
+    """写入临时文件后原子替换，读者不会读到写了一半的配置"""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_file = os.path.join(directory, f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        # 保留原文件权限（配置中含密钥）
+        if os.path.exists(path):
+            os.chmod(tmp_file, os.stat(path).st_mode & 0o777)
+        os.replace(tmp_file, path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def update_config(mutator, path=CONFIG_FILE, expected_revision=None):
+    """
+    加锁读取-修改-写入配置
+
+    Args:
+        mutator: mutator(config)，原地修改配置或返回新的配置字典
+        path: 配置文件路径
+        expected_revision: 期望的当前修订号（比较并交换），为None时不检查
+
+    Returns:
+        写入后的配置字典
+
+    Raises:
+        ConfigConflictError: 当前修订号与 expected_revision 不一致
+    """
+    with _locked(path):
+        current = read_config(path)
+        revision = get_revision(current)
+        if expected_revision is not None and int(expected_revision) != revision:
+            raise ConfigConflictError(expected_revision, revision)
+
+        result = mutator(current)
+        config = current if result is None else result
+        config[REVISION_KEY] = revision + 1
+
+        _write_atomic(path, config)
+        return config
+
+
+def write_config(config, path=CONFIG_FILE, expected_revision=None):
+    """整体写入配置（修订号自动递增）"""
+    new_config = dict(config)
+    return update_config(lambda current: new_config, path, expected_revision)
+
+
+def set_value(key, value, path=CONFIG_FILE):
+    """更新单个顶层配置项，保留其它字段（包括加密字段）原样"""
+    return update_config(lambda current: current.__setitem__(key, value), path)
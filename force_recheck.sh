@@ -59,6 +59,7 @@ cp config.json config.json.force_backup
 # 删除旧的检测结果
 echo "删除旧的检测结果..."
 rm -f downloads/security_report_${current_version}.json
+rm -f downloads/report_findings_${current_version}.json*
 rm -f downloads/SECURITY_REPORT_${current_version}.md
 rm -f downloads/extracted_${current_version}/.analyzed
 echo "✅ 已清理"
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BTAUTOCHECK 日志读取工具
+Log Tail and Ranged Reader
+"""
+
+import os
+
+# 单次读取的默认/最大字节数
+DEFAULT_RANGE_BYTES = 256 * 1024
+MAX_RANGE_BYTES = 1024 * 1024
+
+TAIL_CHUNK_SIZE = 8192
+
+
+def tail_lines(path, limit=10):
+    """
+    从文件末尾向前读取最后 limit 行（不读取整个文件）
+
+    Returns:
+        行列表（已去除行尾换行符）
+    """
+    if limit <= 0:
+        return []
+
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        # 多读一行，保证第一行完整
+        while position > 0 and data.count(b'\n') <= limit:
+            read_size = min(TAIL_CHUNK_SIZE, position)
+            position -= read_size
+            f.seek(position)
+            data = f.read(read_size) + data
+
+    lines = data.decode('utf-8', errors='replace').splitlines()
+    return [line.strip() for line in lines[-limit:]]
+
+
+def read_range(path, offset=None, before=None, limit=DEFAULT_RANGE_BYTES):
+    """
+    按字节范围读取日志，返回的范围总是对齐到整行
+
+    Args:
+        path: 日志文件路径
+        offset: 从该位置向后读取（跟踪追加内容时传入上次返回的 end）
+        before: 读取该位置之前的内容（向前翻页时传入上次返回的 start）
+        limit: 最多读取的字节数
+        两者都省略时读取文件末尾
+
+    Returns:
+        {'content', 'start', 'end', 'size', 'reset'}，start/end 为下一次请求的游标；
+        reset 表示文件被截断或轮转，游标已回到开头
+    """
+    limit = max(1, min(int(limit), MAX_RANGE_BYTES))
+    size = os.path.getsize(path)
+    reset = False
+
+    with open(path, 'rb') as f:
+        if offset is not None:
+            offset = int(offset)
+            if offset > size:
+                # 文件被截断，从头开始
+                offset = 0
+                reset = True
+            start = max(0, offset)
+            f.seek(start)
+            data = f.read(limit)
+            # 文件仍在写入时不返回不完整的最后一行
+            newline = data.rfind(b'\n')
+            if newline >= 0:
+                data = data[:newline + 1]
+            elif len(data) < limit:
+                data = b''
+            end = start + len(data)
+        else:
+            end = size if before is None else max(0, min(int(before), size))
+            start = max(0, end - limit)
+            f.seek(start)
+            data = f.read(end - start)
+            # 丢弃开头不完整的一行
+            if start > 0:
+                newline = data.find(b'\n')
+                if newline >= 0:
+                    data = data[newline + 1:]
+                    start += newline + 1
+
+    return {
+        'content': data.decode('utf-8', errors='replace'),
+        'start': start,
+        'end': end,
+        'size': size,
+        'reset': reset
+    }
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地AI提供商模拟服务器（离线压测用）
+Local Mock AI Provider Server for Offline Benchmarking
+
+模拟 ai_analyzer.py 中各 _call_* 方法使用的请求/响应格式：
+OpenAI兼容接口（OpenAI/DeepSeek/Kimi/Grok/智谱）、Gemini、Claude、
+通义千问(DashScope)、文心一言。支持可配置的延迟分布、错误率和预设返回结果，
+请求开启流式输出时以SSE分块返回。
+
+用法:
+    python3 mock_ai_server.py --port 8765 --latency uniform:0.5,2 --error-rate 0.1
+    BTAUTOCHECK_AI_BASE_URL=http://127.0.0.1:8765 python3 ai_analyzer.py test
+"""
+
+import sys
+import json
+import time
+import random
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+
+# 默认返回的分析结果
+DEFAULT_RESPONSE = {
+    "security_score": 82,
+    "risk_level": "low",
+    "findings": [
+        {"type": "命令执行", "severity": "medium", "description": "使用eval执行动态代码，存在代码注入风险", "line": 5},
+        {"type": "隐私泄露", "severity": "low", "description": "向第三方统计接口上报数据", "line": 12}
+    ],
+    "recommendation": "模拟结果：建议人工复核动态执行代码",
+    "safe_to_use": True
+}
+
+
+def parse_latency(spec):
+    """
+    解析延迟分布描述
+
+    支持: fixed:0.5 / uniform:0.2,1.5 / normal:1.0,0.3 / lognormal:0,0.5
+
+    Returns:
+        (分布名称, 参数列表)
+    """
+    if not spec:
+        return ('fixed', [0.0])
+
+    name, _, args = spec.partition(':')
+    name = name.strip().lower()
+    params = [float(x) for x in args.split(',') if x.strip()] if args else []
+
+    expected = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2}
+    if name not in expected or len(params) != expected[name]:
+        raise ValueError(f"无效的延迟分布: {spec}")
+
+    return (name, params)
+
+
+def detect_provider(path):
+    """根据请求路径判断模拟的提供商"""
+    if ':generateContent' in path or ':streamGenerateContent' in path:
+        return 'gemini'
+    if path.endswith('/v1/messages'):
+        return 'claude'
+    if path.endswith('/text-generation/generation'):
+        return 'qianwen'
+    if path.endswith('/oauth/2.0/token'):
+        return 'wenxin_auth'
+    if 'wenxinworkshop' in path:
+        return 'wenxin'
+    if path.endswith('/chat/completions'):
+        return 'openai'
+    return None
+
+
+class MockAIServer:
+    """AI提供商模拟服务器"""
+
+    def __init__(self, host='127.0.0.1', port=8765, latency='fixed:0', error_rate=0.0,
+                 error_status=503, malformed_rate=0.0, response=None, profiles=None, seed=None,
+                 chunk_size=16, chunk_delay=0.0):
+        """
+        初始化模拟服务器
+
+        Args:
+            host: 监听地址
+            port: 监听端口（0表示随机端口）
+            latency: 默认延迟分布
+            error_rate: 默认错误率（0-1）
+            error_status: 出错时返回的HTTP状态码
+            malformed_rate: 返回非JSON文本的比例，用于测试解析失败路径
+            response: 预设返回的分析结果字典
+            profiles: 按提供商覆盖的配置，如 {"openai": {"latency": "fixed:2", "error_rate": 0.5}}
+            seed: 随机种子，保证压测可复现
+            chunk_size: 流式输出时每个SSE事件包含的字符数
+            chunk_delay: 流式输出时每个SSE事件之间的间隔（秒）
+        """
+        self.host = host
+        self.port = port
+        self.default_profile = {
+            'latency': parse_latency(latency),
+            'error_rate': error_rate,
+            'error_status': error_status,
+            'malformed_rate': malformed_rate,
+            'response': response or DEFAULT_RESPONSE,
+            'chunk_size': chunk_size,
+            'chunk_delay': chunk_delay
+        }
+        self.profiles = {}
+        for provider, profile in (profiles or {}).items():
+            merged = dict(self.default_profile)
+            merged.update(profile)
+            if isinstance(merged['latency'], str):
+                merged['latency'] = parse_latency(merged['latency'])
+            self.profiles[provider] = merged
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def base_url(self):
+        """供 api_base_override / BTAUTOCHECK_AI_BASE_URL 使用的地址"""
+        return f"http://{self.host}:{self.port}"
+
+    def get_profile(self, provider):
+        """获取提供商配置"""
+        return self.profiles.get(provider, self.default_profile)
+
+    def sample_latency(self, profile):
+        """按分布采样一次延迟（秒）"""
+        name, params = profile['latency']
+        with self.lock:
+            if name == 'fixed':
+                value = params[0]
+            elif name == 'uniform':
+                value = self.random.uniform(params[0], params[1])
+            elif name == 'normal':
+                value = self.random.gauss(params[0], params[1])
+            else:
+                value = self.random.lognormvariate(params[0], params[1])
+        return max(0.0, value)
+
+    def roll(self, rate):
+        """按概率判定是否命中"""
+        if rate <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def record(self, provider, outcome, latency):
+        """记录请求统计"""
+        with self.lock:
+            stats = self.stats.setdefault(provider, {'requests': 0, 'ok': 0, 'error': 0, 'malformed': 0,
+                                                     'stream_aborted': 0, 'total_latency': 0.0})
+            if outcome != 'stream_aborted':
+                stats['requests'] += 1
+                stats['total_latency'] += latency
+            stats[outcome] += 1
+
+    def build_body(self, provider, text):
+        """按提供商格式包装回复文本"""
+        if provider == 'gemini':
+            return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+        if provider == 'claude':
+            return {"type": "message", "role": "assistant", "content": [{"type": "text", "text": text}]}
+        if provider == 'qianwen':
+            return {"output": {"choices": [{"message": {"role": "assistant", "content": text}}]}}
+        if provider == 'wenxin':
+            return {"result": text}
+        return {"object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}}]}
+
+    def build_stream_event(self, provider, chunk):
+        """按提供商格式包装一个流式增量"""
+        if provider == 'gemini':
+            return {"candidates": [{"content": {"parts": [{"text": chunk}], "role": "model"}}]}
+        if provider == 'claude':
+            return {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": chunk}}
+        if provider == 'qianwen':
+            return {"output": {"choices": [{"message": {"role": "assistant", "content": chunk}}]}}
+        if provider == 'wenxin':
+            return {"result": chunk, "is_end": False}
+        return {"object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {"content": chunk}}]}
+
+    def handle(self, provider, stream=False):
+        """
+        处理一次模拟请求
+
+        Args:
+            provider: 提供商
+            stream: 是否以SSE流式返回
+
+        Returns:
+            (HTTP状态码, 响应字典)；流式成功时响应为SSE事件列表
+        """
+        if provider == 'wenxin_auth':
+            return 200, {"access_token": "mock-access-token", "expires_in": 2592000}
+
+        profile = self.get_profile(provider)
+        latency = self.sample_latency(profile)
+        time.sleep(latency)
+
+        if self.roll(profile['error_rate']):
+            self.record(provider, 'error', latency)
+            return profile['error_status'], {"error": {"message": "mock upstream error"}}
+
+        if self.roll(profile['malformed_rate']):
+            self.record(provider, 'malformed', latency)
+            text = "分析完成，但这不是合法的JSON {\"security_score\": 8"
+        else:
+            self.record(provider, 'ok', latency)
+            text = "```json\n" + json.dumps(profile['response'], ensure_ascii=False, indent=2) + "\n```"
+
+        if stream:
+            size = max(1, profile['chunk_size'])
+            return 200, [self.build_stream_event(provider, text[i:i + size])
+                         for i in range(0, len(text), size)]
+
+        return 200, self.build_body(provider, text)
+
+    def start(self):
+        """在后台线程启动服务器（供进程内压测使用）"""
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def stop(self):
+        """停止服务器"""
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def serve_forever(self):
+        """前台运行服务器"""
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        try:
+            self.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.httpd.server_close()
+
+    def _make_handler(self):
+        """构造绑定到当前服务器实例的请求处理类"""
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, provider, events):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+
+                delay = server.get_profile(provider)['chunk_delay']
+                try:
+                    for event in events:
+                        line = 'data: ' + json.dumps(event, ensure_ascii=False) + '\n\n'
+                        self.wfile.write(line.encode('utf-8'))
+                        self.wfile.flush()
+                        if delay:
+                            time.sleep(delay)
+                    if provider not in ('gemini', 'claude', 'qianwen', 'wenxin'):
+                        self.wfile.write(b'data: [DONE]\n\n')
+                        self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端提前中断（如分诊模式已拿到评分）
+                    server.record(provider, 'stream_aborted', 0.0)
+
+            def _dispatch(self):
+                parts = urlsplit(self.path)
+                path = parts.path
+                length = int(self.headers.get('Content-Length', 0) or 0)
+                body = {}
+                if length:
+                    try:
+                        body = json.loads(self.rfile.read(length) or b'{}')
+                    except ValueError:
+                        body = {}
+
+                if path == '/stats':
+                    with server.lock:
+                        self._send_json(200, server.stats)
+                    return
+
+                provider = detect_provider(path)
+                if not provider:
+                    self._send_json(404, {"error": {"message": f"unknown path: {path}"}})
+                    return
+
+                stream = (isinstance(body, dict) and body.get('stream') is True) \
+                    or ':streamGenerateContent' in path \
+                    or self.headers.get('X-DashScope-SSE', '').lower() == 'enable'
+
+                status, response = server.handle(provider, stream)
+                if isinstance(response, list):
+                    self._send_stream(provider, response)
+                else:
+                    self._send_json(status, response)
+
+            def do_GET(self):
+                self._dispatch()
+
+            def do_POST(self):
+                self._dispatch()
+
+        return Handler
+
+
+def main():
+    """命令行接口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='BTAUTOCHECK AI提供商模拟服务器')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--port', type=int, default=8765, help='监听端口')
+    parser.add_argument('--latency', default='fixed:0',
+                       help='延迟分布: fixed:S / uniform:A,B / normal:MU,SIGMA / lognormal:MU,SIGMA')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='错误率 (0-1)')
+    parser.add_argument('--error-status', type=int, default=503, help='出错时的HTTP状态码')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='返回非JSON文本的比例 (0-1)')
+    parser.add_argument('--response', help='预设分析结果JSON文件')
+    parser.add_argument('--profiles', help='按提供商覆盖配置的JSON文件')
+    parser.add_argument('--seed', type=int, help='随机种子（保证结果可复现）')
+    parser.add_argument('--chunk-size', type=int, default=16, help='流式输出每个事件的字符数')
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help='流式输出事件间隔（秒）')
+
+    args = parser.parse_args()
+
+    response = None
+    if args.response:
+        with open(args.response, 'r', encoding='utf-8') as f:
+            response = json.load(f)
+
+    profiles = None
+    if args.profiles:
+        with open(args.profiles, 'r', encoding='utf-8') as f:
+            profiles = json.load(f)
+
+    try:
+        server = MockAIServer(args.host, args.port, args.latency, args.error_rate, args.error_status,
+                              args.malformed_rate, response, profiles, args.seed,
+                              args.chunk_size, args.chunk_delay)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    print("=" * 60)
+    print("🧪 AI提供商模拟服务器")
+    print("=" * 60)
+    print(f"📍 地址: {server.base_url}")
+    print(f"⏱️  延迟: {args.latency}")
+    print(f"❌ 错误率: {args.error_rate}")
+    print(f"📊 统计: {server.base_url}/stats")
+    print(f"\n使用方式: export BTAUTOCHECK_AI_BASE_URL={server.base_url}")
+    print("=" * 60)
+
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
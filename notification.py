@@ -5,7 +5,6 @@
 Notification Module - Multi-channel notification support
 """
 
-import json
 import os
 import sys
 import smtplib
@@ -13,28 +12,23 @@ import requests
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime
+from secure_config import SecureConfig
 
 class NotificationManager:
     """通知管理器"""
     
     def __init__(self, config_file='config.json'):
-        """初始化通知管理器"""
-        self.config_file = config_file
-        self.config = self.load_config()
-        self.notification_config = self.config.get('notifications', {})
-        
-    def load_config(self):
-        """加载配置文件"""
-        if not os.path.exists(self.config_file):
-            print(f"❌ 配置文件不存在: {self.config_file}")
-            return {}
-        
-        try:
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"❌ 加载配置失败: {e}")
-            return {}
+        """初始化通知管理器（配置通过 SecureConfig 读取，配置文件修改后立即生效）"""
+        self.secure_config = SecureConfig(config_file)
+    
+    @property
+    def config(self):
+        """解密后的当前配置（进程内共享缓存，配置文件未变化时只需一次 stat）"""
+        return self.secure_config.get_config()
+    
+    @property
+    def notification_config(self):
+        return self.config.get('notifications', {})
     
     def send_all(self, title, message, level="info"):
         """
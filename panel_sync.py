@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+面板文件增量同步
+Delta Apply of Upgrade Packages with Rollback Manifest
+"""
+
+import os
+import sys
+import json
+import stat
+import shutil
+import hashlib
+import uuid
+from datetime import datetime
+
+# 不删除其中多余文件的目录（用户数据、日志、插件等不在升级包中）
+DEFAULT_PROTECTED_PATHS = ['data', 'logs', 'vhost', 'plugin', 'ssl', 'config', 'backup', 'temp', 'tmp']
+
+# 保留的回滚清单数量
+KEEP_MANIFESTS = 3
+
+HASH_READ_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """计算文件SHA256"""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_READ_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def file_md5(path):
+    """计算文件MD5"""
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_READ_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def tree_manifest_path(tree_dir):
+    """解压目录的清单文件（放在目录外，不属于升级包内容）"""
+    return os.path.normpath(tree_dir) + '.manifest.json'
+
+
+def build_tree_manifest(tree_dir):
+    """
+    目录中每个文件的大小和SHA256，以及每个符号链接的目标
+
+    Returns:
+        {相对路径: [大小, SHA256]}，符号链接为 {相对路径: ['link', 链接目标]}
+    """
+    entries = {}
+    for root, dirs, files in os.walk(tree_dir):
+        # 指向目录的符号链接出现在 dirs 中（不展开）
+        for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, tree_dir)
+            if os.path.islink(path):
+                entries[rel] = ['link', os.readlink(path)]
+            else:
+                entries[rel] = [os.path.getsize(path), file_sha256(path)]
+    return entries
+
+
+def manifest_digest(entries):
+    """清单摘要：对排序后的 路径/大小/SHA256（符号链接为 link/目标）计算SHA256"""
+    sha256 = hashlib.sha256()
+    for path in sorted(entries):
+        size, digest = entries[path]
+        sha256.update(f"{path}\0{size}\0{digest}\n".encode('utf-8'))
+    return sha256.hexdigest()
+
+
+def write_tree_manifest(tree_dir, package_md5):
+    """
+    记录已扫描的解压目录内容（由静态检测步骤在解压后调用）
+
+    升级时核对清单，确认解压目录与扫描时完全一致后直接使用，不再重新解压。
+    """
+    entries = build_tree_manifest(tree_dir)
+    manifest = {
+        'package_md5': package_md5,
+        'created_at': datetime.now().isoformat(),
+        'digest': manifest_digest(entries),
+        'files': entries
+    }
+    tmp_file = tree_manifest_path(tree_dir) + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_file, tree_manifest_path(tree_dir))
+    return manifest['digest']
+
+
+def verify_tree_manifest(tree_dir, package_md5):
+    """
+    核对解压目录是否仍是扫描时的内容（升级包MD5一致、文件集合及每个文件的SHA256、
+    每个符号链接的目标一致）
+
+    Returns:
+        (是否一致, 原因)
+    """
+    try:
+        with open(tree_manifest_path(tree_dir), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False, '没有扫描清单'
+
+    if manifest.get('package_md5') != package_md5:
+        return False, '升级包与扫描时不一致'
+    if manifest_digest(manifest['files']) != manifest.get('digest'):
+        return False, '扫描清单已损坏'
+    if not os.path.isdir(tree_dir):
+        return False, '解压目录不存在'
+    if manifest_digest(build_tree_manifest(tree_dir)) != manifest['digest']:
+        return False, '解压目录在扫描后被修改'
+    return True, f"{len(manifest['files'])} 个文件/链接与扫描清单一致"
+
+
+def _is_protected(rel_path, protected_paths):
+    first = rel_path.split(os.sep, 1)[0]
+    return first in protected_paths or rel_path in protected_paths
+
+
+def _is_real_dir(path):
+    """是目录且不是符号链接"""
+    try:
+        return stat.S_ISDIR(os.lstat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def _same_file(src, dst, src_stat):
+    """大小不同直接判定为已修改，大小相同时才比较哈希"""
+    try:
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    if stat.S_ISLNK(src_stat.st_mode) or stat.S_ISLNK(dst_stat.st_mode):
+        return (stat.S_ISLNK(src_stat.st_mode) and stat.S_ISLNK(dst_stat.st_mode)
+                and os.readlink(src) == os.readlink(dst))
+    if not stat.S_ISREG(dst_stat.st_mode) or dst_stat.st_size != src_stat.st_size:
+        return False
+    return file_sha256(src) == file_sha256(dst)
+
+
+def plan_delta(source_dir, target_dir, protected_paths=None, delete_obsolete=True):
+    """
+    比较升级包目录与面板目录
+
+    多余文件只在升级包包含的顶层目录内删除（与原先整目录替换的范围一致），
+    且跳过 protected_paths 中的目录。
+
+    文件与目录互换（面板中是目录而升级包中是文件，或反之）记为带 type_change 的
+    update：整体替换该路径，目录内的文件不再逐个列出删除。
+
+    Returns:
+        变更列表 [{'action': 'add'|'update'|'remove', 'path': 相对路径, 'type_change': 可选}]
+    """
+    protected_paths = DEFAULT_PROTECTED_PATHS if protected_paths is None else protected_paths
+    changes = []
+    package_files = set()
+    type_changes = set()
+
+    for root, dirs, files in os.walk(source_dir):
+        dirs.sort()
+        for name in dirs:
+            src = os.path.join(root, name)
+            rel = os.path.relpath(src, source_dir)
+            dst = os.path.join(target_dir, rel)
+            if not os.path.islink(src) and os.path.lexists(dst) and not _is_real_dir(dst):
+                # 面板中是文件（或符号链接），升级包中是目录
+                changes.append({'action': 'update', 'path': rel, 'type_change': True})
+                package_files.add(rel)
+                type_changes.add(rel)
+
+        for name in sorted(files) + sorted(d for d in dirs if os.path.islink(os.path.join(root, d))):
+            src = os.path.join(root, name)
+            rel = os.path.relpath(src, source_dir)
+            package_files.add(rel)
+            src_stat = os.lstat(src)
+            dst = os.path.join(target_dir, rel)
+            if not os.path.lexists(dst):
+                changes.append({'action': 'add', 'path': rel})
+            elif _is_real_dir(dst):
+                # 面板中是目录，升级包中是文件（或符号链接）
+                changes.append({'action': 'update', 'path': rel, 'type_change': True})
+                type_changes.add(rel)
+            elif not _same_file(src, dst, src_stat):
+                changes.append({'action': 'update', 'path': rel})
+
+    if delete_obsolete:
+        top_dirs = [name for name in os.listdir(source_dir)
+                    if os.path.isdir(os.path.join(source_dir, name)) and not os.path.islink(os.path.join(source_dir, name))]
+        for top in sorted(top_dirs):
+            if _is_protected(top, protected_paths) or top in type_changes:
+                continue
+            for root, dirs, files in os.walk(os.path.join(target_dir, top)):
+                # 整体替换的目录不再逐个删除其中的文件
+                dirs[:] = sorted(d for d in dirs
+                                 if os.path.relpath(os.path.join(root, d), target_dir) not in type_changes)
+                for name in sorted(files) + sorted(d for d in dirs if os.path.islink(os.path.join(root, d))):
+                    rel = os.path.relpath(os.path.join(root, name), target_dir)
+                    if rel not in package_files and not _is_protected(rel, protected_paths):
+                        changes.append({'action': 'remove', 'path': rel})
+
+    return changes
+
+
+def _replace_file(src, dst):
+    """写入临时文件后改名替换（不原地覆盖，已打开旧文件的进程和以硬链接保存的原文件不受影响）"""
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = os.path.join(os.path.dirname(dst), f".{os.path.basename(dst)}.btupgrade.tmp")
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), tmp)
+    else:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _link_or_copy(src, dst):
+    """同一文件系统用硬链接，不复制数据"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _save_original(path, store_path):
+    """保存被修改/删除前的文件或目录（不改动面板目录）"""
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    if os.path.islink(path):
+        os.symlink(os.readlink(path), store_path)
+    elif os.path.isdir(path):
+        shutil.copytree(path, store_path, symlinks=True, copy_function=_link_or_copy)
+    else:
+        _link_or_copy(path, store_path)
+
+
+def _remove_path(path):
+    """删除文件、符号链接或整个目录"""
+    if _is_real_dir(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _restore_original(store_path, dst):
+    """把保存的原文件或目录放回面板目录"""
+    if _is_real_dir(store_path):
+        _remove_path(dst)
+        shutil.copytree(store_path, dst, symlinks=True, copy_function=_link_or_copy)
+    else:
+        if _is_real_dir(dst):
+            shutil.rmtree(dst)
+        _replace_file(store_path, dst)
+
+
+def apply_delta(source_dir, target_dir, manifest_dir='backups', version='', protected_paths=None,
+                delete_obsolete=True):
+    """
+    增量应用升级包
+
+    只写入新增/修改的文件（临时文件+改名），删除多余文件；被替换或删除的原文件
+    以硬链接保存在面板目录旁，并生成变更清单供回滚。
+
+    修改面板目录前变更清单已写入；修改过程中出错时按清单回滚后重新抛出异常，
+    面板目录保持原状。旧清单不在这里清理，升级验证成功后调用 prune_manifests()。
+
+    Returns:
+        (变更清单文件路径, 变更列表)
+    """
+    changes = plan_delta(source_dir, target_dir, protected_paths, delete_obsolete)
+
+    # 同一秒内多次应用时原文件目录和清单也不能重名（失败清理时会删除原文件目录）
+    run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    parent = os.path.dirname(os.path.abspath(target_dir))
+    store_dir = os.path.join(parent, f".{os.path.basename(os.path.abspath(target_dir))}_delta_{run_id}")
+    os.makedirs(store_dir)
+    os.makedirs(manifest_dir, exist_ok=True)
+    manifest_file = os.path.join(manifest_dir, f"delta_{version}_{run_id}.json")
+    manifest = {
+        'version': version,
+        'target_dir': os.path.abspath(target_dir),
+        'store_dir': store_dir,
+        'created_at': datetime.now().isoformat(),
+        'changes': changes,
+        'created_dirs': _dirs_to_create(target_dir, changes),
+        'applied': 0
+    }
+
+    def save_manifest():
+        tmp_file = manifest_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_file, manifest_file)
+
+    # 先保存所有原文件再修改，中途失败也能按清单回滚
+    try:
+        for change in changes:
+            if change['action'] in ('update', 'remove'):
+                _save_original(os.path.join(target_dir, change['path']), os.path.join(store_dir, change['path']))
+        save_manifest()
+    except Exception:
+        # 面板目录尚未改动，只清理已保存的原文件
+        shutil.rmtree(store_dir, ignore_errors=True)
+        raise
+
+    try:
+        for change in changes:
+            dst = os.path.join(target_dir, change['path'])
+            src = os.path.join(source_dir, change['path'])
+            if change['action'] == 'remove':
+                os.remove(dst)
+            elif change.get('type_change'):
+                _remove_path(dst)
+                if _is_real_dir(src):
+                    os.makedirs(dst)
+                else:
+                    _replace_file(src, dst)
+            else:
+                _replace_file(src, dst)
+            manifest['applied'] += 1
+    except Exception as e:
+        print(f"❌ 增量更新失败（已应用 {manifest['applied']}/{len(changes)} 项）: {e}，按变更清单回滚")
+        rollback_delta(manifest_file)
+        raise
+    save_manifest()
+
+    return manifest_file, changes
+
+
+def _dirs_to_create(target_dir, changes):
+    """
+    新增文件时面板目录中将要新建的目录（相对路径，由浅到深）
+
+    文件与目录互换的路径不在其中，回滚时由 _restore_original 整体放回原文件。
+    """
+    type_changes = {change['path'] for change in changes if change.get('type_change')}
+    created = set()
+    for change in changes:
+        if change['action'] != 'add':
+            continue
+        parent = os.path.dirname(change['path'])
+        while parent and parent not in created:
+            if parent in type_changes or _is_real_dir(os.path.join(target_dir, parent)):
+                break
+            created.add(parent)
+            parent = os.path.dirname(parent)
+    return sorted(created, key=lambda path: (path.count('/'), path))
+
+
+def rollback_delta(manifest_file):
+    """按变更清单回滚：恢复被修改/删除的文件，删除新增的文件和新建的目录"""
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    target_dir = manifest['target_dir']
+    store_dir = manifest['store_dir']
+    restored = 0
+
+    for change in reversed(manifest['changes']):
+        dst = os.path.join(target_dir, change['path'])
+        if change['action'] == 'add':
+            if os.path.lexists(dst):
+                os.remove(dst)
+        elif change.get('type_change'):
+            _restore_original(os.path.join(store_dir, change['path']), dst)
+        else:
+            _replace_file(os.path.join(store_dir, change['path']), dst)
+        restored += 1
+
+    # 由深到浅删除升级时新建的目录；目录中有清单外的文件（如运行中生成的）时保留
+    for path in reversed(manifest.get('created_dirs', [])):
+        dst = os.path.join(target_dir, path)
+        if _is_real_dir(dst):
+            try:
+                os.rmdir(dst)
+            except OSError:
+                print(f"⚠️ 目录非空，保留: {dst}")
+
+    print(f"✅ 已回滚 {restored} 个文件")
+    return True
+
+
+def _manifest_created_at(path):
+    """清单的创建时间（读取失败时用文件修改时间）"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return datetime.fromisoformat(json.load(f)['created_at']).timestamp()
+    except (OSError, ValueError, KeyError, TypeError):
+        return os.path.getmtime(path)
+
+
+def prune_manifests(manifest_dir, keep=KEEP_MANIFESTS):
+    """
+    只保留最近几次的变更清单及其原文件（升级验证成功后调用）
+
+    按清单中的创建时间排序，不按文件名（版本号按字符串排序时 11.10.0 排在 11.9.0 前面）。
+    """
+    if not os.path.isdir(manifest_dir):
+        return
+    manifests = [os.path.join(manifest_dir, name) for name in os.listdir(manifest_dir)
+                 if name.startswith('delta_') and name.endswith('.json')]
+    manifests.sort(key=_manifest_created_at)
+    for path in manifests[:-keep] if keep else manifests:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                store_dir = json.load(f).get('store_dir')
+            if store_dir and os.path.isdir(store_dir):
+                shutil.rmtree(store_dir, ignore_errors=True)
+            os.remove(path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 清理旧变更清单失败 {os.path.basename(path)}: {e}")
+
+
+def main():
+    """命令行接口"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='BT-Panel 增量升级工具')
+    subparsers = parser.add_subparsers(dest='action')
+
+    plan_parser = subparsers.add_parser('plan', help='查看升级包与面板目录的差异')
+    plan_parser.add_argument('source', help='升级包解压目录')
+    plan_parser.add_argument('--target', default='/www/server/panel', help='面板目录')
+
+    rollback_parser = subparsers.add_parser('rollback', help='按变更清单回滚')
+    rollback_parser.add_argument('manifest', help='变更清单文件')
+
+    args = parser.parse_args()
+
+    if args.action == 'plan':
+        changes = plan_delta(args.source, args.target)
+        for change in changes:
+            print(f"{change['action']:<7} {change['path']}")
+        print(f"\n共 {len(changes)} 项变更")
+    elif args.action == 'rollback':
+        sys.exit(0 if rollback_delta(args.manifest) else 1)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
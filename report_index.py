@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BTAUTOCHECK 报告索引
+SQLite Index of Security Report Summaries
+"""
+
+import os
+import glob
+import sqlite3
+import threading
+from contextlib import contextmanager
+from report_store import load_summary
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    file_path TEXT PRIMARY KEY,
+    version TEXT,
+    check_time TEXT,
+    static_score NUMERIC,
+    ai_score NUMERIC,
+    risk_files INTEGER,
+    total_issues INTEGER,
+    is_safe INTEGER,
+    mtime REAL,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_reports_check_time ON reports(check_time);
+
+CREATE TABLE IF NOT EXISTS category_stats (
+    file_path TEXT,
+    category TEXT,
+    count INTEGER,
+    PRIMARY KEY (file_path, category)
+);
+
+CREATE TABLE IF NOT EXISTS ai_usage (
+    file_path TEXT PRIMARY KEY,
+    provider TEXT,
+    average_score NUMERIC,
+    analyzed_files INTEGER,
+    total_tokens INTEGER,
+    total_cost REAL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class ReportIndex:
+    """报告索引 - 报告写入时更新，分析查询只读索引，不再逐个解析JSON"""
+
+    _lock = threading.Lock()
+
+    def __init__(self, downloads_dir='downloads', db_file=None):
+        """
+        初始化报告索引
+
+        Args:
+            downloads_dir: 报告所在目录
+            db_file: 索引数据库文件（默认 downloads/report_index.db）
+        """
+        self.downloads_dir = downloads_dir
+        self.db_file = db_file or os.path.join(downloads_dir, 'report_index.db')
+        os.makedirs(os.path.dirname(self.db_file) or '.', exist_ok=True)
+
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """打开连接并在一个事务内使用，结束时提交（异常时回滚）并关闭连接"""
+        conn = sqlite3.connect(self.db_file, timeout=10)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def index_report(self, file_path, data=None):
+        """
+        写入或更新单个报告的索引
+
+        Args:
+            file_path: 报告文件路径
+            data: 已加载的报告内容（省略时读取报告摘要）
+        """
+        if data is None:
+            data = load_summary(file_path)
+
+        stat = os.stat(file_path)
+        static_analysis = data.get('static_analysis') or {}
+        ai_analysis = data.get('ai_analysis') or {}
+        category_stats = static_analysis.get('category_stats') or {}
+
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_path,
+                 data.get('version', 'unknown'),
+                 data.get('check_time', ''),
+                 static_analysis.get('security_score', 0),
+                 ai_analysis.get('average_score', 0) if ai_analysis else 0,
+                 static_analysis.get('risk_files_count', static_analysis.get('risky_files', 0)),
+                 static_analysis.get('total_issues', 0),
+                 1 if static_analysis.get('is_safe') else 0,
+                 stat.st_mtime,
+                 stat.st_size))
+
+            conn.execute("DELETE FROM category_stats WHERE file_path = ?", (file_path,))
+            conn.executemany(
+                "INSERT INTO category_stats VALUES (?, ?, ?)",
+                [(file_path, category, count) for category, count in category_stats.items()])
+
+            conn.execute("DELETE FROM ai_usage WHERE file_path = ?", (file_path,))
+            if ai_analysis:
+                usage = ai_analysis.get('usage') or {}
+                conn.execute(
+                    "INSERT INTO ai_usage VALUES (?, ?, ?, ?, ?, ?)",
+                    (file_path,
+                     ai_analysis.get('provider', 'unknown'),
+                     ai_analysis.get('average_score', 0),
+                     ai_analysis.get('analyzed_files', 0),
+                     usage.get('total_tokens', 0),
+                     usage.get('total_cost', 0)))
+
+    def remove_report(self, file_path):
+        """从索引中删除报告"""
+        with self._lock, self._connect() as conn:
+            for table in ('reports', 'category_stats', 'ai_usage'):
+                conn.execute(f"DELETE FROM {table} WHERE file_path = ?", (file_path,))
+
+    def sync(self, force=False):
+        """
+        与报告目录同步（补录手工放入或未经索引写入的报告，清理已删除的报告）
+
+        目录修改时间未变化时直接返回，不做任何文件读取。
+        """
+        try:
+            dir_mtime = str(os.stat(self.downloads_dir).st_mtime)
+        except OSError:
+            return
+
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'dir_mtime'").fetchone()
+            if row and row['value'] == dir_mtime and not force:
+                return
+            indexed = {r['file_path']: (r['mtime'], r['size'])
+                       for r in conn.execute("SELECT file_path, mtime, size FROM reports")}
+
+        files = glob.glob(os.path.join(self.downloads_dir, 'security_report_*.json'))
+        for file_path in files:
+            try:
+                stat = os.stat(file_path)
+                if indexed.get(file_path) != (stat.st_mtime, stat.st_size):
+                    self.index_report(file_path)
+            except Exception as e:
+                print(f"索引报告失败 {file_path}: {e}")
+
+        for file_path in set(indexed) - set(files):
+            self.remove_report(file_path)
+
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('dir_mtime', ?)", (dir_mtime,))
+
+    def get_reports(self, since=None):
+        """
+        获取报告摘要列表（按检测时间升序）
+
+        Args:
+            since: 只返回该时间（'%Y-%m-%d %H:%M:%S'）之后的报告
+        """
+        query = "SELECT * FROM reports"
+        params = ()
+        if since:
+            query += " WHERE check_time >= ?"
+            params = (since,)
+        query += " ORDER BY check_time"
+
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def get_report(self, file_path):
+        """
+        获取单个报告的完整索引记录（含 category_stats 和 ai_usage）
+
+        Returns:
+            记录字典，未索引返回None
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM reports WHERE file_path = ?", (file_path,)).fetchone()
+            if not row:
+                return None
+            report = dict(row)
+            report['category_stats'] = {r['category']: r['count'] for r in conn.execute(
+                "SELECT category, count FROM category_stats WHERE file_path = ?", (file_path,))}
+            usage = conn.execute("SELECT * FROM ai_usage WHERE file_path = ?", (file_path,)).fetchone()
+            report['ai_usage'] = dict(usage) if usage else None
+        return report
+
+    def get_latest_report(self):
+        """获取最新报告摘要"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM reports ORDER BY check_time DESC LIMIT 1").fetchone()
+        return dict(row) if row else None
+
+    def get_category_stats(self, file_path):
+        """获取报告的分类统计"""
+        with self._connect() as conn:
+            return {row['category']: row['count'] for row in conn.execute(
+                "SELECT category, count FROM category_stats WHERE file_path = ?", (file_path,))}
+
+    def get_ai_usage(self):
+        """按AI提供商汇总评分和用量"""
+        with self._connect() as conn:
+            return [dict(row) for row in conn.execute("""
+                SELECT provider,
+                       COUNT(*) AS count,
+                       SUM(CASE WHEN average_score > 0 THEN 1 ELSE 0 END) AS success,
+                       SUM(average_score) AS total_score,
+                       SUM(total_tokens) AS total_tokens,
+                       SUM(total_cost) AS total_cost
+                FROM ai_usage GROUP BY provider
+            """)]
+
+    def get_summary(self):
+        """汇总统计（报告数、平均分、最高/最低分、版本数，评分为0的不计入）"""
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT COUNT(*) AS total_reports,
+                       AVG(NULLIF(static_score, 0)) AS avg_static_score,
+                       AVG(NULLIF(ai_score, 0)) AS avg_ai_score,
+                       MAX(NULLIF(static_score, 0)) AS max_static_score,
+                       MAX(NULLIF(ai_score, 0)) AS max_ai_score,
+                       MIN(NULLIF(static_score, 0)) AS min_static_score,
+                       MIN(NULLIF(ai_score, 0)) AS min_ai_score,
+                       COUNT(DISTINCT version) AS total_versions,
+                       MAX(check_time) AS latest_check
+                FROM reports
+            """).fetchone()
+        return dict(row)
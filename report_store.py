@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BTAUTOCHECK 检测报告存储
+Security Report Storage with Compact Summary and Separate Findings
+"""
+
+import gzip
+import json
+import os
+
+# 检测明细可选压缩格式
+COMPRESSION_SUFFIXES = {
+    'none': '.json',
+    'gzip': '.json.gz',
+    'zstd': '.json.zst',
+}
+
+# 摘要中不保留的大字段
+SUMMARY_EXCLUDED_FIELDS = {
+    'static_analysis': ('findings', 'files_to_remove'),
+    'ai_analysis': ('findings',),
+    'basic_check': ('suspicious_files',),
+}
+
+
+def report_path(download_dir, version):
+    """报告摘要路径（报告列表、统计和告警都读取该文件）"""
+    return os.path.join(download_dir, f'security_report_{version}.json')
+
+
+def findings_path(download_dir, version, compression='none'):
+    """检测明细文件路径"""
+    return os.path.join(download_dir, f'report_findings_{version}{COMPRESSION_SUFFIXES[compression]}')
+
+
+def build_summary(report):
+    """从完整报告构建摘要（结构与完整报告一致，只去掉大字段）"""
+    summary = {}
+    for key, value in report.items():
+        excluded = SUMMARY_EXCLUDED_FIELDS.get(key)
+        if excluded and isinstance(value, dict):
+            value = {k: v for k, v in value.items() if k not in excluded}
+        summary[key] = value
+    return summary
+
+
+def build_detail(report):
+    """从完整报告取出摘要中去掉的大字段 {段: {字段: 值}}"""
+    detail = {}
+    for key, fields in SUMMARY_EXCLUDED_FIELDS.items():
+        value = report.get(key)
+        if isinstance(value, dict):
+            detail[key] = {field: value[field] for field in fields if field in value}
+    return detail
+
+
+def _write_atomic(path, data):
+    """写入临时文件后改名替换，读者不会读到写了一半的文件"""
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, path)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def _write_findings(path, detail):
+    """按扩展名压缩并写入检测明细"""
+    data = json.dumps(detail, ensure_ascii=False).encode('utf-8')
+    if path.endswith('.gz'):
+        data = gzip.compress(data)
+    elif path.endswith('.zst'):
+        import zstandard
+        data = zstandard.ZstdCompressor().compress(data)
+    _write_atomic(path, data)
+
+
+def _read_findings(path):
+    """按扩展名读取检测明细"""
+    with open(path, 'rb') as f:
+        if path.endswith('.gz'):
+            with gzip.GzipFile(fileobj=f) as reader:
+                data = reader.read()
+        elif path.endswith('.zst'):
+            import zstandard
+            with zstandard.ZstdDecompressor().stream_reader(f) as reader:
+                data = reader.read()
+        else:
+            data = f.read()
+    return json.loads(data.decode('utf-8'))
+
+
+def save_report(download_dir, report, compression='gzip'):
+    """
+    保存检测报告：报告摘要和检测明细两个文件
+
+    Args:
+        download_dir: 报告目录
+        report: 完整检测结果
+        compression: 检测明细压缩方式 none/gzip/zstd
+
+    Returns:
+        报告摘要文件路径
+    """
+    if compression not in COMPRESSION_SUFFIXES:
+        compression = 'none'
+    if compression == 'zstd':
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            print("⚠️  未安装zstandard，检测明细改用gzip压缩 (pip install zstandard)")
+            compression = 'gzip'
+
+    version = report['version']
+    detail_file = findings_path(download_dir, version, compression)
+
+    # 检测明细先写入，摘要中引用的明细文件总是完整的
+    _write_findings(detail_file, build_detail(report))
+
+    # 清理其它压缩格式的旧明细，避免读到过期数据
+    for other in COMPRESSION_SUFFIXES:
+        other_file = findings_path(download_dir, version, other)
+        if other_file != detail_file and os.path.exists(other_file):
+            os.remove(other_file)
+
+    summary = build_summary(report)
+    summary['findings_file'] = os.path.basename(detail_file)
+
+    result_file = report_path(download_dir, version)
+    _write_atomic(result_file, json.dumps(summary, indent=2, ensure_ascii=False).encode('utf-8'))
+    return result_file
+
+
+def load_summary(result_file):
+    """
+    加载报告摘要
+
+    旧版本生成的报告仍内嵌全部检测明细，读取后去掉大字段。
+    """
+    with open(result_file, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    if 'findings_file' in report:
+        return report
+    return build_summary(report)
+
+
+def load_report(result_file):
+    """
+    加载完整报告（合并单独存放的检测明细）
+
+    明细文件与 build_detail 的结构一致：{报告字段: {被摘要去掉的大字段: 值}}。
+    """
+    with open(result_file, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+
+    findings_file = report.get('findings_file')
+    if findings_file:
+        detail = _read_findings(os.path.join(os.path.dirname(result_file), findings_file))
+        for key, values in detail.items():
+            report.setdefault(key, {}).update(values)
+
+    return report
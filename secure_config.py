@@ -9,20 +9,70 @@ import os
 import sys
 import json
 import base64
+import copy
 import hashlib
-from cryptography.fernet import Fernet
+import threading
 from getpass import getpass
+from config_store import update_config, write_config, get_revision
+
+# 需要加密的字段
+SENSITIVE_FIELDS = [
+    ('gemini_api_key',),
+    ('github_token',),
+    ('notifications', 'email', 'smtp_password'),
+    ('notifications', 'serverchan', 'sendkey'),
+    ('notifications', 'bark', 'device_key'),
+    ('notifications', 'telegram', 'bot_token'),
+]
+
+
+def _file_signature(path):
+    """文件标识（inode、修改时间、大小），任一变化即视为文件已更新"""
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
 
 class SecureConfig:
-    """安全配置管理器"""
+    """
+    安全配置管理器
+    
+    解密后的配置和加密器在进程内共享缓存：配置按文件 inode/mtime/size 判断是否变化，
+    未变化时不再读取文件和解密；配置变化时通知已订阅的回调（如调度器）。
+    """
+    
+    # 进程级缓存: 配置文件绝对路径 -> (文件标识, 解密后的配置)
+    _config_cache = {}
+    # 进程级加密器: 密钥文件绝对路径 -> (文件标识, Fernet)
+    _cipher_cache = {}
+    _cache_lock = threading.RLock()
+    _subscribers = []
     
     def __init__(self, config_file='config.json', key_file='.config.key'):
         self.config_file = config_file
         self.key_file = key_file
         self.cipher = None
+    
+    @classmethod
+    def subscribe(cls, callback):
+        """
+        订阅配置变化
+        
+        Args:
+            callback: callback(old_config, new_config)，在检测到配置文件变化并重新加载后调用
+        """
+        with cls._cache_lock:
+            if callback not in cls._subscribers:
+                cls._subscribers.append(callback)
+    
+    @classmethod
+    def unsubscribe(cls, callback):
+        with cls._cache_lock:
+            if callback in cls._subscribers:
+                cls._subscribers.remove(callback)
         
     def _get_or_create_key(self):
         """获取或创建加密密钥"""
+        from cryptography.fernet import Fernet
         if os.path.exists(self.key_file):
             with open(self.key_file, 'rb') as f:
                 return f.read()
@@ -34,10 +84,25 @@ class SecureConfig:
             return key
     
     def _init_cipher(self):
-        """初始化加密器"""
-        if not self.cipher:
-            key = self._get_or_create_key()
-            self.cipher = Fernet(key)
+        """
+        初始化加密器（同一密钥文件在进程内只读取一次）
+        
+        只在加解密时导入 cryptography：不含密文的配置可在未安装时读取。
+        """
+        if self.cipher:
+            return
+        
+        from cryptography.fernet import Fernet
+        
+        key_path = os.path.abspath(self.key_file)
+        with self._cache_lock:
+            cached = self._cipher_cache.get(key_path)
+            if cached and os.path.exists(key_path) and cached[0] == _file_signature(key_path):
+                self.cipher = cached[1]
+                return
+            
+            self.cipher = Fernet(self._get_or_create_key())
+            self._cipher_cache[key_path] = (_file_signature(key_path), self.cipher)
     
     def encrypt_value(self, value):
         """
@@ -88,19 +153,9 @@ class SecureConfig:
         with open(self.config_file, 'r', encoding='utf-8') as f:
             config = json.load(f)
         
-        # 需要加密的字段
-        sensitive_fields = [
-            ('gemini_api_key',),
-            ('github_token',),
-            ('notifications', 'email', 'smtp_password'),
-            ('notifications', 'serverchan', 'sendkey'),
-            ('notifications', 'bark', 'device_key'),
-            ('notifications', 'telegram', 'bot_token'),
-        ]
-        
         # 加密敏感字段
         changed = False
-        for field_path in sensitive_fields:
+        for field_path in SENSITIVE_FIELDS:
             obj = config
             for key in field_path[:-1]:
                 if key in obj:
@@ -118,9 +173,8 @@ class SecureConfig:
                         print(f"✅ 已加密: {' -> '.join(field_path)}")
         
         if changed:
-            # 保存加密后的配置
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4, ensure_ascii=False)
+            # 保存加密后的配置（修订号不变时才写入）
+            write_config(config, self.config_file, expected_revision=get_revision(config))
             
             print(f"\n✅ 配置已加密并保存到: {self.config_file}")
             print(f"🔑 密钥文件: {self.key_file} (请妥善保管)")
@@ -161,23 +215,117 @@ class SecureConfig:
         decrypt_recursive(config)
         
         # 保存解密后的配置
-        with open(self.config_file, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=4, ensure_ascii=False)
+        write_config(config, self.config_file, expected_revision=get_revision(config))
         
         print(f"✅ 配置已解密并保存到: {self.config_file}")
         print(f"⚠️  请注意：配置文件现在包含明文密钥，请谨慎处理")
         return True
     
-    def load_config(self):
+    def get_config(self):
         """
-        加载配置（自动解密）
+        获取解密后的配置（进程内共享缓存，调用方不得修改返回的字典）
+        
+        配置文件未变化时只需一次 stat，不读取文件也不解密。
         
         Returns:
             配置字典
         """
-        if not os.path.exists(self.config_file):
+        config_path = os.path.abspath(self.config_file)
+        try:
+            signature = _file_signature(config_path)
+        except FileNotFoundError:
             return {}
         
+        cached = self._config_cache.get(config_path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        
+        with self._cache_lock:
+            cached = self._config_cache.get(config_path)
+            if cached and cached[0] == signature:
+                return cached[1]
+            
+            # 读取前后文件标识一致，才写入缓存（避免缓存写入过程中的内容）
+            config = self._read_decrypted()
+            if _file_signature(config_path) == signature:
+                self._config_cache[config_path] = (signature, config)
+            subscribers = list(self._subscribers) if cached else []
+        
+        old_config = cached[1] if cached else None
+        for callback in subscribers:
+            try:
+                callback(old_config, config)
+            except Exception as e:
+                print(f"⚠️  配置变更通知失败: {e}")
+        
+        return config
+    
+    def load_config(self):
+        """
+        加载配置用于修改后保存（自动解密）
+        
+        只读访问请使用 get_config()，不复制配置；只有要修改并 save_config() 的调用方
+        才需要这份独立副本。
+        
+        Returns:
+            配置字典（缓存的副本，可自由修改）
+        """
+        return copy.deepcopy(self.get_config())
+    
+    def revision(self):
+        """当前配置修订号（读取缓存，配置未变化时不解析文件）"""
+        return get_revision(self.get_config())
+    
+    def save_config(self, config, check_revision=True):
+        """
+        保存配置（原子写入，修订号递增，随后刷新共享缓存并通知订阅者）
+        
+        config 通常来自 load_config()，其中的敏感字段是明文：原文件中已加密的字段
+        和 SENSITIVE_FIELDS 中的字段会重新加密后再写入，不会因保存而变成明文。
+        
+        Args:
+            config: 配置字典
+            check_revision: 为True时，若配置在 load_config() 之后已被修改则拒绝写入
+        
+        Returns:
+            新的修订号
+        
+        Raises:
+            ConfigConflictError: 配置已被其它写入者修改
+        """
+        expected = get_revision(config) if check_revision else None
+        
+        def reencrypt(current):
+            return self._encrypt_like(config, current)
+        
+        saved = update_config(reencrypt, self.config_file, expected_revision=expected)
+        # 立即刷新共享缓存，订阅者（如调度器）在保存返回前收到变化通知
+        self.get_config()
+        return get_revision(saved)
+    
+    def _encrypt_like(self, config, raw):
+        """按原文件的加密状态和敏感字段列表加密配置中的明文值"""
+        def walk(obj, raw_obj, path):
+            if isinstance(obj, dict):
+                raw_obj = raw_obj if isinstance(raw_obj, dict) else {}
+                return {key: walk(value, raw_obj.get(key), path + (key,)) for key, value in obj.items()}
+            if isinstance(obj, list):
+                raw_obj = raw_obj if isinstance(raw_obj, list) else []
+                return [walk(item, raw_obj[i] if i < len(raw_obj) else None, path)
+                        for i, item in enumerate(obj)]
+            if isinstance(obj, str) and obj:
+                was_encrypted = isinstance(raw_obj, str) and raw_obj.startswith('ENC[')
+                if was_encrypted and self.decrypt_value(raw_obj) == obj:
+                    # 值未修改，保留原密文
+                    return raw_obj
+                if was_encrypted or path in SENSITIVE_FIELDS:
+                    return self.encrypt_value(obj)
+            return obj
+        
+        return walk(config, raw, ())
+    
+    def _read_decrypted(self):
+        """读取配置文件并解密所有 ENC[...] 值"""
         with open(self.config_file, 'r', encoding='utf-8') as f:
             config = json.load(f)
         
@@ -204,7 +352,7 @@ class SecureConfig:
     
     def set_env_from_config(self):
         """从配置设置环境变量"""
-        config = self.load_config()
+        config = self.get_config()
         
         # 设置常用的环境变量
         env_map = {
@@ -238,7 +386,7 @@ def main():
         print("="*60)
         print("🔍 加载并解密配置")
         print("="*60)
-        config = manager.load_config()
+        config = manager.get_config()
         print("\n📋 配置内容 (敏感信息已解密):")
         print(json.dumps(config, indent=2, ensure_ascii=False))
 
@@ -0,0 +1,179 @@
+import json
+
+import pytest
+
+pytest.importorskip('requests')
+
+from ai_analyzer import AIAnalyzer
+
+
+def write_config(tmp_path, ai_config):
+    (tmp_path / 'config.json').write_text(json.dumps({'ai_providers': ai_config}), encoding='utf-8')
+
+
+def make_analyzer(tmp_path, ai_config=None):
+    write_config(tmp_path, ai_config or {})
+    analyzer = AIAnalyzer(str(tmp_path / 'config.json'))
+    analyzer.budget.usage_file = str(tmp_path / 'ai_usage.json')
+    return analyzer
+
+
+VALID = {'security_score': 85, 'risk_level': 'low', 'findings': [], 'recommendation': 'ok', 'safe_to_use': True}
+
+
+def test_parses_fenced_block_with_trailing_text(tmp_path):
+    analyzer = make_analyzer(tmp_path)
+    text = "分析如下：\n```json\n" + json.dumps(VALID) + "\n```\n以上。"
+
+    result = analyzer._parse_ai_response(text, 'openai')
+
+    assert result['security_score'] == 85
+    assert result['safe_to_use'] is True
+
+
+@pytest.mark.parametrize('missing', ['risk_level', 'safe_to_use', 'findings'])
+def test_missing_required_field_is_not_fabricated(tmp_path, missing):
+    analyzer = make_analyzer(tmp_path)
+    obj = {k: v for k, v in VALID.items() if k != missing}
+
+    assert analyzer._parse_ai_response(json.dumps(obj), 'openai') is None
+
+
+def test_missing_field_goes_through_repair_re_ask(tmp_path):
+    analyzer = make_analyzer(tmp_path)
+    calls = []
+
+    def fake_call(provider, prompt, config):
+        calls.append(config)
+        return dict(VALID)
+
+    analyzer._call_ai_provider = fake_call
+    obj = {k: v for k, v in VALID.items() if k != 'safe_to_use'}
+
+    result = analyzer._parse_ai_response(json.dumps(obj), 'openai', {'enabled': True})
+
+    assert result['repaired'] is True
+    assert len(calls) == 1 and calls[0]['_repair_attempt']
+
+
+class FakeStream:
+    status_code = 200
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_lines(self, decode_unicode=True):
+        for chunk in self.chunks:
+            self.read += 1
+            yield 'data: ' + json.dumps({'choices': [{'delta': {'content': chunk}}]})
+        yield 'data: [DONE]'
+
+
+def test_triage_abort_returns_score_without_verdict(tmp_path, monkeypatch):
+    import ai_analyzer
+
+    analyzer = make_analyzer(tmp_path)
+    stream = FakeStream(['{"security_score": 9', '2, "risk_level": "low",', ' "findings": [', ']}'])
+    monkeypatch.setattr(ai_analyzer.requests, 'post', lambda *a, **k: stream)
+
+    result = analyzer._call_streaming('openai', 'prompt', 'http://x', {}, {}, {'_triage': True})
+
+    assert stream.read == 2
+    assert result['security_score'] == 92
+    assert result['risk_level'] == 'low'
+    assert result['triage_only'] and result['stream_aborted']
+    assert 'safe_to_use' not in result and 'findings' not in result
+    assert analyzer.budget.summary()['providers']['openai']['calls'] == 1
+
+
+def test_plan_files_keeps_max_files_per_run_with_budget(tmp_path):
+    analyzer = make_analyzer(tmp_path, {
+        'primary_provider': 'openai',
+        'max_files_per_run': 2,
+        'openai': {'enabled': True, 'budget': {'max_tokens_per_run': 10 ** 9}}
+    })
+    candidates = [(f'file{i}.py', 'print(1)\n' * 50) for i in range(5)]
+
+    selected, skipped = analyzer.plan_files(candidates)
+
+    assert [path for path, _ in selected] == ['file0.py', 'file1.py']
+    assert skipped == 0
+
+
+def test_config_changes_apply_without_recreating_analyzer(tmp_path, monkeypatch):
+    monkeypatch.delenv('BTAUTOCHECK_AI_BASE_URL', raising=False)
+    analyzer = make_analyzer(tmp_path, {'primary_provider': 'openai'})
+    assert analyzer.primary_provider == 'openai'
+    assert analyzer.api_base_override == ''
+
+    write_config(tmp_path, {
+        'primary_provider': 'kimi',
+        'api_base_override': 'http://127.0.0.1:8765',
+        'expected_output_tokens': 100,
+        'kimi': {'enabled': True, 'budget': {'max_tokens_per_run': 150}}
+    })
+
+    assert analyzer.primary_provider == 'kimi'
+    assert analyzer.api_base_override == 'http://127.0.0.1:8765'
+    assert analyzer.budget.can_afford('kimi', 50)
+    assert not analyzer.budget.can_afford('kimi', 51)
+
+
+def test_result_returned_after_cancel_is_billed_once_and_not_parsed(tmp_path, monkeypatch):
+    import threading
+
+    import ai_analyzer
+
+    analyzer = make_analyzer(tmp_path, {'openai': {'enabled': True, 'budget': {'max_tokens_per_run': 10 ** 6}}})
+    cancel = threading.Event()
+
+    class Response:
+        status_code = 200
+
+        def json(self):
+            return {'choices': [{'message': {'content': json.dumps(VALID)}}],
+                    'usage': {'prompt_tokens': 100, 'completion_tokens': 20}}
+
+    def slow_post(*args, **kwargs):
+        # 调用方在请求进行中放弃了这个提供商
+        cancel.set()
+        return Response()
+
+    monkeypatch.setattr(ai_analyzer.requests, 'post', slow_post)
+    analyzer._parse_ai_response = lambda *args, **kwargs: pytest.fail('cancelled result was parsed')
+
+    assert analyzer._call_ai_provider('openai', 'prompt', {'enabled': True, '_cancel': cancel}) is None
+
+    usage = analyzer.budget.summary()['providers']['openai']
+    assert (usage['calls'], usage['input_tokens']) == (1, 100)
+    assert analyzer.budget.reserved['openai']['tokens'] == 0
+
+
+@pytest.mark.parametrize('triage_result, expected_calls', [
+    ({'security_score': 75, 'risk_level': 'low'}, 1),
+    ({'security_score': 60, 'risk_level': 'low'}, 2),
+    ({'security_score': 95, 'risk_level': 'medium'}, 2),
+])
+def test_triage_escalates_only_below_escalation_score(tmp_path, triage_result, expected_calls):
+    # security_threshold 是静态检测阈值，不影响分诊升级
+    analyzer = make_analyzer(tmp_path, {'triage_escalation_score': 70})
+    calls = []
+
+    def fake_analyze(code_sample, file_info='', triage=False):
+        calls.append(triage)
+        return dict(triage_result, triage_only=True) if triage else dict(VALID)
+
+    analyzer.analyze_code = fake_analyze
+
+    result, triage_only = analyzer.analyze_with_triage('code', 'ajax.py')
+
+    assert len(calls) == expected_calls
+    assert triage_only is (expected_calls == 1)
+    assert result.get('triage_only', False) is triage_only
@@ -0,0 +1,89 @@
+import json
+import multiprocessing
+
+from ai_budget import AIBudgetGovernor, estimate_tokens
+
+AI_CONFIG = {
+    'openai': {
+        'enabled': True,
+        'pricing': {'input_per_1k': 1.0, 'output_per_1k': 2.0},
+        'budget': {'max_tokens_per_day': 10000}
+    }
+}
+
+
+def record_calls(usage_file, count):
+    governor = AIBudgetGovernor(AI_CONFIG, usage_file=usage_file)
+    for _ in range(count):
+        governor.record('openai', {'input_tokens': 100, 'output_tokens': 10})
+
+
+def test_estimate_tokens_counts_cjk_per_character():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('安全检测') == 4
+    assert estimate_tokens('abcdefgh') == 2
+
+
+def test_record_tracks_run_usage_and_cost(tmp_path):
+    governor = AIBudgetGovernor(AI_CONFIG, usage_file=str(tmp_path / 'ai_usage.json'))
+    governor.record('openai', {'input_tokens': 1000, 'output_tokens': 500, 'estimated': True})
+
+    summary = governor.summary()
+    assert summary['total_tokens'] == 1500
+    assert summary['total_cost'] == 2.0
+    assert summary['providers']['openai']['estimated_calls'] == 1
+
+
+def test_daily_usage_is_merged_across_processes(tmp_path):
+    usage_file = str(tmp_path / 'ai_usage.json')
+    workers = [multiprocessing.Process(target=record_calls, args=(usage_file, 20)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    with open(usage_file, 'r', encoding='utf-8') as f:
+        history = json.load(f)
+    (day,) = history.values()
+    assert day['openai']['calls'] == 80
+    assert day['openai']['input_tokens'] == 8000
+
+
+def test_daily_cap_sees_other_governors(tmp_path):
+    usage_file = str(tmp_path / 'ai_usage.json')
+    first = AIBudgetGovernor(AI_CONFIG, usage_file=usage_file)
+    second = AIBudgetGovernor(AI_CONFIG, usage_file=usage_file)
+
+    first.record('openai', {'input_tokens': 9000, 'output_tokens': 500})
+
+    assert second.remaining('openai')['tokens'] == 500
+    assert not second.can_afford('openai', 100, output_tokens=800)
+
+
+def test_plan_respects_max_items_and_budget(tmp_path):
+    governor = AIBudgetGovernor(dict(AI_CONFIG, expected_output_tokens=0),
+                                usage_file=str(tmp_path / 'ai_usage.json'))
+    candidates = [('a', 6000), ('b', 5000), ('c', 3000), ('d', 500), ('e', 100)]
+
+    selected, skipped = governor.plan('openai', candidates, max_items=2)
+
+    assert selected == ['a', 'c']
+    assert skipped == 1
+
+
+def test_reservations_keep_concurrent_calls_within_budget(tmp_path):
+    governor = AIBudgetGovernor({'openai': {'budget': {'max_tokens_per_run': 2000}}, 'expected_output_tokens': 200},
+                                usage_file=str(tmp_path / 'ai_usage.json'))
+
+    first = governor.reserve('openai', 600)
+    second = governor.reserve('openai', 600)
+    # 前两次调用尚未返回，第三次预留会超出预算
+    assert first and second
+    assert governor.reserve('openai', 600) is None
+
+    governor.record('openai', {'input_tokens': 600, 'output_tokens': 50}, first)
+    governor.release(second)
+    governor.release(second)
+
+    assert governor.remaining('openai')['tokens'] == 1350
+    assert governor.reserve('openai', 600)
@@ -0,0 +1,136 @@
+import time
+
+import pytest
+
+pytest.importorskip('requests')
+
+from ai_consensus import AIConsensusAnalyzer
+
+
+class FakeAnalyzer:
+    """按提供商返回预设结果的AI分析器"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.configs = {}
+
+    def _build_security_prompt(self, code_sample, file_info):
+        return code_sample
+
+    def _call_ai_provider(self, provider, prompt, config):
+        self.configs[provider] = config
+        delay, result = self.responses[provider]
+        end = time.monotonic() + delay
+        while time.monotonic() < end:
+            if config['_cancel'].is_set():
+                return None
+            time.sleep(0.01)
+        return dict(result) if result else None
+
+
+def make_consensus(responses):
+    consensus = AIConsensusAnalyzer.__new__(AIConsensusAnalyzer)
+    consensus.analyzer = FakeAnalyzer(responses)
+    ai_config = {'enabled': True}
+    for provider in responses:
+        ai_config[provider] = {'enabled': True}
+    consensus.analyzer.config = {'ai_providers': ai_config}
+    return consensus
+
+
+def result(score, findings=None):
+    return {'security_score': score, 'risk_level': 'low', 'findings': findings or []}
+
+
+def test_quorum_stops_early_and_records_abandoned_calls():
+    consensus = make_consensus({
+        'a': (0, result(90)),
+        'b': (0.05, result(88)),
+        'c': (5, result(40)),
+    })
+
+    started = time.monotonic()
+    outcome = consensus.analyze_with_consensus('code', min_ais=2, max_ais=3, call_timeout=10)
+
+    assert time.monotonic() - started < 2
+    assert outcome['consensus_available']
+    assert outcome['early_stopped']
+    assert outcome['abandoned_ais'] == [{'provider': 'c', 'reason': '已达成共识'}]
+    assert 'skipped_ais' not in outcome
+    # 放弃等待后通知进行中的调用停止
+    assert consensus.analyzer.configs['c']['_cancel'].is_set()
+
+
+def test_per_call_timeout_is_passed_to_provider_and_enforced():
+    consensus = make_consensus({
+        'a': (0, result(90)),
+        'b': (0, result(60)),
+        'c': (5, result(88)),
+    })
+
+    started = time.monotonic()
+    outcome = consensus.analyze_with_consensus('code', min_ais=2, max_ais=3,
+                                               score_tolerance=5, call_timeout=0.3)
+
+    assert time.monotonic() - started < 2
+    assert consensus.analyzer.configs['a']['_timeout'] == 0.3
+    assert not outcome['early_stopped']
+    assert outcome['abandoned_ais'] == [{'provider': 'c', 'reason': '调用超时'}]
+    assert outcome['total_ais'] == 2
+
+
+def cluster(results):
+    return AIConsensusAnalyzer.__new__(AIConsensusAnalyzer)._cluster_findings(results)
+
+
+def test_similar_findings_from_different_providers_are_merged():
+    clusters = cluster([
+        {'provider': 'a', 'findings': [
+            {'type': '后门', 'severity': 'high', 'line': 12,
+             'description': 'eval executes user supplied input from request'}]},
+        {'provider': 'b', 'findings': [
+            {'type': '后门', 'severity': 'high', 'line': 14,
+             'description': 'eval() executes user supplied input from the request'}]},
+    ])
+
+    assert len(clusters) == 1
+    assert clusters[0]['providers'] == ['a', 'b']
+
+
+def test_same_type_and_severity_without_similar_description_are_not_merged():
+    clusters = cluster([
+        {'provider': 'a', 'findings': [
+            {'type': '后门', 'severity': 'high', 'description': 'eval executes user input'}]},
+        {'provider': 'b', 'findings': [
+            {'type': '后门', 'severity': 'high', 'description': 'uploads panel password to remote host'}]},
+    ])
+
+    assert len(clusters) == 2
+    assert all(c['agreement_count'] == 1 for c in clusters)
+
+
+def test_findings_from_one_provider_are_never_merged():
+    clusters = cluster([
+        {'provider': 'a', 'findings': [
+            {'type': '漏洞', 'severity': 'medium', 'description': 'SQL injection in user login query'},
+            {'type': '漏洞', 'severity': 'medium', 'description': 'SQL injection in user search query'}]},
+        {'provider': 'b', 'findings': [
+            {'type': '漏洞', 'severity': 'medium', 'description': 'SQL injection in the user login query'}]},
+    ])
+
+    assert len(clusters) == 2
+    assert sorted(c['agreement_count'] for c in clusters) == [1, 2]
+
+
+def test_many_near_duplicates_in_one_file_are_all_compared():
+    # 两个AI都报告了同一文件中的9处eval，描述相同，所有候选落在同样的桶里；
+    # 前8处已经各自配对，最后一处只能和桶里排在第8位之后的候选匹配
+    def findings():
+        return [{'type': '后门', 'severity': 'high', 'file': 'class/common.py', 'line': 10 + i,
+                 'description': 'eval executes user supplied input'} for i in range(9)]
+
+    clusters = cluster([{'provider': 'a', 'findings': findings()},
+                        {'provider': 'b', 'findings': findings()}])
+
+    assert len(clusters) == 9
+    assert all(c['providers'] == ['a', 'b'] for c in clusters)
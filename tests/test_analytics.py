@@ -0,0 +1,74 @@
+import os
+import threading
+
+from analytics import ReportSummaryCache
+from report_index import ReportIndex
+from report_store import save_report
+
+
+def write_report(directory, version, score, provider=None):
+    report = {
+        'version': version,
+        'check_time': f'2026-10-01 12:00:{int(version.rsplit(".", 1)[1]) % 60:02d}',
+        'static_analysis': {'security_score': score, 'category_stats': {}},
+        'ai_analysis': {'provider': provider, 'average_score': score, 'analyzed_files': 1,
+                        'usage': {'total_tokens': 100, 'total_cost': 0.1}} if provider else None,
+    }
+    return save_report(directory, report, 'none')
+
+
+def test_incremental_aggregates(tmp_path):
+    directory = str(tmp_path)
+    cache = ReportSummaryCache(directory, ReportIndex(directory))
+    write_report(directory, '11.0.1', 70, 'openai')
+    second = write_report(directory, '11.0.2', 90, 'openai')
+
+    cache.refresh()
+    totals = cache.totals()
+    assert totals['total_reports'] == 2
+    assert totals['static_sum'] == 160
+    assert (totals['lowest_score'], totals['highest_score']) == (70, 90)
+    assert cache.provider_stats()['openai']['count'] == 2
+    assert cache.latest()['version'] == '11.0.2'
+
+    os.remove(second)
+    cache.refresh()
+    assert cache.totals()['total_reports'] == 1
+    assert cache.totals()['highest_score'] == 70
+    assert [r['version'] for r in cache.reports()] == ['11.0.1']
+
+
+def test_reads_during_concurrent_refresh(tmp_path):
+    directory = str(tmp_path)
+    cache = ReportSummaryCache(directory, ReportIndex(directory))
+    errors = []
+    done = threading.Event()
+
+    def writer():
+        try:
+            for i in range(40):
+                write_report(directory, f'11.1.{i}', 50 + i, f'provider{i % 7}')
+                cache.refresh()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            done.set()
+
+    def reader():
+        try:
+            while not done.is_set():
+                totals = cache.totals()
+                stats = cache.provider_stats()
+                assert sum(s['count'] for s in stats.values()) <= 40
+                assert len(cache.reports()) <= totals['total_reports'] + 40
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert cache.totals()['total_reports'] == 40
@@ -0,0 +1,336 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+import pytest
+
+import backup_manager
+from backup_manager import BackupManager, CHUNK_GC_GRACE_SECONDS
+
+# fake_reflink 替换了 subprocess.Popen，测试中需要真实进程时使用
+REAL_POPEN = subprocess.Popen
+
+
+@pytest.fixture
+def panel(tmp_path):
+    root = tmp_path / 'panel'
+    (root / 'class').mkdir(parents=True)
+    (root / 'class' / 'common.py').write_text('print("panel")\n')
+    (root / 'BTPanel.py').write_text('version = "11.0.0"\n')
+    os.symlink('class/common.py', root / 'common_link.py')
+    return root
+
+
+@pytest.fixture(autouse=True)
+def no_restart(monkeypatch):
+    monkeypatch.setattr(os, 'system', lambda command: 0)
+
+
+def make_manager(tmp_path, panel, **options):
+    return BackupManager(str(panel), str(tmp_path / 'backups'), options=options)
+
+
+def read_tree(root):
+    tree = {}
+    for dirpath, dirs, files in os.walk(root):
+        for name in dirs + files:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root)
+            if os.path.islink(path):
+                tree[rel] = ('link', os.readlink(path))
+            elif os.path.isfile(path):
+                with open(path) as f:
+                    tree[rel] = ('file', f.read())
+            else:
+                tree[rel] = ('dir', None)
+    return tree
+
+
+def chunk_files(manager):
+    return sorted(os.path.join(dirpath, name)
+                  for dirpath, _, files in os.walk(manager.chunk_path) for name in files)
+
+
+def test_dedup_backup_restores_tree(tmp_path, panel):
+    manager = make_manager(tmp_path, panel, type='dedup')
+    expected = read_tree(panel)
+    manifest = manager.create_backup('11.0.0')
+    assert manifest
+
+    (panel / 'BTPanel.py').write_text('version = "11.1.0"\n')
+    (panel / 'new.py').write_text('new\n')
+
+    assert manager.restore_backup(manifest)
+    assert read_tree(panel) == expected
+
+
+def test_dedup_restore_checks_chunk_hashes_before_swapping(tmp_path, panel):
+    manager = make_manager(tmp_path, panel, type='dedup')
+    manifest = manager.create_backup('11.0.0')
+    chunk = chunk_files(manager)[0]
+    with open(chunk, 'wb') as f:
+        f.write(zlib.compress(b'tampered'))
+    (panel / 'BTPanel.py').write_text('current\n')
+
+    # 恢复前只检查数据块存在，损坏在重建时发现，面板目录不被替换
+    assert manager.verify_backup(manifest, sample=False) is False
+    assert manager.restore_backup(manifest) is False
+    assert (panel / 'BTPanel.py').read_text() == 'current\n'
+
+
+def test_gc_skips_tmp_and_recent_chunks(tmp_path, panel):
+    manager = make_manager(tmp_path, panel, type='dedup')
+    manager.create_backup('11.0.0')
+    referenced = chunk_files(manager)
+
+    prefix_dir = os.path.join(manager.chunk_path, 'ff')
+    os.makedirs(prefix_dir, exist_ok=True)
+    old = os.path.join(prefix_dir, 'ff' + '0' * 62)
+    recent = os.path.join(prefix_dir, 'ff' + '1' * 62)
+    tmp = os.path.join(prefix_dir, 'ff' + '2' * 62 + '.123.tmp')
+    for path in (old, recent, tmp):
+        with open(path, 'wb') as f:
+            f.write(b'x')
+    stale = time.time() - CHUNK_GC_GRACE_SECONDS - 60
+    os.utime(old, (stale, stale))
+    os.utime(tmp, (stale, stale))
+
+    manager._collect_garbage_chunks()
+
+    assert not os.path.exists(old)
+    assert os.path.exists(recent) and os.path.exists(tmp)
+    assert all(os.path.exists(path) for path in referenced)
+
+
+def test_gc_waits_for_backup_in_progress(tmp_path, panel):
+    creating = make_manager(tmp_path, panel, type='dedup')
+    collecting = make_manager(tmp_path, panel, type='dedup')
+    done = threading.Event()
+
+    with creating._locked_store():
+        thread = threading.Thread(target=lambda: (collecting._collect_garbage_chunks(), done.set()))
+        thread.start()
+        assert not done.wait(0.3)
+    thread.join(5)
+    assert done.is_set()
+
+
+@pytest.fixture
+def fake_reflink(monkeypatch):
+    """模拟支持 FICLONE 的文件系统：复制数据而不是共享inode"""
+    real_ioctl = backup_manager.fcntl.ioctl
+
+    def ioctl(fd, request, arg=0, *rest):
+        if request != backup_manager.FICLONE:
+            return real_ioctl(fd, request, arg, *rest)
+        os.lseek(arg, 0, os.SEEK_SET)
+        while True:
+            data = os.read(arg, 65536)
+            if not data:
+                return 0
+            os.write(fd, data)
+
+    monkeypatch.setattr(backup_manager.fcntl, 'ioctl', ioctl)
+    monkeypatch.setattr(backup_manager.subprocess, 'Popen', lambda *args, **kwargs: None)
+
+
+def test_snapshot_is_not_changed_by_in_place_writes(tmp_path, panel, fake_reflink):
+    manager = make_manager(tmp_path, panel, type='snapshot')
+    expected = read_tree(panel)
+    snapshot_dir = manager.create_backup('11.0.0')
+    assert manager._backup_type_of(snapshot_dir) == 'snapshot'
+
+    # install.sh 之类的升级脚本原地覆盖写文件
+    with open(panel / 'BTPanel.py', 'r+') as f:
+        f.write('corrupt')
+
+    assert manager.verify_backup(snapshot_dir)
+    assert manager.restore_backup(snapshot_dir)
+    assert read_tree(panel) == expected
+
+
+def test_snapshot_verify_detects_modified_snapshot(tmp_path, panel, fake_reflink):
+    manager = make_manager(tmp_path, panel, type='snapshot')
+    snapshot_dir = manager.create_backup('11.0.0')
+
+    with open(os.path.join(snapshot_dir, 'BTPanel.py'), 'a') as f:
+        f.write('# changed\n')
+    (panel / 'BTPanel.py').write_text('current\n')
+
+    assert manager.verify_backup(snapshot_dir) is False
+    assert manager.restore_backup(snapshot_dir) is False
+    assert (panel / 'BTPanel.py').read_text() == 'current\n'
+
+
+def test_snapshot_without_reflink_falls_back_to_archive(tmp_path, panel, monkeypatch):
+    def unsupported(*args):
+        raise OSError(95, 'Operation not supported')
+
+    monkeypatch.setattr(backup_manager.fcntl, 'ioctl', unsupported)
+    manager = make_manager(tmp_path, panel, type='snapshot', compression='gzip')
+    expected = read_tree(panel)
+
+    backup_filepath = manager.create_backup('11.0.0')
+
+    assert manager._backup_type_of(backup_filepath) == 'archive'
+    assert not [name for name in os.listdir(tmp_path) if '_snapshot_' in name]
+    with open(panel / 'BTPanel.py', 'r+') as f:
+        f.write('corrupt')
+    assert manager.restore_backup(backup_filepath)
+    assert read_tree(panel) == expected
+
+
+def test_archive_verify_full_and_sample(tmp_path, panel):
+    manager = make_manager(tmp_path, panel, compression='gzip')
+    backup_filepath = manager.create_backup('11.0.0')
+
+    assert manager.verify_backup(backup_filepath)
+    assert manager.verify_backup(backup_filepath, sample=True)
+
+
+def test_archive_verify_detects_flipped_byte(tmp_path, panel):
+    manager = make_manager(tmp_path, panel, compression='gzip')
+    backup_filepath = manager.create_backup('11.0.0')
+    with open(backup_filepath, 'r+b') as f:
+        f.seek(os.path.getsize(backup_filepath) // 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+    assert manager.verify_backup(backup_filepath) is False
+    # 抽样校验总会解压最后一个压缩块（小备份只有一个块）
+    assert manager.verify_backup(backup_filepath, sample=True) is False
+
+
+def leftover_dirs(tmp_path, purpose):
+    return [name for name in os.listdir(tmp_path) if f'_{purpose}_' in name]
+
+
+def test_archive_restore_swaps_in_staged_tree(tmp_path, panel):
+    manager = make_manager(tmp_path, panel, compression='gzip')
+    expected = read_tree(panel)
+    backup_filepath = manager.create_backup('11.0.0')
+
+    (panel / 'BTPanel.py').write_text('upgraded\n')
+    (panel / 'class' / 'new.py').write_text('new\n')
+
+    assert manager.restore_backup(backup_filepath)
+    assert read_tree(panel) == expected
+
+
+def test_failed_extraction_leaves_panel_untouched(tmp_path, panel):
+    manager = make_manager(tmp_path, panel, compression='gzip')
+    backup_filepath = manager.create_backup('11.0.0')
+    (panel / 'BTPanel.py').write_text('current\n')
+    current = read_tree(panel)
+    with open(backup_filepath, 'r+b') as f:
+        f.truncate(os.path.getsize(backup_filepath) // 2)
+
+    # 跳过预校验，让失败发生在解压到暂存目录时
+    manager._verify_backup = lambda *args, **kwargs: True
+
+    assert manager.restore_backup(backup_filepath) is False
+    assert read_tree(panel) == current
+    assert not leftover_dirs(tmp_path, 'restore')
+
+
+def test_staged_tree_mismatch_leaves_panel_untouched(tmp_path, panel, monkeypatch):
+    manager = make_manager(tmp_path, panel, compression='gzip')
+    backup_filepath = manager.create_backup('11.0.0')
+    (panel / 'BTPanel.py').write_text('current\n')
+    current = read_tree(panel)
+    monkeypatch.setattr(manager, '_verify_staged_tree', lambda *args: False)
+
+    assert manager.restore_backup(backup_filepath) is False
+    assert read_tree(panel) == current
+    assert not leftover_dirs(tmp_path, 'restore')
+
+
+def test_swap_puts_old_tree_back_when_second_rename_fails(tmp_path, panel, monkeypatch):
+    manager = make_manager(tmp_path, panel)
+    staged = tmp_path / 'staged'
+    staged.mkdir()
+    current = read_tree(panel)
+    real_rename = os.rename
+
+    def rename(src, dst):
+        if src == str(staged):
+            raise OSError('rename failed')
+        return real_rename(src, dst)
+
+    monkeypatch.setattr(os, 'rename', rename)
+
+    with pytest.raises(OSError):
+        manager._swap_into_place(str(staged))
+    monkeypatch.undo()
+
+    assert read_tree(panel) == current
+    assert not leftover_dirs(tmp_path, 'old')
+
+
+def test_load_backup_options_reads_shared_config(tmp_path):
+    config_file = tmp_path / 'config.json'
+    config_file.write_text('{"backup": {"type": "dedup", "verify_mode": "sample"}}', encoding='utf-8')
+
+    options = backup_manager.load_backup_options(str(config_file))
+    options['type'] = 'snapshot'
+
+    assert backup_manager.load_backup_options(str(config_file)) == {'type': 'dedup', 'verify_mode': 'sample'}
+    assert backup_manager.load_backup_options(str(tmp_path / 'missing.json')) == {}
+
+
+def test_cleanup_keeps_configured_number_of_backups(tmp_path, panel):
+    config_file = tmp_path / 'config.json'
+    config_file.write_text('{"keep_backups": 2, "backup": {"compression": "gzip"}}', encoding='utf-8')
+    options = backup_manager.load_backup_options(str(config_file))
+    assert options['keep_backups'] == 2
+
+    manager = make_manager(tmp_path, panel, **options)
+    for version in ('11.0.0', '11.1.0', '11.2.0'):
+        manager.create_backup(version)
+
+    assert [b['version'] for b in sorted(manager.list_backups(), key=lambda b: b['created_at'])] == \
+        ['11.1.0', '11.2.0']
+
+
+def test_restore_stops_running_snapshot_archiver(tmp_path, panel, fake_reflink):
+    manager = make_manager(tmp_path, panel, type='snapshot', compression='gzip')
+    expected = read_tree(panel)
+    snapshot_dir = manager.create_backup('11.0.0')
+    record = next(b for b in manager.list_backups() if b['filepath'] == snapshot_dir)
+
+    # 模拟后台打包进程正在写压缩包
+    archiver = REAL_POPEN([sys.executable, '-c', 'import time; time.sleep(60)',
+                           'archive', '--file', snapshot_dir])
+    assert manager._claim_snapshot_archive(snapshot_dir)
+    manager._update_backup_info(snapshot_dir, {'archive_pid': archiver.pid})
+    with open(record['archive'], 'wb') as f:
+        f.write(b'partial')
+    (panel / 'BTPanel.py').write_text('upgraded\n')
+
+    try:
+        assert manager.restore_backup(snapshot_dir)
+        assert archiver.wait(5) is not None
+    finally:
+        archiver.kill()
+        archiver.wait()
+
+    assert read_tree(panel) == expected
+    assert not os.path.exists(record['archive'])
+    assert not os.path.exists(manager._snapshot_index_file(snapshot_dir))
+    assert all(b['filepath'] != snapshot_dir for b in manager.list_backups())
+
+
+def test_archiver_skips_snapshot_cancelled_before_it_started(tmp_path, panel, fake_reflink):
+    manager = make_manager(tmp_path, panel, type='snapshot', compression='gzip')
+    snapshot_dir = manager.create_backup('11.0.0')
+
+    manager._stop_snapshot_archiver(snapshot_dir)
+
+    assert manager.archive_snapshot(snapshot_dir) is False
+    record = next(b for b in manager.list_backups() if b['filepath'] == snapshot_dir)
+    assert record['archive_status'] == 'cancelled'
+    assert not os.path.exists(record['archive'])
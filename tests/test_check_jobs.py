@@ -0,0 +1,105 @@
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+
+import pytest
+
+from check_jobs import CheckJobQueue, _group_alive
+
+QUICK_COMMAND = [sys.executable, '-c', 'print("步骤: 下载"); print("done")']
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return str(tmp_path / 'check_jobs.json'), str(tmp_path / 'check.lock')
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_run_foreground_records_history(paths):
+    state_file, lock_file = paths
+    queue = CheckJobQueue(state_file, lock_file, command=QUICK_COMMAND)
+
+    assert queue.run_foreground('cron') == 0
+
+    (record,) = queue.history()
+    assert record['status'] == 'succeeded'
+    assert record['trigger'] == 'cron'
+    assert queue.status()['active'] is None
+
+
+def test_worker_runs_queued_job_and_coalesces(paths):
+    state_file, lock_file = paths
+    command = [sys.executable, '-c', 'import time; time.sleep(0.5)']
+    queue = CheckJobQueue(state_file, lock_file, command=command)
+    queue.start_worker()
+
+    record, coalesced = queue.submit('manual')
+    assert not coalesced
+    second, coalesced = queue.submit('scheduler')
+    assert coalesced and second['id'] == record['id']
+
+    assert queue.get(record['id']).wait(timeout=10) == 0
+    assert wait_for(lambda: queue.history() and queue.history()[0]['status'] == 'succeeded')
+    (finished,) = queue.history()
+    assert [c['trigger'] for c in finished['coalesced']] == ['scheduler']
+
+
+def test_status_and_history_do_not_write_state(paths):
+    state_file, lock_file = paths
+    queue = CheckJobQueue(state_file, lock_file, command=QUICK_COMMAND)
+    queue.run_foreground('cron')
+    before = os.stat(state_file).st_mtime_ns
+
+    time.sleep(0.01)
+    queue.status()
+    queue.history()
+
+    assert os.stat(state_file).st_mtime_ns == before
+
+
+def test_run_lock_follows_check_process_after_runner_dies(paths, tmp_path):
+    state_file, lock_file = paths
+    marker = tmp_path / 'started'
+    command = [sys.executable, '-c', f'import time; open({str(marker)!r}, "w").close(); time.sleep(60)']
+    runner = subprocess.Popen([sys.executable, '-c', textwrap.dedent(f'''
+        import sys
+        sys.path.insert(0, {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r})
+        from check_jobs import CheckJobQueue
+        CheckJobQueue({state_file!r}, {lock_file!r}, command={command!r}).run_foreground('cron')
+    ''')], cwd=str(tmp_path))
+
+    queue = CheckJobQueue(state_file, lock_file, command=QUICK_COMMAND)
+    try:
+        assert wait_for(marker.exists)
+        assert wait_for(lambda: (queue.status()['active'] or {}).get('pid'))
+        runner.kill()
+        runner.wait()
+
+        # 运行者退出后检测进程仍在运行：任务仍是 running，运行锁仍被占用
+        active = queue.status()['active']
+        assert active['status'] == 'running'
+        assert queue._acquire_run_lock(blocking=False) is None
+        record, coalesced = queue.submit('manual')
+        assert coalesced and record['id'] == active['id']
+    finally:
+        pid = (queue.status()['active'] or {}).get('pid')
+        if pid and _group_alive(pid):
+            os.killpg(pid, signal.SIGKILL)
+
+    assert wait_for(lambda: not _group_alive(pid))
+    assert queue.status()['active']['status'] == 'interrupted'
+    handle = queue._acquire_run_lock(blocking=False)
+    assert handle is not None
+    handle.close()
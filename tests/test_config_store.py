@@ -0,0 +1,73 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+from config_store import (REVISION_KEY, ConfigConflictError, get_revision, read_config,
+                          set_value, update_config, write_config)
+
+
+def increment(path, times):
+    for _ in range(times):
+        update_config(lambda config: config.__setitem__('counter', config.get('counter', 0) + 1), path)
+
+
+def test_revision_increments_and_preserves_fields(tmp_path):
+    path = str(tmp_path / 'config.json')
+    write_config({'github_token': 'ENC[secret]', 'current_version': '11.0.0'}, path)
+
+    saved = set_value('current_version', '11.1.0', path)
+
+    assert get_revision(saved) == 2
+    assert read_config(path) == {'github_token': 'ENC[secret]', 'current_version': '11.1.0', REVISION_KEY: 2}
+
+
+def test_stale_revision_is_rejected(tmp_path):
+    path = str(tmp_path / 'config.json')
+    write_config({'security_threshold': 80}, path)
+    page_revision = get_revision(read_config(path))
+    set_value('security_threshold', 90, path)
+
+    with pytest.raises(ConfigConflictError) as info:
+        write_config({'security_threshold': 70, REVISION_KEY: page_revision}, path,
+                     expected_revision=page_revision)
+
+    assert (info.value.expected, info.value.actual) == (1, 2)
+    assert read_config(path)['security_threshold'] == 90
+
+
+def test_write_keeps_file_mode_and_leaves_no_tmp(tmp_path):
+    path = str(tmp_path / 'config.json')
+    write_config({'a': 1}, path)
+    os.chmod(path, 0o600)
+
+    write_config({'a': 2}, path)
+
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert sorted(os.listdir(tmp_path)) == ['config.json', 'config.json.lock']
+
+
+def test_failed_write_keeps_previous_config(tmp_path):
+    path = str(tmp_path / 'config.json')
+    write_config({'a': 1}, path)
+
+    with pytest.raises(TypeError):
+        write_config({'a': object()}, path)
+
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f) == {'a': 1, REVISION_KEY: 1}
+
+
+def test_concurrent_updates_from_processes_are_not_lost(tmp_path):
+    path = str(tmp_path / 'config.json')
+    write_config({}, path)
+    workers = [multiprocessing.Process(target=increment, args=(path, 25)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    config = read_config(path)
+    assert config['counter'] == 100
+    assert get_revision(config) == 101
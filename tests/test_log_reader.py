@@ -0,0 +1,52 @@
+from log_reader import read_range, tail_lines
+
+
+def write_lines(path, count, start=0):
+    with open(path, 'a', encoding='utf-8') as f:
+        for i in range(start, start + count):
+            f.write(f'line {i}\n')
+
+
+def test_tail_lines_reads_last_lines(tmp_path):
+    path = tmp_path / 'auto_check.log'
+    write_lines(path, 5000)
+
+    assert tail_lines(str(path), 3) == ['line 4997', 'line 4998', 'line 4999']
+    assert tail_lines(str(path), 0) == []
+
+
+def test_read_range_pages_backwards_on_line_boundaries(tmp_path):
+    path = tmp_path / 'auto_check.log'
+    write_lines(path, 1000)
+
+    last = read_range(str(path), limit=100)
+    assert last['end'] == last['size']
+    assert last['content'].startswith('line ')
+    earlier = read_range(str(path), before=last['start'], limit=100)
+    assert earlier['end'] == last['start']
+    assert earlier['content'].endswith('\n')
+
+
+def test_follow_returns_only_complete_appended_lines(tmp_path):
+    path = tmp_path / 'auto_check.log'
+    write_lines(path, 3)
+    end = read_range(str(path))['end']
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('line 3\npartial')
+    chunk = read_range(str(path), offset=end)
+    assert chunk['content'] == 'line 3\n'
+
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(' done\n')
+    assert read_range(str(path), offset=chunk['end'])['content'] == 'partial done\n'
+
+
+def test_follow_resets_after_truncation(tmp_path):
+    path = tmp_path / 'auto_check.log'
+    write_lines(path, 100)
+    end = read_range(str(path))['end']
+
+    path.write_text('new 0\n', encoding='utf-8')
+    chunk = read_range(str(path), offset=end)
+    assert chunk['reset'] and chunk['content'] == 'new 0\n'
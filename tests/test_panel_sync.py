@@ -0,0 +1,184 @@
+import json
+import os
+
+import pytest
+
+import panel_sync
+from panel_sync import apply_delta, plan_delta, prune_manifests, rollback_delta
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def read_tree(root):
+    tree = {}
+    for dirpath, dirs, files in os.walk(root):
+        for name in dirs + files:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root)
+            if os.path.islink(path):
+                tree[rel] = ('link', os.readlink(path))
+            elif os.path.isfile(path):
+                with open(path) as f:
+                    tree[rel] = ('file', f.read())
+            else:
+                tree[rel] = ('dir', None)
+    return tree
+
+
+@pytest.fixture
+def trees(tmp_path):
+    package, panel = tmp_path / 'package', tmp_path / 'panel'
+    write(package / 'class' / 'common.py', 'new common\n')
+    write(package / 'class' / 'added.py', 'added\n')
+    write(package / 'BTPanel.py', 'same\n')
+    write(panel / 'class' / 'common.py', 'old common\n')
+    write(panel / 'class' / 'obsolete.py', 'obsolete\n')
+    write(panel / 'BTPanel.py', 'same\n')
+    write(panel / 'data' / 'user.db', 'user data\n')
+    return package, panel, tmp_path / 'backups'
+
+
+def test_apply_and_rollback(trees):
+    package, panel, manifest_dir = trees
+    original = read_tree(panel)
+
+    manifest_file, changes = apply_delta(str(package), str(panel), str(manifest_dir), '11.1.0')
+
+    assert sorted((c['action'], c['path']) for c in changes) == [
+        ('add', 'class/added.py'), ('remove', 'class/obsolete.py'), ('update', 'class/common.py')]
+    assert (panel / 'class' / 'common.py').read_text() == 'new common\n'
+    assert (panel / 'data' / 'user.db').exists()
+
+    rollback_delta(manifest_file)
+    assert read_tree(panel) == original
+
+
+def test_failure_mid_apply_rolls_back(trees, monkeypatch):
+    package, panel, manifest_dir = trees
+    original = read_tree(panel)
+    real_replace = panel_sync._replace_file
+    calls = []
+
+    def failing_replace(src, dst):
+        calls.append(dst)
+        if len(calls) == 2:
+            raise OSError('disk full')
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(panel_sync, '_replace_file', failing_replace)
+
+    with pytest.raises(OSError):
+        apply_delta(str(package), str(panel), str(manifest_dir), '11.1.0')
+
+    monkeypatch.undo()
+    assert read_tree(panel) == original
+
+
+def test_file_directory_type_changes(trees):
+    package, panel, manifest_dir = trees
+    # 面板中是目录、升级包中是文件；面板中是文件、升级包中是目录
+    write(panel / 'class' / 'plugin_api' / 'old.py', 'old api\n')
+    write(package / 'class' / 'plugin_api', 'api module\n')
+    write(panel / 'class' / 'tools', 'tools script\n')
+    write(package / 'class' / 'tools' / '__init__.py', 'tools package\n')
+    original = read_tree(panel)
+
+    manifest_file, changes = apply_delta(str(package), str(panel), str(manifest_dir), '11.1.0')
+
+    assert (panel / 'class' / 'plugin_api').read_text() == 'api module\n'
+    assert (panel / 'class' / 'tools' / '__init__.py').read_text() == 'tools package\n'
+    assert not any(c['path'].startswith('class/plugin_api/') for c in changes)
+
+    rollback_delta(manifest_file)
+    assert read_tree(panel) == original
+
+
+def test_plan_detects_type_change(trees):
+    package, panel, _ = trees
+    write(panel / 'class' / 'plugin_api' / 'old.py', 'old api\n')
+    write(package / 'class' / 'plugin_api', 'api module\n')
+
+    changes = plan_delta(str(package), str(panel))
+
+    assert {'action': 'update', 'path': 'class/plugin_api', 'type_change': True} in changes
+
+
+def test_prune_keeps_newest_by_creation_time(trees):
+    package, panel, manifest_dir = trees
+    manifest_dir.mkdir()
+    for i, version in enumerate(['11.7.0', '11.8.0', '11.9.0']):
+        store_dir = manifest_dir / f'store_{version}'
+        store_dir.mkdir()
+        manifest = {'version': version, 'store_dir': str(store_dir),
+                    'created_at': f'2026-01-0{i + 1}T00:00:00', 'changes': []}
+        (manifest_dir / f'delta_{version}_2026010{i + 1}_000000.json').write_text(json.dumps(manifest))
+
+    manifest_file, _ = apply_delta(str(package), str(panel), str(manifest_dir), '11.10.0')
+
+    # 应用时不清理，升级验证成功后才清理
+    assert len(list(manifest_dir.glob('delta_*.json'))) == 4
+
+    prune_manifests(str(manifest_dir))
+
+    remaining = sorted(p.name.split('_')[1] for p in manifest_dir.glob('delta_*.json'))
+    assert remaining == ['11.10.0', '11.8.0', '11.9.0']
+    assert os.path.exists(manifest_file)
+    assert not (manifest_dir / 'store_11.7.0').exists()
+
+
+def test_tree_manifest_records_and_verifies_symlinks(trees):
+    package, _, _ = trees
+    os.symlink('class/common.py', package / 'common_link.py')
+    os.symlink('class', package / 'class_link')
+    (package.parent / 'LinuxPanel.zip').write_bytes(b'zip')
+    package_md5 = panel_sync.file_md5(str(package.parent / 'LinuxPanel.zip'))
+    panel_sync.write_tree_manifest(str(package), package_md5)
+
+    entries = panel_sync.build_tree_manifest(str(package))
+    assert entries['common_link.py'] == ['link', 'class/common.py']
+    assert entries['class_link'] == ['link', 'class']
+    assert panel_sync.verify_tree_manifest(str(package), package_md5)[0]
+
+    # 扫描后把链接改指向扫描范围外的文件
+    os.remove(package / 'common_link.py')
+    os.symlink('/etc/passwd', package / 'common_link.py')
+    assert panel_sync.verify_tree_manifest(str(package), package_md5) == (False, '解压目录在扫描后被修改')
+
+
+def test_rollback_removes_created_directories(trees):
+    package, panel, manifest_dir = trees
+    write(package / 'class' / 'new_pkg' / 'sub' / 'mod.py', 'mod\n')
+    write(package / 'static' / 'js' / 'app.js', 'app\n')
+    original = read_tree(panel)
+
+    manifest_file, _ = apply_delta(str(package), str(panel), str(manifest_dir), '11.1.0')
+    with open(manifest_file, encoding='utf-8') as f:
+        assert json.load(f)['created_dirs'] == ['static', 'class/new_pkg', 'static/js', 'class/new_pkg/sub']
+
+    rollback_delta(manifest_file)
+    assert read_tree(panel) == original
+
+
+def test_applies_in_the_same_second_do_not_share_rollback_data(trees, monkeypatch):
+    package, panel, manifest_dir = trees
+    original = read_tree(panel)
+
+    class FrozenDatetime(panel_sync.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2026, 1, 1, 12, 0, 0)
+
+    monkeypatch.setattr(panel_sync, 'datetime', FrozenDatetime)
+    first, _ = apply_delta(str(package), str(panel), str(manifest_dir), '11.1.0')
+    after_first = read_tree(panel)
+    write(package / 'BTPanel.py', 'second\n')
+    second, _ = apply_delta(str(package), str(panel), str(manifest_dir), '11.1.0')
+
+    assert first != second
+    rollback_delta(second)
+    assert read_tree(panel) == after_first
+    rollback_delta(first)
+    assert read_tree(panel) == original
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+
+import report_index
+from report_index import ReportIndex
+from report_store import save_report
+
+
+def make_report(version, score, ai=None):
+    return {
+        'version': version,
+        'check_time': f'2026-10-0{version[-1]} 12:00:00',
+        'static_analysis': {
+            'security_score': score,
+            'is_safe': score >= 80,
+            'total_issues': 3,
+            'category_stats': {'backdoor': 1, 'sql': 2},
+            'findings': {'backdoor': [{'file': 'a.py'}]},
+        },
+        'ai_analysis': ai,
+    }
+
+
+def test_index_and_query_reports(tmp_path):
+    index = ReportIndex(str(tmp_path))
+    ai = {'provider': 'openai', 'average_score': 90, 'analyzed_files': 2,
+          'usage': {'total_tokens': 1200, 'total_cost': 0.5}}
+    for version, score, ai_result in (('11.0.1', 70, None), ('11.0.2', 90, ai)):
+        report = make_report(version, score, ai_result)
+        index.index_report(save_report(str(tmp_path), report, 'none'), report)
+
+    reports = index.get_reports()
+    assert [r['version'] for r in reports] == ['11.0.1', '11.0.2']
+    assert index.get_latest_report()['static_score'] == 90
+    assert index.get_summary()['total_reports'] == 2
+
+    latest = index.get_report(reports[-1]['file_path'])
+    assert latest['category_stats'] == {'backdoor': 1, 'sql': 2}
+    assert latest['ai_usage']['total_tokens'] == 1200
+    assert index.get_ai_usage()[0]['provider'] == 'openai'
+
+
+def test_sync_adds_and_removes_reports(tmp_path):
+    index = ReportIndex(str(tmp_path))
+    result_file = save_report(str(tmp_path), make_report('11.0.3', 85), 'none')
+
+    index.sync(force=True)
+    assert [r['version'] for r in index.get_reports()] == ['11.0.3']
+
+    os.remove(result_file)
+    index.sync(force=True)
+    assert index.get_reports() == []
+
+
+def test_connections_are_closed(tmp_path, monkeypatch):
+    opened = []
+    real_connect = sqlite3.connect
+
+    def tracking_connect(*args, **kwargs):
+        conn = real_connect(*args, **kwargs)
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(report_index.sqlite3, 'connect', tracking_connect)
+    index = ReportIndex(str(tmp_path))
+    report = make_report('11.0.4', 80)
+    index.index_report(save_report(str(tmp_path), report, 'none'), report)
+    index.get_reports()
+    index.get_summary()
+
+    assert opened
+    for conn in opened:
+        try:
+            conn.execute('SELECT 1')
+        except sqlite3.ProgrammingError:
+            continue
+        raise AssertionError('连接未关闭')
@@ -0,0 +1,71 @@
+import gzip
+import json
+import os
+
+import pytest
+
+import report_store
+from report_store import findings_path, load_report, load_summary, report_path, save_report
+
+REPORT = {
+    'version': '11.2.0',
+    'md5': 'abc',
+    'basic_check': {'file_size': 10, 'suspicious_files': ['x.sh']},
+    'static_analysis': {
+        'security_score': 88,
+        'category_stats': {'backdoor_critical': 1},
+        'findings': {'backdoor_critical': [{'file': 'class/a.py', 'sample': 'eval(x)'}]},
+        'files_to_remove': ['class/a.py'],
+    },
+    'ai_analysis': {'average_score': 90, 'findings': [{'description': 'eval'}]},
+}
+
+
+@pytest.mark.parametrize('compression', ['none', 'gzip'])
+def test_report_is_stored_as_summary_and_findings(tmp_path, compression):
+    result_file = save_report(str(tmp_path), REPORT, compression)
+
+    assert result_file == report_path(str(tmp_path), '11.2.0')
+    assert sorted(os.listdir(tmp_path)) == sorted([
+        'security_report_11.2.0.json',
+        os.path.basename(findings_path(str(tmp_path), '11.2.0', compression))])
+
+    summary = load_summary(result_file)
+    assert summary['static_analysis'] == {'security_score': 88, 'category_stats': {'backdoor_critical': 1}}
+    assert 'findings' not in summary['ai_analysis']
+    assert 'suspicious_files' not in summary['basic_check']
+
+    assert {k: v for k, v in load_report(result_file).items() if k != 'findings_file'} == REPORT
+
+
+def test_switching_compression_removes_stale_findings(tmp_path):
+    save_report(str(tmp_path), REPORT, 'none')
+    save_report(str(tmp_path), REPORT, 'gzip')
+
+    assert not os.path.exists(findings_path(str(tmp_path), '11.2.0', 'none'))
+    with gzip.open(findings_path(str(tmp_path), '11.2.0', 'gzip'), 'rt', encoding='utf-8') as f:
+        assert json.load(f)['static_analysis']['files_to_remove'] == ['class/a.py']
+
+
+def test_legacy_report_with_embedded_findings(tmp_path):
+    result_file = report_path(str(tmp_path), '11.1.0')
+    with open(result_file, 'w', encoding='utf-8') as f:
+        json.dump(dict(REPORT, version='11.1.0'), f)
+
+    assert 'findings' not in load_summary(result_file)['static_analysis']
+    assert load_report(result_file)['static_analysis']['findings'] == REPORT['static_analysis']['findings']
+
+
+def test_failed_write_keeps_previous_report(tmp_path, monkeypatch):
+    result_file = save_report(str(tmp_path), REPORT, 'none')
+
+    def broken_dumps(*args, **kwargs):
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(report_store.json, 'dumps', broken_dumps)
+    with pytest.raises(RuntimeError):
+        save_report(str(tmp_path), dict(REPORT, md5='new'), 'none')
+    monkeypatch.undo()
+
+    assert load_summary(result_file)['md5'] == 'abc'
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from secure_config import SecureConfig
+
+
+def write_config(path, config):
+    path.write_text(json.dumps(config), encoding='utf-8')
+
+
+def test_get_config_is_shared_until_file_changes(tmp_path):
+    config_file = tmp_path / 'config.json'
+    write_config(config_file, {'security_threshold': 80})
+    changes = []
+
+    def on_change(old, new):
+        changes.append((old['security_threshold'], new['security_threshold']))
+
+    SecureConfig.subscribe(on_change)
+    try:
+        first = SecureConfig(str(config_file)).get_config()
+        assert SecureConfig(str(config_file)).get_config() is first
+
+        write_config(config_file, {'security_threshold': 90})
+        assert SecureConfig(str(config_file)).get_config()['security_threshold'] == 90
+    finally:
+        SecureConfig.unsubscribe(on_change)
+
+    assert changes == [(80, 90)]
+
+
+def test_load_config_returns_editable_copy(tmp_path):
+    config_file = tmp_path / 'config.json'
+    write_config(config_file, {'scheduler': {'enabled': True}})
+    secure_config = SecureConfig(str(config_file))
+
+    editable = secure_config.load_config()
+    editable['scheduler']['enabled'] = False
+
+    assert secure_config.get_config()['scheduler']['enabled'] is True
+
+
+def test_engines_read_current_config(tmp_path):
+    pytest.importorskip('requests')
+    from alert_rules import AlertRulesEngine
+
+    config_file = tmp_path / 'config.json'
+    write_config(config_file, {'security_threshold': 80, 'notifications': {}})
+    engine = AlertRulesEngine(str(config_file))
+    assert engine.config['security_threshold'] == 80
+
+    write_config(config_file, {'security_threshold': 95, 'notifications': {'bark': {'enabled': True}}})
+
+    assert engine.config['security_threshold'] == 95
+    assert engine.notif_manager.notification_config == {'bark': {'enabled': True}}
+
+
+def test_save_config_notifies_subscribers_immediately(tmp_path):
+    config_file = tmp_path / 'config.json'
+    write_config(config_file, {'scheduler': {'enabled': True, 'interval_hours': 1}})
+    secure_config = SecureConfig(str(config_file))
+    secure_config.get_config()
+    changes = []
+
+    def on_change(old, new):
+        changes.append(new['scheduler'])
+
+    SecureConfig.subscribe(on_change)
+    try:
+        config = secure_config.load_config()
+        config['scheduler']['interval_hours'] = 6
+        secure_config.save_config(config)
+    finally:
+        SecureConfig.unsubscribe(on_change)
+
+    assert changes == [{'enabled': True, 'interval_hours': 6}]
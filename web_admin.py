@@ -5,21 +5,25 @@ BTAUTOCHECK Web管理系统
 完整的Web管理界面
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file, Response, stream_with_context
 from functools import wraps
 import os
 import json
 import hashlib
 import subprocess
-import glob
 import re
 import logging
+import threading
+import time
 from datetime import datetime
 from secure_config import SecureConfig
-from backup_manager import BackupManager
+from config_store import ConfigConflictError, REVISION_KEY
+from backup_manager import BackupManager, load_backup_options
 from notification import NotificationManager
 from analytics import AnalyticsEngine
 from alert_rules import AlertRulesEngine
+from log_reader import tail_lines, read_range, DEFAULT_RANGE_BYTES
+from check_jobs import CheckJobQueue, format_sse
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from werkzeug.security import safe_join
@@ -86,6 +90,17 @@ audit_handler.setFormatter(logging.Formatter(
 audit_logger.addHandler(audit_handler)
 audit_logger.setLevel(logging.INFO)
 
+# 检测任务队列（单飞执行，与cron共用进程间锁，并推送进度；执行线程在启动服务时开启）
+check_jobs = CheckJobQueue()
+
+# 进度推送（SSE）每个连接占用一个waitress工作线程：限制同时连接数，
+# 连接到期后断开，浏览器在 SSE_RETRY_MS 后带 Last-Event-ID 重连续传；
+# 连接数已满时返回503，页面改为轮询 /check/status?since=<seq>
+SSE_MAX_STREAMS = 2
+SSE_MAX_LIFETIME = 30
+SSE_RETRY_MS = 3000
+sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
 # 初始化调度器
 scheduler = BackgroundScheduler(daemon=True)
 scheduler.start()
@@ -232,19 +247,14 @@ def change_password():
 @login_required
 def dashboard():
     """仪表板"""
-    # 读取配置
-    secure_config = SecureConfig()
-    config = secure_config.load_config()
-    
-    # 确保scheduler字段存在
-    if 'scheduler' not in config:
-        config['scheduler'] = {'enabled': True, 'interval_hours': 1}
+    # 读取配置（只读，使用共享缓存）
+    config = SecureConfig().get_config()
     
     # 统计信息
     stats = {
         'current_version': config.get('current_version', 'Unknown'),
         'security_threshold': config.get('security_threshold', 80),
-        'backup_count': len(BackupManager().list_backups()),
+        'backup_count': get_backup_count(),
         'notification_enabled': config.get('notification_enabled', False)
     }
     
@@ -337,16 +347,19 @@ def config_management():
             if sendkey:
                 config['notifications']['serverchan']['sendkey'] = sendkey
         
-        # 保存配置
-        with open('config.json', 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=4, ensure_ascii=False)
+        # 保存配置（原子写入并保持敏感字段加密；页面打开后配置被修改过则拒绝覆盖）
+        config[REVISION_KEY] = request.form.get('config_revision', config.get(REVISION_KEY, 0), type=int)
+        try:
+            secure_config.save_config(config)
+        except ConfigConflictError as e:
+            return jsonify({'success': False, 'message': str(e)}), 409
         
-        # 如果调度器配置有变化，重新初始化
-        init_scheduler()
+        # 调度配置有变化时由 on_config_change 重新加载调度器
         
         return jsonify({'success': True, 'message': '配置已保存，调度器已更新'})
     
-    config = secure_config.load_config()
+    # 只补充顶层默认字段，浅复制即可（不修改共享缓存）
+    config = dict(secure_config.get_config())
     
     # 确保所有必需的字段都存在（避免模板渲染错误）
     if 'scheduler' not in config:
@@ -383,7 +396,7 @@ def backup_create():
     version = request.form.get('version', 'manual')
     description = request.form.get('description', '手动备份')
     
-    manager = BackupManager()
+    manager = BackupManager(options=load_backup_options())
     result = manager.create_backup(version, description)
     
     if result:
@@ -397,7 +410,10 @@ def backup_create():
 @audit_log('恢复备份')
 def backup_restore(filepath):
     """恢复备份"""
-    manager = BackupManager()
+    manager = BackupManager(options=load_backup_options())
+    filepath, error = resolve_backup_path(manager, filepath)
+    if error:
+        return error
     result = manager.restore_backup(filepath)
     
     if result:
@@ -405,12 +421,48 @@ def backup_restore(filepath):
     else:
         return jsonify({'success': False, 'message': '备份恢复失败'})
 
+@app.route('/backup/verify/<path:filepath>', methods=['POST'])
+@login_required
+@limiter.limit("30 per hour")
+@audit_log('校验备份')
+def backup_verify(filepath):
+    """校验备份（sample=1 时抽样校验）"""
+    sample = request.form.get('sample', request.args.get('sample', '0')) in ('1', 'true', 'on')
+    manager = BackupManager(options=load_backup_options())
+    filepath, error = resolve_backup_path(manager, filepath)
+    if error:
+        return error
+    if manager.verify_backup(filepath, sample=sample):
+        return jsonify({'success': True, 'message': '抽样校验通过' if sample else '备份校验通过'})
+    return jsonify({'success': False, 'message': '备份校验失败'})
+
+def resolve_backup_path(manager, filepath):
+    """
+    校验备份路径：解析符号链接后必须位于备份目录内，或是已登记的快照目录（快照放在面板目录旁）
+    
+    Returns:
+        (备份路径, 错误响应)，校验通过时错误响应为None
+    """
+    real_path = os.path.realpath(filepath)
+    backup_root = os.path.realpath(manager.backup_path)
+    if os.path.commonpath([real_path, backup_root]) == backup_root:
+        return filepath, None
+    
+    for backup in manager.list_backups():
+        if backup.get('type') == 'snapshot' and os.path.realpath(backup['filepath']) == real_path:
+            return backup['filepath'], None
+    
+    audit_logger.critical(f"User:{session.get('username')} IP:{request.remote_addr} 尝试访问备份目录外的文件: {filepath}")
+    return None, (jsonify({'success': False, 'message': '非法访问'}), 403)
+
 @app.route('/reports')
 @login_required
 def report_list():
     """报告列表"""
-    reports = get_all_reports()
-    return render_template('reports.html', reports=reports)
+    reports, pagination = paginate(get_all_reports(),
+                                   request.args.get('page', 1, type=int),
+                                   request.args.get('per_page', 20, type=int))
+    return render_template('reports.html', reports=reports, pagination=pagination)
 
 @app.route('/report/view/<filename>')
 @login_required
@@ -453,70 +505,157 @@ def report_view(filename):
         audit_logger.critical(f"User:{session.get('username')} IP:{request.remote_addr} 尝试访问downloads外的文件: {filepath}")
         return "非法访问", 403
     
+    # 已预渲染HTML时只返回页面框架，报告主体和分类由前端按需加载（可缓存）
+    html_dir = get_report_html_dir(filepath)
+    if html_dir:
+        version = os.path.basename(html_dir)[len('SECURITY_REPORT_'):-len('_html')]
+        return render_template('report_view.html', filename=filename, content=None, version=version)
+    
     try:
         with open(filepath, 'r', encoding='utf-8') as f:
             content = f.read()
-        return render_template('report_view.html', filename=filename, content=content)
+        return render_template('report_view.html', filename=filename, content=content, version=None)
     except Exception as e:
         audit_logger.error(f"读取报告失败 {filepath}: {e}")
         return "报告读取失败", 500
 
+def get_report_html_dir(report_path):
+    """获取报告的预渲染HTML目录（不存在或比Markdown旧时返回None）"""
+    match = re.match(r'^[A-Z_a-z]+_REPORT_([\d.]+)\.md$', os.path.basename(report_path), re.IGNORECASE)
+    if not match:
+        return None
+    html_dir = os.path.join(os.path.dirname(report_path), f'SECURITY_REPORT_{match.group(1)}_html')
+    index_file = os.path.join(html_dir, 'index.html')
+    try:
+        if os.path.getmtime(index_file) >= os.path.getmtime(report_path):
+            return html_dir
+    except OSError:
+        pass
+    return None
+
+@app.route('/report/raw/<filename>')
+@login_required
+def report_raw(filename):
+    """返回报告Markdown原文（支持ETag/Last-Modified）"""
+    if not re.match(r'^[A-Z_a-z]+_REPORT_[\d.]+\.md$', filename, re.IGNORECASE):
+        return "非法文件名", 400
+    
+    filepath = safe_join('downloads', filename)
+    if filepath is None or not os.path.exists(filepath):
+        return "报告不存在", 404
+    
+    response = send_file(filepath, mimetype='text/plain; charset=utf-8', conditional=True, etag=True, max_age=0)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/report/html/<version>/<section>')
+@login_required
+@limiter.limit("600 per hour")  # 查看报告时会按需加载多个分类
+def report_html_section(version, section):
+    """返回预渲染的报告主体或分类片段（支持ETag/Last-Modified和gzip）"""
+    if not re.match(r'^[\d.]+$', version) or not re.match(r'^[a-z_]+$', section):
+        return "非法参数", 400
+    
+    html_dir = safe_join('downloads', f'SECURITY_REPORT_{version}_html')
+    filepath = safe_join(html_dir, f'{section}.html') if html_dir else None
+    if filepath is None or not os.path.exists(filepath):
+        return "报告不存在", 404
+    
+    # 优先返回生成时写好的gzip副本
+    gzip_path = filepath + '.gz'
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '') and os.path.exists(gzip_path)
+    response = send_file(gzip_path if use_gzip else filepath, mimetype='text/html',
+                         conditional=True, etag=True, max_age=0)
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @app.route('/logs')
 @login_required
 def log_viewer():
     """日志查看器"""
-    logs = get_all_logs()
-    return render_template('logs.html', logs=logs)
+    logs, pagination = paginate(get_all_logs(),
+                                request.args.get('page', 1, type=int),
+                                request.args.get('per_page', 20, type=int))
+    return render_template('logs.html', logs=logs, pagination=pagination)
 
-@app.route('/logs/view/<filename>')
-@login_required
-@audit_log('查看日志')
-def log_view(filename):
-    """查看日志（安全版本）"""
+def resolve_log_path(filename):
+    """
+    校验日志文件名并返回路径
+    
+    Returns:
+        (文件路径, None) 或 (None, 错误响应)
+    """
     # 严格验证文件名格式（只允许auto_check_*.log和audit.log）
     if not re.match(r'^(auto_check_\d{8}\.log|audit\.log)$', filename):
         audit_logger.warning(f"User:{session.get('username')} IP:{request.remote_addr} 尝试访问非法日志文件: {filename}")
-        return jsonify({'success': False, 'message': '非法文件名'}), 400
+        return None, (jsonify({'success': False, 'message': '非法文件名'}), 400)
     
     # 防止路径遍历
     if '..' in filename or '/' in filename or '\\' in filename:
         audit_logger.warning(f"User:{session.get('username')} IP:{request.remote_addr} 日志路径遍历尝试: {filename}")
-        return jsonify({'success': False, 'message': '非法文件名'}), 400
+        return None, (jsonify({'success': False, 'message': '非法文件名'}), 400)
     
     # 安全路径拼接
     try:
         filepath = safe_join('logs', filename)
     except Exception as e:
         audit_logger.error(f"路径拼接失败: {e}")
-        return jsonify({'success': False, 'message': '非法路径'}), 400
+        return None, (jsonify({'success': False, 'message': '非法路径'}), 400)
     
     if filepath is None or not os.path.exists(filepath):
-        return jsonify({'success': False, 'message': '日志不存在'}), 404
-    
-    # 限制文件大小
-    max_size = 5 * 1024 * 1024  # 5MB
-    try:
-        file_size = os.path.getsize(filepath)
-        if file_size > max_size:
-            audit_logger.warning(f"日志文件过大: {filepath} ({file_size} bytes)")
-            return jsonify({'success': False, 'message': '日志文件过大'}), 413
-    except Exception as e:
-        audit_logger.error(f"获取文件大小失败: {e}")
-        return jsonify({'success': False, 'message': '文件读取失败'}), 500
+        return None, (jsonify({'success': False, 'message': '日志不存在'}), 404)
     
     # 确保文件在logs目录内
     if not os.path.abspath(filepath).startswith(os.path.abspath('logs')):
         audit_logger.critical(f"User:{session.get('username')} IP:{request.remote_addr} 尝试访问logs外的文件: {filepath}")
-        return jsonify({'success': False, 'message': '非法访问'}), 403
+        return None, (jsonify({'success': False, 'message': '非法访问'}), 403)
     
+    return filepath, None
+
+def read_log_response(filepath, **kwargs):
+    """按范围读取日志并返回JSON响应（每次最多1MB）"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return jsonify({'success': True, 'content': content})
+        chunk = read_range(filepath, limit=request.args.get('limit', DEFAULT_RANGE_BYTES, type=int), **kwargs)
+        return jsonify(dict(chunk, success=True))
     except Exception as e:
         audit_logger.error(f"读取日志失败 {filepath}: {e}")
         return jsonify({'success': False, 'message': '日志读取失败'}), 500
 
+@app.route('/logs/view/<filename>')
+@login_required
+@limiter.limit("300 per hour")  # 向前翻页时会连续请求
+@audit_log('查看日志')
+def log_view(filename):
+    """
+    查看日志（安全版本）
+    
+    ?before=<start> 向前翻页，不传时返回文件末尾
+    """
+    filepath, error = resolve_log_path(filename)
+    if error:
+        return error
+    return read_log_response(filepath, before=request.args.get('before', type=int))
+
+@app.route('/logs/follow/<filename>')
+@login_required
+@limiter.limit("30 per minute")  # 跟踪模式每5秒拉取一次
+def log_follow(filename):
+    """
+    读取上次位置之后追加的日志（跟踪运行中的检测）
+    
+    ?offset=<end> 为上次返回的 end；打开日志时已记录审计日志，定时拉取不再记录
+    """
+    filepath, error = resolve_log_path(filename)
+    if error:
+        return error
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'success': False, 'message': '缺少offset参数'}), 400
+    return read_log_response(filepath, offset=offset)
+
 @app.route('/check/run', methods=['POST'])
 @login_required
 @limiter.limit("5 per hour")  # 速率限制：每小时最多5次
@@ -524,14 +663,110 @@ def log_view(filename):
 def run_check():
     """手动触发检测"""
     try:
-        # 在后台运行检测
-        subprocess.Popen(['python3', 'auto_update.py'], 
-                        stdout=subprocess.PIPE, 
-                        stderr=subprocess.PIPE)
-        return jsonify({'success': True, 'message': '检测已开始，请稍后查看结果'})
+        # 加入检测队列，已有检测排队或运行时合并到该任务
+        record, coalesced = check_jobs.submit(trigger='manual')
+        return jsonify(_job_response(record, coalesced))
     except Exception as e:
         return jsonify({'success': False, 'message': f'启动失败: {str(e)}'})
 
+def _job_response(record, coalesced):
+    """提交检测后的响应（其它进程运行的任务无法推送进度）"""
+    job = check_jobs.get(record['id'])
+    if coalesced:
+        message = '已有检测任务在运行或排队，本次请求已合并'
+    else:
+        message = '检测已加入队列'
+    return {
+        'success': True,
+        'message': message,
+        'job_id': record['id'],
+        'coalesced': coalesced,
+        'events_url': url_for('check_events', job_id=record['id']) if job else None,
+        'status_url': url_for('check_status', job_id=record['id']) if job else None
+    }
+
+@app.route('/check/events/<job_id>')
+@login_required
+@limiter.limit("300 per hour")
+def check_events(job_id):
+    """
+    以Server-Sent Events推送检测进度（支持 Last-Event-ID 断线续传）
+    
+    每个连接最多保持 SSE_MAX_LIFETIME 秒，同时最多 SSE_MAX_STREAMS 个连接，
+    超出时返回503，由页面改为轮询 check_status。
+    """
+    job = check_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    
+    if not sse_slots.acquire(blocking=False):
+        return jsonify({'success': False, 'message': '进度推送连接数已满，请轮询任务状态',
+                        'status_url': url_for('check_status', job_id=job_id)}), 503, \
+            {'Retry-After': str(SSE_MAX_LIFETIME)}
+    
+    last_seq = request.headers.get('Last-Event-ID', type=int) or request.args.get('since', 0, type=int)
+    deadline = time.monotonic() + SSE_MAX_LIFETIME
+    
+    def stream():
+        seq = last_seq
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                # 到期断开，浏览器重连时带上最后的事件序号
+                break
+            events = job.events_since(seq, timeout=min(15, left))
+            if not events:
+                if job.finished:
+                    break
+                yield ": keepalive\n\n"
+                continue
+            for event in events:
+                seq = event['seq']
+                yield format_sse(event)
+            if job.finished and seq >= job.last_seq:
+                break
+    
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # 服务器关闭响应（正常结束或客户端断开）时归还连接名额
+    response.call_on_close(sse_slots.release)
+    return response
+
+@app.route('/check/status/<job_id>')
+@login_required
+def check_status(job_id):
+    """
+    查询检测任务状态
+    
+    ?since=<seq> 同时返回该序号之后仍在环形缓冲区中的事件（进度推送连接数已满时轮询使用）
+    """
+    job = check_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '任务不存在'}), 404
+    response = {'success': True, 'job': job.to_dict()}
+    since = request.args.get('since', type=int)
+    if since is not None:
+        response['events'] = job.events_since(since, timeout=0)
+    return jsonify(response)
+
+@app.route('/check/cancel/<job_id>', methods=['POST'])
+@login_required
+@limiter.limit("20 per hour")
+@audit_log('取消检测')
+def check_cancel(job_id):
+    """取消排队中或运行中的检测任务"""
+    if check_jobs.cancel(job_id):
+        return jsonify({'success': True, 'message': '检测任务已取消'})
+    return jsonify({'success': False, 'message': '任务不存在或已结束'}), 404
+
+@app.route('/check/history')
+@login_required
+@limiter.limit("300 per hour")
+def check_history():
+    """检测队列状态与运行历史（含耗时、合并的触发次数）"""
+    return jsonify(dict(check_jobs.status(), success=True))
+
 @app.route('/notification/test', methods=['POST'])
 @login_required
 @limiter.limit("20 per hour")
@@ -593,17 +828,13 @@ def process_user_input(data):
 @login_required
 def api_stats():
     """API：统计数据"""
-    secure_config = SecureConfig()
-    config = secure_config.load_config()
+    config = SecureConfig().get_config()
     
-    # 获取检测历史
-    reports = get_all_reports()
-    
-    # 构建统计数据
+    # 构建统计数据（目录列表和备份数量均有缓存）
     stats = {
         'current_version': config.get('current_version', 'Unknown'),
-        'total_reports': len(reports),
-        'total_backups': len(BackupManager().list_backups()),
+        'total_reports': len(reports_listing.get()),
+        'total_backups': get_backup_count(),
         'last_check': get_last_check_time(),
         'security_threshold': config.get('security_threshold', 80)
     }
@@ -667,31 +898,101 @@ def get_recent_reports(limit=5):
     all_reports = get_all_reports()
     return all_reports[:limit]
 
+class DirectoryListingCache:
+    """
+    目录列表缓存
+    
+    目录修改时间不变时直接返回缓存的列表（新建/删除/重命名文件都会更新目录
+    修改时间），只重新stat最新的一个文件，以反映正在追加写入的日志或原地覆盖的报告。
+    """
+    
+    def __init__(self, directory, pattern):
+        self.directory = directory
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.lock = threading.Lock()
+        self.dir_mtime = None
+        self.entries = []
+    
+    def get(self):
+        """返回文件列表（按修改时间倒序）：[{'filename', 'path', 'size', 'mtime_ts'}]"""
+        with self.lock:
+            try:
+                dir_mtime = os.stat(self.directory).st_mtime_ns
+            except OSError:
+                self.dir_mtime = None
+                self.entries = []
+                return []
+            
+            if dir_mtime != self.dir_mtime:
+                entries = []
+                with os.scandir(self.directory) as it:
+                    for entry in it:
+                        if entry.is_file() and self.pattern.match(entry.name):
+                            st = entry.stat()
+                            entries.append({'filename': entry.name, 'path': entry.path,
+                                            'size': st.st_size, 'mtime_ts': st.st_mtime})
+                entries.sort(key=lambda e: e['mtime_ts'], reverse=True)
+                self.entries = entries
+                self.dir_mtime = dir_mtime
+            elif self.entries:
+                newest = self.entries[0]
+                try:
+                    st = os.stat(newest['path'])
+                    self.entries[0] = dict(newest, size=st.st_size, mtime_ts=st.st_mtime)
+                except OSError:
+                    self.dir_mtime = None
+            
+            return list(self.entries)
+
+reports_listing = DirectoryListingCache('downloads', r'^security_report_.*\.md$')
+logs_listing = DirectoryListingCache('logs', r'^auto_check_.*\.log$')
+_backup_count_cache = {'mtime': None, 'count': 0}
+_backup_count_lock = threading.Lock()
+
+def paginate(items, page, per_page):
+    """
+    对列表分页
+    
+    Returns:
+        (当前页条目, 分页信息字典)
+    """
+    per_page = max(1, min(per_page, 200))
+    total = len(items)
+    pages = max(1, (total + per_page - 1) // per_page)
+    page = max(1, min(page, pages))
+    start = (page - 1) * per_page
+    return items[start:start + per_page], {
+        'page': page,
+        'per_page': per_page,
+        'pages': pages,
+        'total': total
+    }
+
+def get_backup_count():
+    """获取备份数量（backup_info.json 未变化时不重复解析）"""
+    backup_info_file = os.path.join('backups', 'backup_info.json')
+    try:
+        mtime = os.path.getmtime(backup_info_file)
+    except OSError:
+        return 0
+    
+    with _backup_count_lock:
+        if _backup_count_cache['mtime'] != mtime:
+            _backup_count_cache['count'] = len(BackupManager().list_backups())
+            _backup_count_cache['mtime'] = mtime
+        return _backup_count_cache['count']
+
 def get_all_reports():
     """获取所有报告"""
     reports = []
-    # 使用不区分大小写的模式匹配
-    patterns = [
-        'downloads/SECURITY_REPORT_*.md',
-        'downloads/Security_Report_*.md',
-        'downloads/security_report_*.md'
-    ]
-    
-    files_set = set()
-    for pattern in patterns:
-        files_set.update(glob.glob(pattern))
-    
-    files = list(files_set)
-    files.sort(key=os.path.getmtime, reverse=True)
-    
-    for filepath in files:
-        filename = os.path.basename(filepath)
-        version = filename.replace('SECURITY_REPORT_', '').replace('Security_Report_', '').replace('security_report_', '').replace('.md', '')
+    for entry in reports_listing.get():
+        filename = entry['filename']
+        version = re.sub(r'^security_report_', '', filename, flags=re.IGNORECASE).replace('.md', '')
         reports.append({
             'filename': filename,
             'version': version,
-            'size': os.path.getsize(filepath),
-            'mtime': datetime.fromtimestamp(os.path.getmtime(filepath)).strftime('%Y-%m-%d %H:%M:%S')
+            'size': entry['size'],
+            'mtime': datetime.fromtimestamp(entry['mtime_ts']).strftime('%Y-%m-%d %H:%M:%S')
         })
     
     return reports
@@ -703,41 +1004,30 @@ def get_recent_logs(limit=10):
     log_file = f'logs/auto_check_{today}.log'
     
     if os.path.exists(log_file):
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-            logs = [line.strip() for line in lines[-limit:]]
+        logs = tail_lines(log_file, limit)
     
     return logs
 
 def get_all_logs():
     """获取所有日志文件"""
-    logs = []
-    pattern = 'logs/auto_check_*.log'
-    files = glob.glob(pattern)
-    files.sort(key=os.path.getmtime, reverse=True)
-    
-    for filepath in files:
-        filename = os.path.basename(filepath)
-        logs.append({
-            'filename': filename,
-            'size': os.path.getsize(filepath),
-            'mtime': datetime.fromtimestamp(os.path.getmtime(filepath)).strftime('%Y-%m-%d %H:%M:%S')
-        })
-    
-    return logs
+    return [{
+        'filename': entry['filename'],
+        'size': entry['size'],
+        'mtime': datetime.fromtimestamp(entry['mtime_ts']).strftime('%Y-%m-%d %H:%M:%S')
+    } for entry in logs_listing.get()]
 
 def get_last_check_time():
     """获取最后检测时间"""
-    logs = get_all_logs()
+    logs = logs_listing.get()
     if logs:
-        return logs[0]['mtime']
+        return datetime.fromtimestamp(logs[0]['mtime_ts']).strftime('%Y-%m-%d %H:%M:%S')
     return 'Never'
 
 # ========================================
 # 自动检测调度器功能
 # ========================================
 
-def run_auto_check():
+def run_auto_check(trigger='scheduler'):
     """执行自动检测任务"""
     try:
         print(f"\n{'='*70}")
@@ -745,21 +1035,20 @@ def run_auto_check():
         print(f"⏰ 触发时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
         print(f"{'='*70}\n")
         
-        # 运行auto_update.py
-        result = subprocess.run(
-            ['python3', 'auto_update.py'],
-            capture_output=True,
-            text=True,
-            cwd=os.path.dirname(__file__) or '.'
-        )
+        # 加入检测队列并等待执行完成（已有检测时合并，不重复运行）
+        record, coalesced = check_jobs.submit(trigger=trigger)
+        job = check_jobs.get(record['id'])
+        if coalesced:
+            print(f"ℹ️  已有检测任务 {record['id']}，本次触发已合并")
+        returncode = job.wait() if job else None
         
         print(f"\n{'='*70}")
         print(f"✅ 定时自动检测完成")
         print(f"⏰ 完成时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print(f"📊 退出码: {result.returncode}")
+        print(f"📊 退出码: {returncode}")
         print(f"{'='*70}\n")
         
-        return result.returncode == 0
+        return returncode == 0
     except Exception as e:
         print(f"❌ 定时检测失败: {e}")
         return False
@@ -767,8 +1056,7 @@ def run_auto_check():
 def init_scheduler():
     """初始化调度器"""
     try:
-        secure_config = SecureConfig()
-        config = secure_config.load_config()
+        config = SecureConfig().get_config()
         
         scheduler_config = config.get('scheduler', {})
         enabled = scheduler_config.get('enabled', True)
@@ -794,13 +1082,18 @@ def init_scheduler():
     except Exception as e:
         print(f"❌ 调度器初始化失败: {e}")
 
+def on_config_change(old_config, new_config):
+    """配置文件变化时（包括其它进程或命令行修改）按需重新加载调度器"""
+    if (old_config or {}).get('scheduler') != new_config.get('scheduler'):
+        print("🔄 检测到调度配置变化，重新加载调度器")
+        init_scheduler()
+
 @app.route('/scheduler/status')
 @login_required
 def scheduler_status():
     """获取调度器状态"""
     try:
-        secure_config = SecureConfig()
-        config = secure_config.load_config()
+        config = SecureConfig().get_config()
         scheduler_config = config.get('scheduler', {})
         
         jobs = []
@@ -842,11 +1135,9 @@ def scheduler_toggle():
         config['scheduler']['enabled'] = enabled
         config['scheduler']['interval_hours'] = interval_hours
         
+        # 保存后由 on_config_change 重新加载调度器
         secure_config.save_config(config)
         
-        # 重新初始化调度器
-        init_scheduler()
-        
         return jsonify({'success': True, 'message': '调度器配置已更新'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
@@ -858,13 +1149,8 @@ def scheduler_toggle():
 def scheduler_run_now():
     """立即执行检测"""
     try:
-        # 在后台线程中执行
-        import threading
-        thread = threading.Thread(target=run_auto_check)
-        thread.daemon = True
-        thread.start()
-        
-        return jsonify({'success': True, 'message': '检测任务已启动，请稍后查看报告和日志'})
+        record, coalesced = check_jobs.submit(trigger='run_now')
+        return jsonify(_job_response(record, coalesced))
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)})
 
@@ -875,8 +1161,7 @@ def scheduler_run_now():
 def upload_to_github():
     """手动上传报告到GitHub"""
     try:
-        secure_config = SecureConfig()
-        config = secure_config.load_config()
+        config = SecureConfig().get_config()
         
         # 检查GitHub配置
         if not config.get('github_username') or not config.get('github_repo') or not config.get('github_token'):
@@ -958,14 +1243,17 @@ def alert_rules_config():
             'end': request.form.get('silent_end', '08:00')
         }
         
-        # 保存配置
-        with open('config.json', 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=4, ensure_ascii=False)
+        # 保存配置（原子写入并保持敏感字段加密；页面打开后配置被修改过则拒绝覆盖）
+        config[REVISION_KEY] = request.form.get('config_revision', config.get(REVISION_KEY, 0), type=int)
+        try:
+            secure_config.save_config(config)
+        except ConfigConflictError as e:
+            return jsonify({'success': False, 'message': str(e)}), 409
         
         return jsonify({'success': True, 'message': '告警规则已保存'})
     
-    # GET请求：显示配置页面
-    config = secure_config.load_config()
+    # GET请求：显示配置页面（只补充顶层默认字段，浅复制即可）
+    config = dict(secure_config.get_config())
     
     # 确保alert_rules存在
     if 'alert_rules' not in config:
@@ -1008,8 +1296,12 @@ if __name__ == '__main__':
     os.makedirs('downloads', exist_ok=True)
     os.makedirs('backups', exist_ok=True)
     
-    # 初始化调度器
+    # 启动检测任务执行线程（只在服务进程中启动一次，导入模块时不启动）
+    check_jobs.start_worker()
+    
+    # 初始化调度器，并在配置变化时自动重新加载
     init_scheduler()
+    SecureConfig.subscribe(on_config_change)
     
     # 启动Web服务器
     print("=" * 70)